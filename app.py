@@ -1,30 +1,58 @@
-from flask import Flask, request, send_file, render_template, jsonify
+from flask import Flask, Response, request, send_file, render_template, jsonify, stream_with_context
 import os
 from werkzeug.utils import secure_filename
-from PyPDF2 import PdfReader, PdfWriter
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
+from PyPDF2 import PdfReader
 import io
-import subprocess
 import tempfile
 import shutil
 import json
 import time
-from threading import Thread
 import uuid
 
+from batches import batch_status, expand_uploads, stream_batch_zip
+from checkpoints import open_checkpoint
+from chunk_planner import get_cost_model, plan_document_chunks
+from cpu_budget import get_cpu_budget, job_cpu_limit, split_cores
+from job_events import get_stream_limiter, job_event_stream
+from job_store import create_job_store
+from lang_detect import detect_languages
+from memory_budget import chunk_peak_bytes, get_memory_budget
+from metrics import StageTimer, get_metrics, job_gauges, record_job
+from ocr_cache import get_cache
+from ocr_engine import run_ocr
+from ocr_pipeline import run_chunks
+from pdf_tools import (
+    PAGE_TEXT, PageAssembler, assemble_pages, classify_pages, format_page_ranges, page_fingerprints,
+    page_sources, parse_page_ranges, quick_page_count,
+)
+from preprocess import get_profile, needs_deskew, plugin_options
+from retention import start_sweeper, touch
+from scheduler import LANES, QueueFull, create_scheduler, job_lane
+from text_extract import (
+    TEXT_FORMATS, extract_pages, follow_file, format_page, text_layer_blocks, text_layer_page,
+)
+from text_pdf import TextPDFWriter
+from uploads import PDFUploadRequest, UploadRejected
+
 app = Flask(__name__)
+# Las subidas se escriben directamente en UPLOAD_FOLDER mientras llegan (ver uploads.py)
+app.request_class = PDFUploadRequest
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max
 app.config['UPLOAD_FOLDER'] = '/tmp/uploads'
 app.config['OUTPUT_FOLDER'] = '/tmp/outputs'
+# Con un proxy delante (Apache, lighttpd...) USE_X_SENDFILE=1 le deja enviar
+# los archivos; si no, gunicorn los envía con sendfile()
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '0') == '1'
 
 # Crear directorios si no existen
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
 
-# Diccionario para almacenar el progreso de trabajos
-jobs = {}
+# Estado de los trabajos, compartido entre workers (ver job_store.py)
+jobs = create_job_store()
+
+# Cola acotada + número fijo de hilos de OCR (ver scheduler.py)
+scheduler = create_scheduler(jobs)
 
 ALLOWED_EXTENSIONS = {'pdf'}
 
@@ -54,35 +82,50 @@ def check_system_dependencies():
             missing.append(name)
     return missing
 
-def run_ocrmypdf(input_path, output_path, lang='spa+eng', timeout=1200):
+def ocr_parallel_workers(n_chunks):
+    """Número de fragmentos que se procesan a la vez.
+
+    Por defecto se usa un fragmento por CPU; la variable de entorno
+    OCR_PARALLEL_CHUNKS permite fijar un tope menor.
+    """
+    cpus = os.cpu_count() or 1
+    cap = int(os.environ.get('OCR_PARALLEL_CHUNKS', cpus))
+    return max(1, min(cpus, cap, n_chunks))
+
+def ocr_options(lang, profile=None):
+    """Opciones de ocrmypdf que afectan al resultado (y a la clave de caché).
+
+    ``profile`` es el perfil de preprocesado (ver preprocess.py); con
+    ``quality`` se endereza y limpia todo como antes, con los demás se
+    reduce la imagen de OCR y se limpia solo si hace falta.
+    """
+    profile = get_profile(profile)
+    options = {
+        'redo_ocr': True,
+        'rotate_pages': True,
+        'language': lang,
+    }
+    if profile.native_cleanup:
+        options.update(deskew=True, clean=True)
+    options.update(plugin_options(profile))
+    return options
+
+def run_ocrmypdf(input_path, output_path, lang='spa+eng', timeout=1200, ocr_jobs=None, profile=None):
     """Lanza ocrmypdf sobre el PDF dado.
 
-    Utiliza opciones para mantener la capa de texto existente (--skip-text),
-    corregir rotaciones y enderezar páginas.  Si ocrmypdf devuelve un código
-    de error distinto de cero, se lanza una excepción con el stderr.
+    Rehace la capa de texto (--redo-ocr) y corrige rotaciones; según el
+    perfil, endereza las páginas siempre o solo si están inclinadas.  El
+    motor (CLI en subproceso o API en procesos persistentes) se elige con
+    OCR_ENGINE; si ocrmypdf falla se lanza RuntimeError con el final de su
+    log.  ``ocr_jobs`` limita los hilos internos de ocrmypdf (--jobs)
+    cuando se procesan varios fragmentos en paralelo.
     """
-    cmd = [
-        'ocrmypdf',
-        '--redo-ocr',
-        '--rotate-pages',
-        '--deskew',
-        '--clean',
-        '-l', lang,
-        input_path,
-        output_path
-    ]
-    try:
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            timeout=timeout
-        )
-        if result.returncode != 0:
-            raise RuntimeError(result.stderr.decode(errors='ignore'))
-    except FileNotFoundError:
-        # Si ocrmypdf no está disponible, informar claramente
-        raise RuntimeError('ocrmypdf no está instalado')
+    options = ocr_options(lang, profile)
+    if not options.get('deskew') and needs_deskew(input_path, get_profile(profile)):
+        options['deskew'] = True
+    if ocr_jobs:
+        options['jobs'] = ocr_jobs
+    run_ocr(input_path, output_path, options, timeout)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -104,88 +147,56 @@ def has_extractable_text(pdf_path, sample_pages=3):
 
 def process_pdf_with_text(job_id, input_pdf_path, output_pdf_path):
     """
-    Procesa PDF que ya tiene texto extraíble (mucho más rápido)
+    Procesa un PDF que ya tiene texto en todas sus páginas (mucho más rápido).
+    
+    El texto se saca con pdftotext por bloques de páginas en paralelo y se
+    escribe página a página en un PDF de texto (ver text_pdf.py), sin pasar
+    por OCR.
     """
+    timer = StageTimer()
+    input_bytes = 0
+    cpu_grant = None
     try:
-        jobs[job_id]['status'] = 'processing'
-        jobs[job_id]['progress'] = 10
-        jobs[job_id]['message'] = 'Analizando PDF...'
-        
-        reader = PdfReader(input_pdf_path)
-        total_pages = len(reader.pages)
-        
-        jobs[job_id]['total_pages'] = total_pages
-        jobs[job_id]['progress'] = 20
-        
-        print(f"Procesando PDF con texto: {total_pages} páginas")
-        
-        # Crear PDF de salida
-        c = canvas.Canvas(output_pdf_path, pagesize=A4)
-        width, height = A4
-        
-        for page_num in range(total_pages):
-            progress_percent = 20 + int((page_num / total_pages) * 70)
-            jobs[job_id]['progress'] = progress_percent
-            jobs[job_id]['message'] = f'Extrayendo texto página {page_num + 1} de {total_pages}...'
-            jobs[job_id]['current_page'] = page_num + 1
-            
-            # Extraer texto de la página
-            page = reader.pages[page_num]
-            text = page.extract_text()
-            
-            # Añadir texto al PDF de salida
-            text_object = c.beginText(40, height - 40)
-            text_object.setFont("Helvetica", 9)
-            
-            lines = text.split('\n')
-            for line in lines:
-                if text_object.getY() < 40:
-                    c.drawText(text_object)
-                    break
-                
-                # Manejar líneas largas
-                if len(line) > 90:
-                    words = line.split()
-                    current_line = ""
-                    for word in words:
-                        test_line = current_line + word + " "
-                        if len(test_line) < 90:
-                            current_line = test_line
-                        else:
-                            if current_line:
-                                text_object.textLine(current_line.strip())
-                            current_line = word + " "
-                    if current_line:
-                        text_object.textLine(current_line.strip())
-                else:
-                    text_object.textLine(line)
-            
-            c.drawText(text_object)
-            
-            if page_num < total_pages - 1:
-                c.showPage()
-            
-            # Pausa pequeña cada 20 páginas
-            if (page_num + 1) % 20 == 0:
-                time.sleep(0.05)
+        job = jobs.get(job_id) or {}
+        block = int(os.environ.get('TEXT_BLOCK_PAGES', 25))
+        page_timeout = int(os.environ.get('OCR_PAGE_TIMEOUT_SECONDS', 300))
         
-        jobs[job_id]['progress'] = 95
-        jobs[job_id]['message'] = 'Guardando PDF...'
-        c.save()
+        jobs.update(job_id, status='processing', progress=5, message='Analizando PDF...')
+        input_bytes = os.path.getsize(input_pdf_path)
+        with timer.stage('analyze'):
+            total_pages = quick_page_count(input_pdf_path)
+        jobs.update(job_id, total_pages=total_pages)
         
-        jobs[job_id]['status'] = 'completed'
-        jobs[job_id]['progress'] = 100
-        jobs[job_id]['message'] = 'Completado'
-        jobs[job_id]['pages_processed'] = total_pages
-        
-        print(f"PDF procesado exitosamente: {total_pages} páginas")
+        # Un pdftotext por bloque, tantos a la vez como núcleos conceda el
+        # presupuesto común
+        with timer.stage('cpu_wait'):
+            cpu_grant = get_cpu_budget().acquire(job_cpu_limit(-(-total_pages // block)),
+                                                 lane=job.get('priority', 'interactive'))
+        workers = cpu_grant.count
+        jobs.update(job_id, message=f'Extrayendo texto ({workers} bloques en paralelo)...', progress=10,
+                    cpu_cores=workers)
+        with timer.stage('extract'), TextPDFWriter(output_pdf_path) as writer:
+            pages = text_layer_blocks(input_pdf_path, total_pages, workers, block=block,
+                                      timeout=page_timeout * block)
+            for done, page in enumerate(pages, 1):
+                writer.add_page(page.text)
+                if done % block == 0 or done == total_pages:
+                    jobs.update(
+                        job_id,
+                        current_page=done,
+                        message=f'Extrayendo texto página {done} de {total_pages}...',
+                        progress=10 + int((done / total_pages) * 85),
+                    )
         
+        jobs.update(job_id, status='completed', progress=100, message='Completado',
+                    pages_processed=total_pages)
     except Exception as e:
-        jobs[job_id]['status'] = 'error'
-        jobs[job_id]['error'] = str(e)
-        jobs[job_id]['message'] = f'Error: {str(e)}'
-        print(f"Error en procesamiento: {str(e)}")
+        jobs.update(job_id, status='error', error=str(e), message=f'Error: {str(e)}')
         raise
+    finally:
+        if cpu_grant is not None:
+            cpu_grant.release()
+        record_job(jobs, job_id, timer, input_bytes)
 
 def process_pdf_with_ocr(job_id: str, input_pdf_path: str, output_pdf_path: str):
     """
@@ -196,22 +207,30 @@ def process_pdf_with_ocr(job_id: str, input_pdf_path: str, output_pdf_path: str)
     partes resultantes en un único PDF.  Si faltan dependencias de
     sistema, actualiza el estado del trabajo y lanza una excepción.
     """
+    # Tiempos por etapa: quedan en el registro del trabajo y en /metrics
+    timer = StageTimer()
+    input_bytes = 0
+    cpu_grant = None
+    checkpoint = None
+    # Las partes terminadas se publican aquí para /pages mientras dura el trabajo
+    parts_dir = os.path.join(app.config['OUTPUT_FOLDER'], f'{job_id}.parts')
     try:
         # Verificar dependencias
         missing = check_system_dependencies()
         if missing:
             missing_list = ', '.join(missing)
-            jobs[job_id]['status'] = 'error'
-            jobs[job_id]['error'] = missing_list
-            jobs[job_id]['message'] = (
-                f'Faltan dependencias del sistema: {missing_list}. '
-                'En Render/Ubuntu instala: tesseract-ocr (+idiomas), ocrmypdf, ghostscript (gs), qpdf.'
+            jobs.update(
+                job_id,
+                status='error',
+                error=missing_list,
+                message=(
+                    f'Faltan dependencias del sistema: {missing_list}. '
+                    'En Render/Ubuntu instala: tesseract-ocr (+idiomas), ocrmypdf, ghostscript (gs), qpdf.'
+                ),
             )
             return
 
-        jobs[job_id]['status'] = 'processing'
-        jobs[job_id]['progress'] = 5
-        jobs[job_id]['message'] = 'Analizando PDF...'
+        jobs.update(job_id, status='processing', progress=5, message='Analizando PDF...')
 
         # Configuración a través de variables de entorno
         max_pages_total = int(os.environ.get('MAX_PAGES_TOTAL', 300))
@@ -220,86 +239,498 @@ def process_pdf_with_ocr(job_id: str, input_pdf_path: str, output_pdf_path: str)
         ocr_timeout = int(os.environ.get('OCR_TIMEOUT_SECONDS', 1200))
 
         # Leer PDF para contar páginas
-        reader = PdfReader(input_pdf_path)
-        total_pages = len(reader.pages)
-        jobs[job_id]['total_pages'] = total_pages
+        input_bytes = os.path.getsize(input_pdf_path)
+        with timer.stage('analyze'):
+            reader = PdfReader(input_pdf_path)
+            total_pages = len(reader.pages)
+        jobs.update(job_id, total_pages=total_pages)
 
         if total_pages > max_pages_total:
-            jobs[job_id]['status'] = 'error'
-            jobs[job_id]['error'] = 'Exceso de páginas'
-            jobs[job_id]['message'] = (
-                f'El PDF tiene {total_pages} páginas, supera el límite de '
-                f'{max_pages_total}. Reduce el PDF o aumenta MAX_PAGES_TOTAL.'
+            jobs.update(
+                job_id,
+                status='error',
+                error='Exceso de páginas',
+                message=(
+                    f'El PDF tiene {total_pages} páginas, supera el límite de '
+                    f'{max_pages_total}. Reduce el PDF o aumenta MAX_PAGES_TOTAL.'
+                ),
             )
             return
 
+        # Reutilizar el resultado si este mismo PDF ya se procesó con la
+        # misma configuración
+        cache = get_cache()
+        job = jobs.get(job_id) or {}
+        profile = job.get('profile')
+        lane = job.get('priority', 'interactive')
+        settings = ocr_options(lang, profile)
+        # SHA-256 calculado al recibir la subida (None si el trabajo no vino de /upload)
+        digest = job.get('sha256')
+        doc_key = None
+        if cache is not None:
+            with timer.stage('cache_lookup'):
+                doc_key = cache.document_key(input_pdf_path, settings, digest=digest)
+                cache_hit = cache.get_file(doc_key, output_pdf_path)
+            if cache_hit:
+                jobs.update(
+                    job_id,
+                    status='completed',
+                    progress=100,
+                    message='Completado (resultado en caché)',
+                    pages_processed=total_pages,
+                    cache_hit=True,
+                )
+                return
+
+        # Clasificar páginas: solo las escaneadas o mixtas pasan por OCR; las
+        # que ya tienen capa de texto se conservan sin cambios.
+        if os.environ.get('OCR_PAGE_TRIAGE', '1') != '0':
+            jobs.update(job_id, message='Clasificando páginas...')
+            with timer.stage('classify'):
+                page_kinds = classify_pages(input_pdf_path)
+            ocr_pages = [i for i, kind in enumerate(page_kinds) if kind != PAGE_TEXT]
+        else:
+            ocr_pages = list(range(total_pages))
+        text_pages = total_pages - len(ocr_pages)
+        jobs.update(job_id, ocr_pages=len(ocr_pages), text_pages=text_pages)
+
+        # Las partes publicadas por una ejecución anterior interrumpida ya no valen
+        shutil.rmtree(parts_dir, ignore_errors=True)
+        jobs.update(job_id, page_parts=None)
+
         # Directorio temporal para fragmentos
         tmpdir = tempfile.mkdtemp(prefix='ocr_chunks_')
-        partial_outputs = []
+        assembler = PageAssembler(total_pages, parts_dir)
         try:
-            if total_pages <= pages_per_chunk:
-                # Un solo fragmento
-                jobs[job_id]['message'] = 'Ejecutando OCR...'
-                jobs[job_id]['progress'] = 10
-                run_ocrmypdf(input_pdf_path, output_pdf_path, lang=lang, timeout=ocr_timeout)
-                jobs[job_id]['pages_processed'] = total_pages
+            # Las páginas con capa de texto se toman tal cual del original
+            ocr_page_set = set(ocr_pages)
+            kept_pages = [i for i in range(total_pages) if i not in ocr_page_set]
+            assembler.provide(kept_pages, input_pdf_path, kept_pages, durable=True)
+
+            # Los fragmentos que ya terminó una ejecución anterior interrumpida
+            # de este mismo documento se reutilizan (ver checkpoints.py)
+            pending_pages = ocr_pages
+            checkpoint = open_checkpoint(input_pdf_path, settings, digest=digest) if ocr_pages else None
+            if checkpoint is not None:
+                resumed = set()
+                for pages, path in checkpoint.completed():
+                    if ocr_page_set.issuperset(pages) and resumed.isdisjoint(pages):
+                        assembler.provide(pages, path)
+                        resumed.update(pages)
+                pending_pages = [i for i in ocr_pages if i not in resumed]
+                jobs.update(job_id, resumed_pages=len(resumed))
+
+            # Las páginas cuyo OCR ya está en caché no se vuelven a reconocer
+            page_keys = {}
+            if cache is not None and pending_pages:
+                with timer.stage('cache_lookup'):
+                    all_keys = cache.page_keys(page_fingerprints(input_pdf_path, pending_pages), settings)
+                    found = cache.fetch_pages(all_keys, tmpdir)
+                lookup_pages, pending_pages = pending_pages, []
+                for page, key, path in zip(lookup_pages, all_keys, found):
+                    if path:
+                        assembler.provide([page], path)
+                    else:
+                        pending_pages.append(page)
+                        page_keys[page] = key
+                jobs.update(job_id, pages_from_cache=len(lookup_pages) - len(pending_pages))
+
+            # Los núcleos salen del presupuesto común a todos los trabajos y
+            # workers de la máquina (ver cpu_budget.py).  Un trabajo
+            # interactivo los reserva para toda la etapa de OCR; uno bulk los
+            # pide fragmento a fragmento y cede el sitio a los interactivos
+            # al terminar cada uno
+            if pending_pages and lane != 'bulk':
+                with timer.stage('cpu_wait'):
+                    cpu_grant = get_cpu_budget().acquire(job_cpu_limit(len(pending_pages)))
+            cores = cpu_grant.count if cpu_grant is not None else job_cpu_limit(len(pending_pages))
+            
+            # Los fragmentos se escriben, se reconocen y se añaden a la salida
+            # en tubería: mientras unos están en OCR se escribe el siguiente,
+            # y cada parte terminada se incorpora al PDF final en orden.
+            # Los cortes siguen el coste estimado de cada página, repartido
+            # entre los workers y dentro del timeout (ver chunk_planner.py);
+            # PAGES_PER_CHUNK es el máximo de páginas por fragmento.  Un
+            # documento que cabe en un fragmento se reconoce en una sola
+            # llamada a ocrmypdf con una página por núcleo (--jobs).
+            if len(pending_pages) <= pages_per_chunk:
+                plan_workers = 1
             else:
-                # Dividir en fragmentos más pequeños
-                n_chunks = (total_pages + pages_per_chunk - 1) // pages_per_chunk
-                jobs[job_id]['message'] = f'Dividiendo PDF en {n_chunks} partes...'
-                jobs[job_id]['progress'] = 10
-                
-                # Crear fragmentos
-                for idx in range(n_chunks):
-                    start = idx * pages_per_chunk
-                    end = min((idx + 1) * pages_per_chunk, total_pages)
-                    chunk_path = os.path.join(tmpdir, f'chunk_{idx+1}.pdf')
-                    writer = PdfWriter()
-                    for page_num in range(start, end):
-                        writer.add_page(reader.pages[page_num])
-                    with open(chunk_path, 'wb') as f_out:
-                        writer.write(f_out)
-                    partial_output = os.path.join(tmpdir, f'chunk_{idx+1}_ocr.pdf')
-                    partial_outputs.append(partial_output)
-                    
-                    # Ejecutar OCR en el fragmento
-                    jobs[job_id]['message'] = f'OCR parte {idx+1} de {n_chunks}...'
-                    jobs[job_id]['progress'] = 10 + int((idx / n_chunks) * 70)
-                    run_ocrmypdf(chunk_path, partial_output, lang=lang, timeout=ocr_timeout)
-                
-                # Combinar fragmentos OCR en un solo PDF
-                jobs[job_id]['message'] = 'Combinando partes...'
-                jobs[job_id]['progress'] = 90
-                merger = PdfWriter()
-                total_processed = 0
-                for partial in partial_outputs:
-                    r = PdfReader(partial)
-                    total_processed += len(r.pages)
-                    for p in r.pages:
-                        merger.add_page(p)
-                with open(output_pdf_path, 'wb') as f_out:
-                    merger.write(f_out)
-                jobs[job_id]['pages_processed'] = total_processed
+                plan_workers = min(cores, ocr_parallel_workers(len(pending_pages)))
+            with timer.stage('plan'):
+                groups, page_units = plan_document_chunks(
+                    input_pdf_path, pending_pages, plan_workers, ocr_timeout, pages_per_chunk
+                )
+            cost_model = get_cost_model()
+            n_chunks = len(groups)
+            workers, ocr_jobs = split_cores(cores, n_chunks, ocr_parallel_workers(n_chunks))
+            estimate = sum(page_units.values()) * cost_model.seconds_per_unit / workers
+            jobs.update(
+                job_id,
+                message=f'OCR de {n_chunks} partes ({workers} en paralelo, {cores} núcleos)...',
+                progress=10,
+                cpu_cores=cores,
+                ready_pages=assembler.ready_pages,
+                page_parts=assembler.published,
+                chunk_plan=[len(g) for g in groups],
+                estimated_ocr_seconds=round(estimate, 1) if page_units else None,
+            )
+            progress = {'chunks': 0, 'pages': total_pages - len(pending_pages)}
+
+            chunk_stats = {}
+            languages = {}
+
+            def ocr_chunk(chunk_path, partial_output):
+                stats = chunk_stats[partial_output] = {}
+                start = time.perf_counter()
+                grant = get_cpu_budget().acquire(ocr_jobs, lane='bulk') if lane == 'bulk' else None
+                stats['cpu_wait'] = time.perf_counter() - start
+                memory = None
+                try:
+                    chunk_jobs = grant.count if grant is not None else ocr_jobs
+                    # El fragmento empieza cuando su pico de memoria estimado
+                    # cabe en el presupuesto de la máquina (ver memory_budget.py)
+                    start = time.perf_counter()
+                    memory = get_memory_budget().acquire(chunk_peak_bytes(chunk_path, chunk_jobs))
+                    stats['memory_wait'] = time.perf_counter() - start
+                    # Solo los idiomas presentes en el fragmento (ver lang_detect.py)
+                    start = time.perf_counter()
+                    chunk_lang = stats['languages'] = detect_languages(chunk_path, lang)
+                    stats['lang_detect'] = time.perf_counter() - start
+                    run_ocrmypdf(chunk_path, partial_output, lang=chunk_lang, timeout=ocr_timeout,
+                                 ocr_jobs=chunk_jobs, profile=profile)
+                finally:
+                    if memory is not None:
+                        memory.release()
+                    if grant is not None:
+                        grant.release()
+
+            def chunk_finished(result):
+                # La espera por núcleos o memoria y la elección de idiomas no cuentan
+                # como tiempo de OCR
+                stats = chunk_stats.pop(result.output_path, {})
+                for stage in ('cpu_wait', 'memory_wait', 'lang_detect'):
+                    timer.add(stage, stats.get(stage, 0.0))
+                    result.ocr_seconds -= stats.get(stage, 0.0)
+                chunk_lang = stats.get('languages', lang)
+                languages[chunk_lang] = languages.get(chunk_lang, 0) + len(result.pages)
+                timer.chunk(result.index, len(result.pages), result.split_seconds, result.ocr_seconds)
+                if page_units:
+                    cost_model.observe(sum(page_units[p] for p in result.pages), result.ocr_seconds)
+                part_path = result.output_path
+                if checkpoint is not None:
+                    part_path = checkpoint.add(result.pages, part_path)
+                # Las páginas se buscan con todos los idiomas del trabajo: un
+                # fragmento reconocido con menos (ver lang_detect.py) no se guarda
+                if cache is not None and chunk_lang == lang:
+                    with timer.stage('cache_store'):
+                        cache.store_pages(part_path, [page_keys[p] for p in result.pages])
+                progress['chunks'] += 1
+                progress['pages'] += len(result.pages)
+                jobs.update(
+                    job_id,
+                    chunks_done=progress['chunks'],
+                    current_page=progress['pages'],
+                    ready_pages=assembler.provide(result.pages, part_path),
+                    page_parts=assembler.published,
+                    message=f"OCR parte {progress['chunks']} de {n_chunks} completada...",
+                    progress=10 + int((progress['chunks'] / n_chunks) * 80),
+                    languages=languages,
+                )
+
+            with timer.stage('ocr'):
+                run_chunks(input_pdf_path, groups, tmpdir, ocr_chunk, workers, on_done=chunk_finished)
+            if cpu_grant is not None:
+                cpu_grant.release()
+
+            jobs.update(job_id, message='Guardando PDF final...', progress=90)
+            with timer.stage('save'):
+                assembler.save(output_pdf_path)
+            jobs.update(job_id, pages_processed=total_pages)
         finally:
+            assembler.close()
             # Limpiar directorio temporal
             try:
                 shutil.rmtree(tmpdir)
             except Exception:
                 pass
 
-        jobs[job_id]['status'] = 'completed'
-        jobs[job_id]['progress'] = 100
-        jobs[job_id]['message'] = 'Completado'
+        if cache is not None and ocr_pages:
+            with timer.stage('cache_store'):
+                cache.put_file(doc_key, output_pdf_path)
+        if checkpoint is not None:
+            checkpoint.clear()
+
+        jobs.update(job_id, status='completed', progress=100, message='Completado')
+    except Exception as e:
+        jobs.update(job_id, status='error', error=str(e), message=f'Error: {str(e)}')
+        raise
+    finally:
+        if cpu_grant is not None:
+            cpu_grant.release()
+        if checkpoint is not None:
+            # Sin borrarlo: si el trabajo falló, se reanudará desde aquí
+            checkpoint.release()
+        shutil.rmtree(parts_dir, ignore_errors=True)
+        record_job(jobs, job_id, timer, input_bytes)
+
+def process_pdf_to_text(job_id, input_pdf_path, output_path):
+    """
+    Extrae solo el texto del PDF, sin construir un PDF de salida.
+    
+    Las páginas con capa de texto se leen directamente y el resto se
+    reconoce con tesseract página a página (ver text_extract.py).  Cada
+    página se añade a la salida (texto plano o JSON por líneas) en cuanto
+    está lista, así que /text/<job_id> puede ir sirviéndola mientras tanto.
+    """
+    timer = StageTimer()
+    input_bytes = 0
+    cpu_grant = None
+    try:
+        job = jobs.get(job_id) or {}
+        fmt = job.get('output_format', 'text')
+        boxes = bool(job.get('word_boxes'))
+        lang = os.environ.get('OCR_LANGUAGE', 'spa+eng')
+        # El perfil limita la resolución de rasterizado y decide la limpieza
+        profile = get_profile(job.get('profile'))
+        dpi = profile.max_dpi or int(os.environ.get('OCR_TEXT_DPI', 300))
+        page_timeout = int(os.environ.get('OCR_PAGE_TIMEOUT_SECONDS', 300))
+        
+        jobs.update(job_id, status='processing', progress=5, message='Analizando PDF...')
+        input_bytes = os.path.getsize(input_pdf_path)
+        with timer.stage('analyze'):
+            total_pages = quick_page_count(input_pdf_path)
+        jobs.update(job_id, total_pages=total_pages)
+        
+        # Solo las páginas escaneadas o mixtas pasan por tesseract
+        if os.environ.get('OCR_PAGE_TRIAGE', '1') != '0':
+            jobs.update(job_id, message='Clasificando páginas...')
+            with timer.stage('classify'):
+                page_kinds = classify_pages(input_pdf_path)
+            ocr_pages = [i for i, kind in enumerate(page_kinds) if kind != PAGE_TEXT]
+        else:
+            ocr_pages = list(range(total_pages))
+        jobs.update(job_id, ocr_pages=len(ocr_pages), text_pages=total_pages - len(ocr_pages))
+        
+        # Páginas a la vez = núcleos concedidos por el presupuesto común
+        with timer.stage('cpu_wait'):
+            cpu_grant = get_cpu_budget().acquire(job_cpu_limit(len(ocr_pages)),
+                                                 lane=job.get('priority', 'interactive'))
+        workers = cpu_grant.count
+        jobs.update(job_id, message=f'Extrayendo texto ({workers} páginas en paralelo)...', progress=10,
+                    cpu_cores=workers)
+        with timer.stage('ocr'), open(output_path, 'w', encoding='utf-8') as out:
+            pages = extract_pages(input_pdf_path, range(total_pages), ocr_pages, lang, workers,
+                                  boxes=boxes, dpi=dpi, timeout=page_timeout,
+                                  denoise_above=profile.denoise_above)
+            for done, result in enumerate(pages, 1):
+                out.write(format_page(result, fmt))
+                out.flush()
+                timer.chunk(result.page, 1, 0.0, result.seconds)
+                jobs.update(
+                    job_id,
+                    current_page=done,
+                    ready_pages=done,
+                    message=f'Página {done} de {total_pages} lista...',
+                    progress=10 + int((done / total_pages) * 85),
+                )
+        
+        jobs.update(job_id, status='completed', progress=100, message='Completado',
+                    pages_processed=total_pages)
     except Exception as e:
-        jobs[job_id]['status'] = 'error'
-        jobs[job_id]['error'] = str(e)
-        jobs[job_id]['message'] = f'Error: {str(e)}'
+        jobs.update(job_id, status='error', error=str(e), message=f'Error: {str(e)}')
         raise
+    finally:
+        if cpu_grant is not None:
+            cpu_grant.release()
+        record_job(jobs, job_id, timer, input_bytes)
+
+def process_job(job_id, input_path, output_path):
+    """Procesa un trabajo según el formato de salida y el método pedidos al subirlo"""
+    job = jobs.get(job_id) or {}
+    if job.get('output_format', 'pdf') in TEXT_FORMATS:
+        return process_pdf_to_text(job_id, input_path, output_path)
+    if job.get('method') == 'text':
+        # La vía rápida solo sirve si todas las páginas tienen texto; si no,
+        # el trabajo pasa por OCR
+        try:
+            text_only = all(kind == PAGE_TEXT for kind in classify_pages(input_path))
+        except Exception:
+            text_only = False  # el OCR informará de qué le pasa al PDF
+        if text_only:
+            return process_pdf_with_text(job_id, input_path, output_path)
+        jobs.update(job_id, method='ocr')
+    return process_pdf_with_ocr(job_id, input_path, output_path)
+
+# Reanudar los trabajos que dejó en cola o a medias un worker que murió
+# (ver scheduler.recover); los fragmentos terminados salen de su punto de control
+scheduler.recover(process_job, lambda job: (job['input_path'], job['output_path']))
+
+# Los resultados ya no se borran al descargarlos, sino al caducar (ver retention.py)
+start_sweeper(jobs, [app.config['UPLOAD_FOLDER'], app.config['OUTPUT_FOLDER']])
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def requested_output():
+    """Formato de salida pedido en el formulario: (formato, cajas de palabras).
+    
+    output=pdf (por defecto) genera el PDF buscable; output=text y
+    output=json devuelven solo el texto por página (con boxes=1, el JSON
+    incluye además la caja de cada palabra).
+    """
+    fmt = request.form.get('output', 'pdf').strip().lower() or 'pdf'
+    if fmt != 'pdf' and fmt not in TEXT_FORMATS:
+        raise UploadRejected(f"Formato de salida no válido: {fmt} (usa pdf, {', '.join(TEXT_FORMATS)})")
+    boxes = request.form.get('boxes', '').strip().lower() in ('1', 'true', 'yes', 'on')
+    return fmt, boxes
+
+def requested_profile():
+    """Perfil de preprocesado pedido en el formulario (profile=fast/balanced/quality)"""
+    try:
+        return get_profile(request.form.get('profile', '').strip() or None).name
+    except ValueError as e:
+        raise UploadRejected(str(e))
+
+def requested_method():
+    """Cómo se construye la salida PDF: method=ocr (por defecto) o method=text.
+    
+    text es la vía rápida para PDFs con texto en todas las páginas (ver
+    process_pdf_with_text); si alguna página es escaneada, el trabajo pasa
+    por OCR igualmente.
+    """
+    method = request.form.get('method', 'ocr').strip().lower() or 'ocr'
+    if method not in ('ocr', 'text'):
+        raise UploadRejected(f"Método no válido: {method} (usa ocr o text)")
+    return method
+
+def requested_priority(default=None):
+    """Carril pedido en el formulario (priority=interactive/bulk)"""
+    lane = request.form.get('priority', '').strip().lower() or default
+    if lane is not None and lane not in LANES:
+        raise UploadRejected(f"Prioridad no válida: {lane} (usa {', '.join(LANES)})")
+    return lane
+
+def requested_pages():
+    """Rangos de páginas a procesar (pages=1-5,8,20-); se comprueban contra el PDF al subirlo"""
+    return request.form.get('pages', '').strip() or None
+
+def register_upload(upload, original_name, output_format='pdf', profile=None, priority=None, method='ocr',
+                    pages=None, **extra):
+    """Mueve un PDF recibido a su sitio y crea su trabajo.
+    
+    Con pages (p. ej. 1-5,8) solo se conservan esas páginas: el trabajo
+    procesa, y devuelve, un PDF con ellas.
+    
+    Devuelve (job_id, campos del trabajo, cached); con cached el trabajo ya
+    está completado desde la caché y no hay que encolarlo. Lanza
+    UploadRejected si el PDF no es válido o tiene demasiadas páginas.
+    """
+    job_id = str(uuid.uuid4())
+    filename = secure_filename(original_name) or 'documento.pdf'
+    if os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], filename)):
+        # Mismo nombre ya en curso (p. ej. dos a.pdf dentro de un ZIP)
+        filename = f"{job_id[:8]}_{filename}"
+    
+    # El archivo ya está en disco, con su hash calculado y la cabecera
+    # comprobada; se mueve a su nombre definitivo y se cuentan las
+    # páginas leyendo solo el trailer y la xref
+    input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    try:
+        upload.save_as(input_path)
+        total_pages = quick_page_count(input_path)
+    except Exception:
+        upload.discard()
+        raise UploadRejected('El archivo subido no parece un PDF válido')
+    
+    digest = upload.sha256
+    selection = {}
+    if pages:
+        try:
+            selected = parse_page_ranges(pages, total_pages)
+        except ValueError as e:
+            upload.discard()
+            raise UploadRejected(str(e))
+        if len(selected) < total_pages:
+            # El resto del documento se descarta aquí, antes de encolar, para
+            # que todas las etapas (carril, caché, fragmentos) vean solo el rango
+            subset_path = f'{input_path}.pages'
+            try:
+                assemble_pages([(input_path, i) for i in selected], subset_path)
+                os.replace(subset_path, input_path)
+            except Exception:
+                upload.discard()
+                if os.path.exists(subset_path):
+                    os.remove(subset_path)
+                raise UploadRejected('No se pudieron extraer las páginas pedidas del PDF')
+            selection = {'page_selection': format_page_ranges(selected), 'source_pages': total_pages}
+            total_pages = len(selected)
+            digest = None  # el hash de la subida ya no corresponde al archivo
+    
+    max_pages_total = int(os.environ.get('MAX_PAGES_TOTAL', 300))
+    if total_pages > max_pages_total:
+        upload.discard()
+        raise UploadRejected(
+            f'El PDF tiene {total_pages} páginas, supera el límite de '
+            f'{max_pages_total}. Reduce el PDF o aumenta MAX_PAGES_TOTAL.'
+        )
+    
+    # Generar nombre de salida con sufijo _OCR
+    base_name = os.path.splitext(filename)[0]
+    extension = TEXT_FORMATS[output_format][0] if output_format in TEXT_FORMATS else 'pdf'
+    output_filename = f"{base_name}_OCR.{extension}"
+    output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
+    
+    job_fields = {
+        'filename': output_filename,
+        'source_name': original_name,
+        'input_path': input_path,
+        'output_path': output_path,
+        'total_pages': total_pages,
+        'sha256': digest,
+        'output_format': output_format,
+        'profile': get_profile(profile).name,
+        # Los documentos grandes van siempre al carril bulk (ver scheduler.job_lane)
+        'priority': job_lane(priority, total_pages),
+        'method': method if output_format == 'pdf' else 'text',
+        **selection,
+        **extra
+    }
+    
+    # Si este mismo archivo ya se procesó con la misma configuración, el
+    # resultado se entrega sin pasar por la cola
+    cache = get_cache()
+    if cache is not None and job_fields['method'] == 'ocr':
+        settings = ocr_options(os.environ.get('OCR_LANGUAGE', 'spa+eng'), profile)
+        doc_key = cache.document_key(input_path, settings, digest=digest)
+        if cache.get_file(doc_key, output_path):
+            jobs.create(
+                job_id,
+                status='completed',
+                progress=100,
+                message='Completado (resultado en caché)',
+                pages_processed=total_pages,
+                cache_hit=True,
+                **job_fields
+            )
+            return job_id, job_fields, True
+    
+    # Inicializar job
+    jobs.create(
+        job_id,
+        status='queued',
+        progress=0,
+        message='Analizando archivo...',
+        **job_fields
+    )
+    return job_id, job_fields, False
+
+def queue_busy_response(e):
+    response = jsonify({'error': f'Servidor ocupado, inténtalo más tarde. {e}'})
+    response.headers['Retry-After'] = '30'
+    return response, 429
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files:
@@ -311,64 +742,181 @@ def upload_file():
         return jsonify({'error': 'No se seleccionó ningún archivo'}), 400
     
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        
-        # Guardar archivo temporal
-        input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(input_path)
-        
-        # Generar nombre de salida con sufijo _OCR
-        base_name = os.path.splitext(filename)[0]
-        output_filename = f"{base_name}_OCR.pdf"
-        output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
-        
-        # Crear job ID único
-        job_id = str(uuid.uuid4())
-        
-        # Inicializar job
-        jobs[job_id] = {
-            'status': 'queued',
-            'progress': 0,
-            'message': 'Analizando archivo...',
-            'filename': output_filename,
-            'input_path': input_path,
-            'output_path': output_path
-        }
+        output_format, boxes = requested_output()
+        job_id, fields, cached = register_upload(file.stream, file.filename,
+                                                 output_format=output_format, profile=requested_profile(),
+                                                 priority=requested_priority('bulk'), method=requested_method(),
+                                                 pages=requested_pages(), word_boxes=boxes)
+        if cached:
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'message': 'Completado (resultado en caché)',
+                'method': 'cache'
+            })
         
         # Nota: muchos PDFs "mixtos" (texto + páginas escaneadas) engañan a extract_text().
         # Para asegurar que se OCR-ean las imágenes y se mantenga un PDF final legible,
         # SIEMPRE pasamos por ocrmypdf (modo híbrido).
-        thread = Thread(
-            target=process_pdf_with_ocr,
-            args=(job_id, input_path, output_path)
-        )
-
-        thread.daemon = True
-        thread.start()
+        try:
+            position = scheduler.submit(
+                job_id,
+                process_job,
+                (fields['input_path'], fields['output_path']),
+                cost=fields['total_pages'],
+                lane=fields['priority']
+            )
+        except QueueFull as e:
+            jobs.delete(job_id)
+            if os.path.exists(fields['input_path']):
+                os.remove(fields['input_path'])
+            return queue_busy_response(e)
         
         return jsonify({
             'success': True,
             'job_id': job_id,
-            'message': 'Procesamiento iniciado',
-            'method': 'text_extraction' if has_text else 'ocr'
+            'message': 'Procesamiento en cola',
+            'queue_position': position,
+            'method': fields['method']
         })
     
     return jsonify({'error': 'Tipo de archivo no permitido. Solo se aceptan PDFs'}), 400
 
-@app.route('/status/<job_id>')
-def job_status(job_id):
-    """Endpoint para verificar el estado del trabajo"""
-    if job_id not in jobs:
-        return jsonify({'error': 'Job no encontrado'}), 404
+@app.route('/batch', methods=['POST'])
+def create_batch():
+    """Varios PDFs (campo files, se admiten ZIP) bajo un mismo identificador de lote"""
+    files = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+    if not files:
+        return jsonify({'error': 'No se envió ningún archivo'}), 400
+    
+    output_format, boxes = requested_output()
+    profile = requested_profile()
+    priority = requested_priority('bulk')
+    method = requested_method()
+    pages = requested_pages()
+    batch_id = str(uuid.uuid4())
+    accepted = []
+    rejected = []
+    for name, upload, error in expand_uploads(files, app.config['UPLOAD_FOLDER']):
+        if upload is None:
+            rejected.append({'filename': name, 'error': error or 'Archivo rechazado'})
+            continue
+        try:
+            accepted.append(register_upload(upload, name, output_format=output_format, profile=profile,
+                                            priority=priority, method=method, pages=pages,
+                                            word_boxes=boxes, batch_id=batch_id))
+        except UploadRejected as e:
+            rejected.append({'filename': name, 'error': str(e)})
+    
+    if not accepted:
+        return jsonify({'error': 'Ningún PDF válido en el lote', 'rejected': rejected}), 400
     
-    job = jobs[job_id]
+    try:
+        scheduler.submit_many([
+            (job_id, process_job, (fields['input_path'], fields['output_path']), fields['total_pages'],
+             fields['priority'])
+            for job_id, fields, cached in accepted if not cached
+        ])
+    except QueueFull as e:
+        for job_id, fields, _ in accepted:
+            jobs.delete(job_id)
+            for path in (fields['input_path'], fields['output_path']):
+                if os.path.exists(path):
+                    os.remove(path)
+        return queue_busy_response(e)
+    
+    jobs.create(
+        batch_id,
+        kind='batch',
+        batch_id=batch_id,
+        job_ids=[job_id for job_id, _, _ in accepted],
+        rejected=rejected
+    )
+    return jsonify({
+        'success': True,
+        'batch_id': batch_id,
+        'documents': [{'job_id': job_id, 'source': fields['source_name']} for job_id, fields, _ in accepted],
+        'rejected': rejected
+    })
+
+@app.route('/batch/<batch_id>')
+def batch_progress(batch_id):
+    batch = jobs.get(batch_id)
+    if batch is None or batch.get('kind') != 'batch':
+        return jsonify({'error': 'Lote no encontrado'}), 404
+    return jsonify(batch_status(jobs, batch))
+
+def streaming_response(body, **kwargs):
+    """Respuesta en flujo dentro del tope SSE_MAX_STREAMS (ver job_events.py).
+    
+    Cada flujo ocupa un hilo de gthread mientras dura; pasado el tope se
+    responde 503 y la página vuelve a consultar /status.
+    """
+    limiter = get_stream_limiter()
+    if not limiter.try_acquire():
+        body.close()
+        response = jsonify({'error': 'Demasiadas conexiones en curso; inténtalo más tarde o consulta /status'})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    response = Response(stream_with_context(body), **kwargs)
+    response.call_on_close(limiter.release)
+    return response
+
+@app.route('/batch/<batch_id>/download')
+def batch_download(batch_id):
+    batch = jobs.get(batch_id)
+    if batch is None or batch.get('kind') != 'batch':
+        return jsonify({'error': 'Lote no encontrado'}), 404
+    
+    # El ZIP solo se sirve cuando han terminado todos los documentos (ver batches.py)
+    status = batch_status(jobs, batch)
+    if status['status'] != 'completed':
+        resp = jsonify(status)
+        resp.headers['Retry-After'] = '10'
+        return resp, 409
     
+    def stream():
+        yield from stream_batch_zip(jobs, batch)
+        # Los archivos se conservan hasta que caducan (ver retention.py)
+        for job_id in batch['job_ids']:
+            touch(jobs, job_id)
+    
+    return streaming_response(
+        stream(),
+        mimetype='application/zip',
+        headers={
+            'Content-Disposition': f'attachment; filename="lote_{batch_id[:8]}_OCR.zip"',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@app.errorhandler(UploadRejected)
+def upload_rejected(e):
+    """Subida cortada mientras llegaba (p. ej. no empieza por %PDF-)"""
+    return jsonify({'error': str(e)}), 400
+
+def job_status_payload(job):
+    """Estado público de un trabajo (lo que devuelven /status y /events)"""
     response = {
         'status': job['status'],
         'progress': job['progress'],
         'message': job.get('message', ''),
     }
     
+    if job['status'] == 'queued':
+        response['queue_position'] = job.get('queue_position', 0)
+        response['priority'] = job.get('priority', 'interactive')
+    
+    if job['status'] == 'processing':
+        response['ready_pages'] = job.get('ready_pages', 0)
+    
+    if job.get('output_format', 'pdf') != 'pdf':
+        response['output_format'] = job['output_format']
+    
+    if job.get('page_selection'):
+        # Páginas del PDF subido que cubre el trabajo (pages= al subirlo)
+        response['page_selection'] = job['page_selection']
+    
     if job['status'] == 'completed':
         response['filename'] = job['filename']
         response['pages_processed'] = job.get('pages_processed', 0)
@@ -380,35 +928,217 @@ def job_status(job_id):
         response['total_pages'] = job['total_pages']
         response['current_page'] = job.get('current_page', 0)
     
-    return jsonify(response)
+    if 'languages' in job:
+        # Páginas reconocidas con cada combinación de idiomas
+        response['languages'] = job['languages']
+    
+    if 'timings' in job:
+        response['timings'] = job['timings']
+    
+    return response
+
+def job_lookup_error(job_id, job):
+    """Respuesta 404 si ``job`` no es un trabajo (no existe o es un lote), o None"""
+    if job is None:
+        return jsonify({'error': 'Job no encontrado'}), 404
+    if job.get('kind') == 'batch':
+        # Un lote no tiene estado propio: se consulta en /batch/<id>
+        return jsonify({'error': f'Es un lote; consulta /batch/{job_id}', 'batch': f'/batch/{job_id}'}), 404
+    return None
+
+@app.route('/status/<job_id>')
+def job_status(job_id):
+    """Endpoint para verificar el estado del trabajo"""
+    job = jobs.get(job_id)
+    error = job_lookup_error(job_id, job)
+    if error:
+        return error
+    
+    return jsonify(job_status_payload(job))
+
+@app.route('/events/<job_id>')
+def job_events(job_id):
+    """Progreso del trabajo como Server-Sent Events (ver job_events.py)"""
+    error = job_lookup_error(job_id, jobs.get(job_id))
+    if error:
+        return error
+    
+    stream = job_event_stream(jobs, job_id, job_status_payload,
+                              last_event_id=request.headers.get('Last-Event-ID'))
+    return streaming_response(
+        stream,
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/text/<job_id>')
+def job_text(job_id):
+    """Texto de un trabajo con output=text/json, servido página a página según se reconoce
+
+    Hasta que el trabajo empieza a escribir páginas la respuesta es 409 con Retry-After.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job no encontrado'}), 404
+    if job.get('output_format') not in TEXT_FORMATS:
+        return jsonify({'error': 'El trabajo no es de solo texto; usa /download'}), 400
+    
+    output_path = job['output_path']
+    # Hasta que empiezan a salir páginas (en cola o esperando núcleos) no hay
+    # nada que enviar: un flujo parado retendría un hilo y un hueco de flujo
+    if job.get('status') == 'queued' or (job.get('status') == 'processing' and not os.path.exists(output_path)):
+        resp = jsonify(dict(job_status_payload(job), error='El texto aún no está disponible'))
+        resp.headers['Retry-After'] = '5'
+        return resp, 409
+    poll = float(os.environ.get('SSE_POLL_SECONDS', '0.5'))
+    
+    def finished():
+        status = (jobs.get(job_id) or {}).get('status', 'error')
+        return status in ('completed', 'error')
+    
+    def stream():
+        yield from follow_file(output_path, finished, poll=poll)
+        # Los archivos se conservan hasta que caducan (ver retention.py)
+        touch(jobs, job_id)
+    
+    return streaming_response(
+        stream(),
+        mimetype=TEXT_FORMATS[job['output_format']][1],
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def selected_pages(job):
+    """Páginas del PDF subido que forman el resultado del trabajo, en orden"""
+    if job.get('page_selection'):
+        return parse_page_ranges(job['page_selection'], job['source_pages'])
+    return list(range(job.get('total_pages', 0)))
+
+def ready_page_sources(job, positions):
+    """(archivo, índice) de cada página del resultado en positions, y las que faltan"""
+    if job.get('status') == 'completed':
+        return [(job['output_path'], i) for i in positions], []
+    published = page_sources(job.get('page_parts') or [])
+    missing = [i for i in positions if i not in published]
+    return [published[i] for i in positions if i in published], missing
+
+@app.route('/pages/<job_id>')
+def job_pages(job_id):
+    """Algunas páginas de un trabajo de OCR (pages=3-7) en cuanto terminan sus fragmentos.
+    
+    Los números de página son los del PDF subido.  format=pdf (por defecto)
+    devuelve un PDF solo con esas páginas y format=text/json su texto, como
+    /text.  Mientras alguna no esté lista responde 409 con las que faltan.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job no encontrado'}), 404
+    if job.get('output_format', 'pdf') != 'pdf' or job.get('method') == 'text':
+        return jsonify({'error': 'Solo para trabajos de OCR a PDF; usa /text o /download'}), 400
+    
+    fmt = request.args.get('format', 'pdf').strip().lower() or 'pdf'
+    if fmt != 'pdf' and fmt not in TEXT_FORMATS:
+        return jsonify({'error': f"Formato no válido: {fmt} (usa pdf, {', '.join(TEXT_FORMATS)})"}), 400
+    
+    covered = selected_pages(job)
+    position = {page: i for i, page in enumerate(covered)}
+    try:
+        wanted = parse_page_ranges(request.args.get('pages') or format_page_ranges(covered),
+                                   job.get('source_pages', job.get('total_pages', 0)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    outside = [page for page in wanted if page not in position]
+    if outside:
+        return jsonify({'error': f'Páginas que no forman parte del trabajo: {format_page_ranges(outside)}'}), 400
+    
+    for _ in range(2):
+        if job.get('status') == 'error':
+            return jsonify({'error': job.get('error', 'Error desconocido')}), 409
+        sources, missing = ready_page_sources(job, [position[page] for page in wanted])
+        if missing:
+            response = jsonify({
+                'error': 'Las páginas pedidas aún no están listas',
+                'missing': format_page_ranges([covered[i] for i in missing]),
+                'ready_pages': job.get('ready_pages', 0)
+            })
+            response.headers['Retry-After'] = '5'
+            return response, 409
+        if all(os.path.exists(path) for path, _ in sources):
+            break
+        # Las partes publicadas se borran al terminar el trabajo: se vuelve a leer
+        job = jobs.get(job_id) or {}
+    else:
+        return jsonify({'error': 'Archivo no encontrado'}), 404
+    
+    touch(jobs, job_id)
+    if fmt in TEXT_FORMATS:
+        body = []
+        for page, (path, index) in zip(wanted, sources):
+            result = text_layer_page(path, index, boxes=bool(job.get('word_boxes')))
+            result.page = page
+            body.append(format_page(result, fmt))
+        return Response(''.join(body), mimetype=TEXT_FORMATS[fmt][1])
+    
+    with tempfile.TemporaryDirectory(prefix='ocrpages_') as tmp:
+        pages_path = os.path.join(tmp, 'pages.pdf')
+        assemble_pages(sources, pages_path)
+        with open(pages_path, 'rb') as f:
+            data = io.BytesIO(f.read())
+    spec = format_page_ranges(wanted).replace(',', '_')
+    return send_file(
+        data,
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=f"{os.path.splitext(job['filename'])[0]}_p{spec}.pdf",
+        max_age=0
+    )
+
+@app.route('/metrics')
+def metrics():
+    """Métricas en formato Prometheus (ver metrics.py)"""
+    return Response(
+        get_metrics().render(job_gauges(jobs)),
+        mimetype='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+def send_result(job_id, job):
+    """Envía el archivo de salida de un trabajo terminado.
+    
+    send_file atiende Range (206) e If-Range/ETag, así que una descarga
+    cortada se reanuda donde se quedó, y el archivo sale con sendfile()
+    (o X-Sendfile con USE_X_SENDFILE=1) sin pasar por Python.  No se borra:
+    lo hará el barrido cuando caduque (ver retention.py).
+    """
+    file_path = job.get('output_path')
+    if job.get('status') != 'completed' or not file_path or not os.path.exists(file_path):
+        return jsonify({'error': 'Archivo no encontrado'}), 404
+    
+    touch(jobs, job_id)
+    return send_file(
+        file_path,
+        as_attachment=True,
+        download_name=job['filename'],
+        conditional=True,
+        max_age=0
+    )
+
+@app.route('/result/<job_id>')
+def download_result(job_id):
+    """Salida de un trabajo por su identificador"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job no encontrado'}), 404
+    
+    return send_result(job_id, job)
 
 @app.route('/download/<filename>')
 def download_file(filename):
-    file_path = os.path.join(app.config['OUTPUT_FOLDER'], filename)
-    
-    if os.path.exists(file_path):
-        response = send_file(file_path, as_attachment=True, download_name=filename)
-        
-        # Limpiar archivos después de descargarlo
-        @response.call_on_close
-        def cleanup():
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                # Buscar y eliminar archivo de entrada asociado
-                for job_id, job_data in list(jobs.items()):
-                    if job_data.get('filename') == filename:
-                        input_path = job_data.get('input_path')
-                        if input_path and os.path.exists(input_path):
-                            os.remove(input_path)
-                        del jobs[job_id]
-                        break
-            except Exception as e:
-                print(f"Error en cleanup: {e}")
-        
-        return response
+    """Salida de un trabajo por nombre de archivo (búsqueda por índice, ver job_store.py)"""
+    found = jobs.find(filename=secure_filename(filename))
+    if found is None:
+        return jsonify({'error': 'Archivo no encontrado'}), 404
     
-    return jsonify({'error': 'Archivo no encontrado'}), 404
+    job_id, job = found
+    return send_result(job_id, job)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
@@ -1,25 +1,53 @@
 from __future__ import annotations
 
+import io
 import os
-import uuid
 import time
+import uuid
 import shutil
 import tempfile
-import subprocess
-from threading import Thread
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterator, List, Tuple
 
-from flask import Flask, request, send_file, render_template, jsonify
+from flask import Flask, Response, request, send_file, render_template, jsonify, stream_with_context
 from werkzeug.utils import secure_filename
-from PyPDF2 import PdfReader, PdfWriter
+
+from checkpoints import open_checkpoint
+from batches import batch_status, expand_uploads, stream_batch_zip
+from chunk_planner import get_cost_model, plan_document_chunks
+from cpu_budget import get_cpu_budget, job_cpu_limit, split_cores
+from job_events import get_stream_limiter, job_event_stream
+from job_store import create_job_store
+from lang_detect import detect_languages
+from memory_budget import chunk_peak_bytes, get_memory_budget
+from metrics import StageTimer, get_metrics, job_gauges, record_job
+from ocr_cache import get_cache
+from ocr_engine import run_ocr
+from ocr_pipeline import ChunkResult, run_chunks
+from pdf_tools import (
+    PAGE_TEXT, PageAssembler, assemble_pages, classify_pages, format_page_ranges, page_fingerprints,
+    page_sources, parse_page_ranges, pdf_page_count, quick_page_count,
+)
+from preprocess import get_profile, needs_deskew, plugin_options
+from retention import start_sweeper, touch
+from scheduler import LANES, QueueFull, create_scheduler, job_lane
+from text_extract import (
+    TEXT_FORMATS, extract_pages, follow_file, format_page, text_layer_blocks, text_layer_page,
+)
+from text_pdf import TextPDFWriter
+from uploads import PDFUpload, PDFUploadRequest, UploadRejected
 
 app = Flask(__name__)
+# Uploads are written straight to UPLOAD_FOLDER as they arrive (see uploads.py)
+app.request_class = PDFUploadRequest
 
 # Configuration from environment
 MAX_UPLOAD_MB = int(os.environ.get('MAX_UPLOAD_MB', '50'))
 app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_MB * 1024 * 1024
 app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', '/tmp/uploads')
 app.config['OUTPUT_FOLDER'] = os.environ.get('OUTPUT_FOLDER', '/tmp/outputs')
+# Behind a proxy that understands X-Sendfile, let it send result files;
+# otherwise gunicorn sends them with sendfile().
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '0') == '1'
 
 # Ensure directories exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -27,8 +55,11 @@ os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
 
 ALLOWED_EXTENSIONS = {'pdf'}
 
-# Job tracking dictionary
-jobs: Dict[str, Dict[str, Any]] = {}
+# Job state, shared across gunicorn workers (see job_store.py)
+jobs = create_job_store()
+
+# Bounded queue + fixed number of OCR slots (see scheduler.py)
+scheduler = create_scheduler(jobs)
 
 
 def allowed_file(filename: str) -> bool:
@@ -57,147 +88,500 @@ def check_system_dependencies() -> List[str]:
     return missing
 
 
-def pdf_page_count(pdf_path: str) -> int:
-    reader = PdfReader(pdf_path)
-    return len(reader.pages)
-
-
-def split_pdf(pdf_path: str, out_dir: str, pages_per_chunk: int) -> List[str]:
-    reader = PdfReader(pdf_path)
-    total = len(reader.pages)
-    chunk_paths: List[str] = []
-    idx = 1
-    for start in range(0, total, pages_per_chunk):
-        end = min(start + pages_per_chunk, total)
-        writer = PdfWriter()
-        for i in range(start, end):
-            writer.add_page(reader.pages[i])
-        chunk_path = os.path.join(out_dir, f"chunk_{idx:04d}.pdf")
-        with open(chunk_path, 'wb') as f:
-            writer.write(f)
-        chunk_paths.append(chunk_path)
-        idx += 1
-    return chunk_paths
-
-
-def merge_pdfs(pdf_paths: List[str], output_pdf_path: str) -> None:
-    writer = PdfWriter()
-    for path in pdf_paths:
-        r = PdfReader(path)
-        for page in r.pages:
-            writer.add_page(page)
-    with open(output_pdf_path, 'wb') as f:
-        writer.write(f)
-
-
-def run_ocrmypdf(input_path: str, output_path: str, lang: str, timeout: int) -> None:
-    cmd = [
-        'ocrmypdf',
-        '--redo-ocr',
-        '--rotate-pages',
-        '--deskew',
-        '--clean-final',
-        '--optimize', '1',
-        '-l', lang,
-        input_path,
-        output_path
-    ]
-    result = subprocess.run(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        timeout=timeout
-    )
-    if result.returncode != 0:
-        tail = (result.stdout or '').splitlines()[-30:]
-        raise RuntimeError("ocrmypdf falló. Log (últimas líneas):\n" + "\n".join(tail))
+def ocr_parallel_workers(n_chunks: int) -> int:
+    """Número de fragmentos que se procesan a la vez.
+
+    Por defecto se usa un fragmento por CPU; OCR_PARALLEL_CHUNKS permite
+    fijar un tope menor (p. ej. en instancias con poca memoria).
+    """
+    cpus = os.cpu_count() or 1
+    cap = int(os.environ.get('OCR_PARALLEL_CHUNKS', str(cpus)))
+    return max(1, min(cpus, cap, n_chunks))
+
+
+def ocr_options(lang: str, profile: str | None = None) -> Dict[str, Any]:
+    """ocrmypdf options that affect the result (also used as cache key).
+
+    ``quality`` deskews and cleans every page as before; the other
+    preprocessing profiles (see preprocess.py) downsample the OCR image and
+    clean it only when needed, leaving the output images untouched.
+    """
+    preset = get_profile(profile)
+    options: Dict[str, Any] = {
+        'redo_ocr': True,
+        'rotate_pages': True,
+        'optimize': 1,
+        'language': lang,
+    }
+    if preset.native_cleanup:
+        options.update(deskew=True, clean_final=True)
+    options.update(plugin_options(preset))
+    return options
+
+
+def run_ocrmypdf(input_path: str, output_path: str, lang: str, timeout: int,
+                 ocr_jobs: int | None = None, profile: str | None = None) -> None:
+    options = ocr_options(lang, profile)
+    # Deskew only chunks that actually contain a skewed page.
+    if not options.get('deskew') and needs_deskew(input_path, get_profile(profile)):
+        options['deskew'] = True
+    if ocr_jobs:
+        # Limita los hilos internos de ocrmypdf para no sobresuscribir CPUs
+        # cuando hay varios fragmentos en paralelo.
+        options['jobs'] = ocr_jobs
+    run_ocr(input_path, output_path, options, timeout)
+
+
+def process_pdf_with_text(job_id: str, input_pdf_path: str, output_pdf_path: str) -> None:
+    """Fast path for PDFs whose pages all have a text layer: no OCR.
+
+    pdftotext runs over blocks of pages in parallel and each page is written
+    to a plain text PDF as soon as it is ready (see text_pdf.py).
+    """
+    timer = StageTimer()
+    input_bytes = 0
+    cpu_grant = None
+    try:
+        job = jobs.get(job_id) or {}
+        block = int(os.environ.get('TEXT_BLOCK_PAGES', '25'))
+        page_timeout = int(os.environ.get('OCR_PAGE_TIMEOUT_SECONDS', '300'))
+
+        jobs.update(job_id, status='processing', progress=3, message="Analizando PDF...")
+        input_bytes = os.path.getsize(input_pdf_path)
+        with timer.stage('analyze'):
+            total_pages = quick_page_count(input_pdf_path)
+        jobs.update(job_id, total_pages=total_pages)
+
+        # One pdftotext per block, as many at once as the shared budget allows.
+        with timer.stage('cpu_wait'):
+            cpu_grant = get_cpu_budget().acquire(job_cpu_limit(-(-total_pages // block)),
+                                                 lane=job.get('priority', 'interactive'))
+        workers = cpu_grant.count
+        jobs.update(job_id, message=f"Extrayendo texto ({workers} bloques en paralelo)...", progress=10,
+                    cpu_cores=workers)
+        with timer.stage('extract'), TextPDFWriter(output_pdf_path) as writer:
+            pages = text_layer_blocks(input_pdf_path, total_pages, workers, block=block,
+                                      timeout=page_timeout * block)
+            for done, page in enumerate(pages, 1):
+                writer.add_page(page.text)
+                if done % block == 0 or done == total_pages:
+                    jobs.update(
+                        job_id,
+                        current_page=done,
+                        message=f"Extrayendo texto página {done} de {total_pages}...",
+                        progress=10 + int((done / total_pages) * 85),
+                    )
+
+        jobs.update(
+            job_id,
+            status='completed',
+            progress=100,
+            message="Completado",
+            pages_processed=total_pages,
+        )
+
+    except Exception as e:
+        jobs.update(job_id, status='error', error=str(e), message=f"Error: {str(e)}")
+    finally:
+        if cpu_grant is not None:
+            cpu_grant.release()
+        record_job(jobs, job_id, timer, input_bytes)
 
 
 def process_pdf_with_ocr(job_id: str, input_pdf_path: str, output_pdf_path: str) -> None:
+    # Per-stage timings end up on the job record and in /metrics.
+    timer = StageTimer()
+    input_bytes = 0
+    cpu_grant = None
+    checkpoint = None
+    # Finished parts are published here for /pages while the job runs.
+    parts_dir = os.path.join(app.config['OUTPUT_FOLDER'], f"{job_id}.parts")
     try:
         missing = check_system_dependencies()
         if missing:
             missing_list = ", ".join(missing)
-            jobs[job_id]['status'] = 'error'
-            jobs[job_id]['error'] = missing_list
-            jobs[job_id]['message'] = (
-                f"Faltan dependencias del sistema: {missing_list}. "
-                "En Render/Ubuntu instala: tesseract-ocr (+idiomas), ocrmypdf, ghostscript (gs), qpdf."
+            jobs.update(
+                job_id,
+                status='error',
+                error=missing_list,
+                message=(
+                    f"Faltan dependencias del sistema: {missing_list}. "
+                    "En Render/Ubuntu instala: tesseract-ocr (+idiomas), ocrmypdf, ghostscript (gs), qpdf."
+                ),
             )
             return
 
-        jobs[job_id]['status'] = 'processing'
-        jobs[job_id]['progress'] = 3
-        jobs[job_id]['message'] = "Analizando PDF..."
+        jobs.update(job_id, status='processing', progress=3, message="Analizando PDF...")
 
         if not looks_like_pdf(input_pdf_path):
-            jobs[job_id]['status'] = 'error'
-            jobs[job_id]['error'] = "Archivo no parece un PDF válido"
-            jobs[job_id]['message'] = "El archivo subido no parece un PDF válido."
+            jobs.update(
+                job_id,
+                status='error',
+                error="Archivo no parece un PDF válido",
+                message="El archivo subido no parece un PDF válido.",
+            )
             return
+        input_bytes = os.path.getsize(input_pdf_path)
 
         max_pages_total = int(os.environ.get('MAX_PAGES_TOTAL', '300'))
         pages_per_chunk = int(os.environ.get('PAGES_PER_CHUNK', '25'))
         lang = os.environ.get('OCR_LANGUAGE', 'spa+eng')
         ocr_timeout = int(os.environ.get('OCR_TIMEOUT_SECONDS', '1200'))
 
-        total_pages = pdf_page_count(input_pdf_path)
-        jobs[job_id]['total_pages'] = total_pages
+        with timer.stage('analyze'):
+            total_pages = pdf_page_count(input_pdf_path)
+        jobs.update(job_id, total_pages=total_pages)
 
         if total_pages <= 0:
-            jobs[job_id]['status'] = 'error'
-            jobs[job_id]['error'] = "PDF sin páginas"
-            jobs[job_id]['message'] = "El PDF no tiene páginas."
+            jobs.update(
+                job_id,
+                status='error',
+                error="PDF sin páginas",
+                message="El PDF no tiene páginas.",
+            )
             return
 
         if total_pages > max_pages_total:
-            jobs[job_id]['status'] = 'error'
-            jobs[job_id]['error'] = "Exceso de páginas"
-            jobs[job_id]['message'] = (
-                f"El PDF tiene {total_pages} páginas, supera el límite de {max_pages_total}. "
-                "Reduce el PDF o aumenta MAX_PAGES_TOTAL."
+            jobs.update(
+                job_id,
+                status='error',
+                error="Exceso de páginas",
+                message=(
+                    f"El PDF tiene {total_pages} páginas, supera el límite de {max_pages_total}. "
+                    "Reduce el PDF o aumenta MAX_PAGES_TOTAL."
+                ),
             )
             return
 
-        file_size_mb = os.path.getsize(input_pdf_path) / (1024 * 1024)
-        if file_size_mb > 25 or total_pages > 150:
-            pages_per_chunk = max(10, min(pages_per_chunk, 15))
+        cache = get_cache()
+        job = jobs.get(job_id) or {}
+        profile = job.get('profile')
+        lane = job.get('priority', 'interactive')
+        settings = ocr_options(lang, profile)
+        # SHA-256 computed while the upload streamed in (None for other callers)
+        digest = job.get('sha256')
+        doc_key = None
+        if cache is not None:
+            with timer.stage('cache_lookup'):
+                doc_key = cache.document_key(input_pdf_path, settings, digest=digest)
+                cache_hit = cache.get_file(doc_key, output_pdf_path)
+            if cache_hit:
+                jobs.update(
+                    job_id,
+                    status='completed',
+                    progress=100,
+                    message="Completado (resultado en caché)",
+                    pages_processed=total_pages,
+                    cache_hit=True,
+                )
+                return
+
+        # Only scanned/mixed pages go through OCR; pages that already have a
+        # text layer are spliced back unchanged (OCR_PAGE_TRIAGE=0 disables).
+        if os.environ.get('OCR_PAGE_TRIAGE', '1') != '0':
+            jobs.update(job_id, progress=5, message="Clasificando páginas...")
+            with timer.stage('classify'):
+                page_kinds = classify_pages(input_pdf_path)
+            ocr_pages = [i for i, kind in enumerate(page_kinds) if kind != PAGE_TEXT]
+        else:
+            ocr_pages = list(range(total_pages))
+        text_pages = total_pages - len(ocr_pages)
+        jobs.update(job_id, ocr_pages=len(ocr_pages), text_pages=text_pages)
+
+        if not ocr_pages:
+            shutil.copyfile(input_pdf_path, output_pdf_path)
+            jobs.update(
+                job_id,
+                status='completed',
+                progress=100,
+                message="Completado (todas las páginas ya tenían texto)",
+                pages_processed=total_pages,
+            )
+            return
 
-        jobs[job_id]['progress'] = 8
-        jobs[job_id]['message'] = "Preparando trabajo (dividiendo en partes)..."
+        # Parts published by an interrupted earlier run are not valid anymore.
+        shutil.rmtree(parts_dir, ignore_errors=True)
+        jobs.update(job_id, progress=8, message="Preparando trabajo (dividiendo en partes)...",
+                    page_parts=None)
 
-        with tempfile.TemporaryDirectory(prefix="ocrjob_") as tmp:
+        with tempfile.TemporaryDirectory(prefix="ocrjob_") as tmp, \
+                PageAssembler(total_pages, parts_dir) as assembler:
             chunk_dir = os.path.join(tmp, "chunks")
-            out_dir = os.path.join(tmp, "out")
-            os.makedirs(chunk_dir, exist_ok=True)
-            os.makedirs(out_dir, exist_ok=True)
-
-            chunk_paths = split_pdf(input_pdf_path, chunk_dir, pages_per_chunk)
-            n_chunks = len(chunk_paths)
-            ocr_parts: List[str] = []
-            for idx, chunk_path in enumerate(chunk_paths, start=1):
-                jobs[job_id]['message'] = f"OCR parte {idx} de {n_chunks}..."
-                jobs[job_id]['progress'] = 10 + int(((idx - 1) / max(n_chunks, 1)) * 75)
-                part_output = os.path.join(out_dir, f"chunk_{idx:04d}_ocr.pdf")
-                run_ocrmypdf(chunk_path, part_output, lang=lang, timeout=ocr_timeout)
-                ocr_parts.append(part_output)
-                if idx % 10 == 0:
-                    time.sleep(0.05)
-
-            jobs[job_id]['message'] = "Combinando partes en un único PDF..."
-            jobs[job_id]['progress'] = 92
-            merge_pdfs(ocr_parts, output_pdf_path)
-
-        jobs[job_id]['status'] = 'completed'
-        jobs[job_id]['progress'] = 100
-        jobs[job_id]['message'] = "Completado"
-        jobs[job_id]['pages_processed'] = total_pages
+            cached_dir = os.path.join(tmp, "cached")
+            for d in (chunk_dir, cached_dir):
+                os.makedirs(d, exist_ok=True)
+
+            # Pages with a text layer come straight from the input.
+            ocr_page_set = set(ocr_pages)
+            kept_pages = [i for i in range(total_pages) if i not in ocr_page_set]
+            assembler.provide(kept_pages, input_pdf_path, kept_pages, durable=True)
+
+            # Chunks finished by an earlier, interrupted run on this same
+            # document are reused (see checkpoints.py).
+            pending_pages = ocr_pages
+            checkpoint = open_checkpoint(input_pdf_path, settings, digest=digest)
+            if checkpoint is not None:
+                resumed = set()
+                for pages, path in checkpoint.completed():
+                    if ocr_page_set.issuperset(pages) and resumed.isdisjoint(pages):
+                        assembler.provide(pages, path)
+                        resumed.update(pages)
+                pending_pages = [i for i in ocr_pages if i not in resumed]
+                jobs.update(job_id, resumed_pages=len(resumed))
+
+            # Pages whose OCR result is already cached are not recognised again.
+            page_keys: Dict[int, str] = {}
+            if cache is not None and pending_pages:
+                with timer.stage('cache_lookup'):
+                    all_keys = cache.page_keys(page_fingerprints(input_pdf_path, pending_pages), settings)
+                    found = cache.fetch_pages(all_keys, cached_dir)
+                lookup_pages, pending_pages = pending_pages, []
+                for page, key, path in zip(lookup_pages, all_keys, found):
+                    if path:
+                        assembler.provide([page], path)
+                    else:
+                        pending_pages.append(page)
+                        page_keys[page] = key
+                jobs.update(job_id, pages_from_cache=len(lookup_pages) - len(pending_pages))
+
+            # Cores come from the machine-wide budget shared with every other
+            # job and gunicorn worker (see cpu_budget.py).  Interactive jobs
+            # hold them for the whole OCR stage; bulk jobs lease them chunk by
+            # chunk, giving way to interactive work at every chunk boundary.
+            if pending_pages and lane != 'bulk':
+                with timer.stage('cpu_wait'):
+                    cpu_grant = get_cpu_budget().acquire(job_cpu_limit(len(pending_pages)))
+            cores = cpu_grant.count if cpu_grant is not None else job_cpu_limit(len(pending_pages))
+
+            # Chunk boundaries follow the estimated cost of each page, balanced
+            # across workers and within the timeout (see chunk_planner.py).
+            # PAGES_PER_CHUNK is the upper bound on pages per chunk; a document
+            # that fits in one chunk is a single ocrmypdf run with one page per
+            # core (--jobs) instead of several runs with their own startup.
+            if len(pending_pages) <= pages_per_chunk:
+                plan_workers = 1
+            else:
+                plan_workers = min(cores, ocr_parallel_workers(len(pending_pages)))
+            with timer.stage('plan'):
+                groups, page_units = plan_document_chunks(
+                    input_pdf_path, pending_pages, plan_workers, ocr_timeout, pages_per_chunk,
+                )
+            cost_model = get_cost_model()
+            n_chunks = len(groups)
+            workers, ocr_jobs = split_cores(cores, n_chunks, ocr_parallel_workers(n_chunks))
+            estimate = sum(page_units.values()) * cost_model.seconds_per_unit / workers
+            jobs.update(
+                job_id,
+                message=f"OCR de {n_chunks} partes ({workers} en paralelo, {cores} núcleos)...",
+                progress=10,
+                cpu_cores=cores,
+                ready_pages=assembler.ready_pages,
+                page_parts=assembler.published,
+                chunk_plan=[len(g) for g in groups],
+                estimated_ocr_seconds=round(estimate, 1) if page_units else None,
+            )
+
+            chunks_done = 0
+            pages_done = total_pages - len(pending_pages)
+
+            chunk_stats: Dict[str, Dict[str, Any]] = {}
+            languages: Dict[str, int] = {}
+
+            def ocr_chunk(chunk_path: str, part_output: str) -> None:
+                stats = chunk_stats[part_output] = {}
+                start = time.perf_counter()
+                grant = get_cpu_budget().acquire(ocr_jobs, lane='bulk') if lane == 'bulk' else None
+                stats['cpu_wait'] = time.perf_counter() - start
+                memory = None
+                try:
+                    chunk_jobs = grant.count if grant is not None else ocr_jobs
+                    # The chunk starts only once its estimated peak memory fits
+                    # the machine-wide budget (see memory_budget.py).
+                    start = time.perf_counter()
+                    memory = get_memory_budget().acquire(chunk_peak_bytes(chunk_path, chunk_jobs))
+                    stats['memory_wait'] = time.perf_counter() - start
+                    # Only the languages actually present in the chunk (see lang_detect.py).
+                    start = time.perf_counter()
+                    chunk_lang = stats['languages'] = detect_languages(chunk_path, lang)
+                    stats['lang_detect'] = time.perf_counter() - start
+                    run_ocrmypdf(chunk_path, part_output, lang=chunk_lang, timeout=ocr_timeout,
+                                 ocr_jobs=chunk_jobs, profile=profile)
+                finally:
+                    if memory is not None:
+                        memory.release()
+                    if grant is not None:
+                        grant.release()
+
+            def chunk_finished(result: ChunkResult) -> None:
+                nonlocal chunks_done, pages_done
+                # Waiting for cores or memory and picking languages are not OCR time
+                # (nor cost model input).
+                stats = chunk_stats.pop(result.output_path, {})
+                for stage in ('cpu_wait', 'memory_wait', 'lang_detect'):
+                    timer.add(stage, stats.get(stage, 0.0))
+                    result.ocr_seconds -= stats.get(stage, 0.0)
+                chunk_lang = stats.get('languages', lang)
+                languages[chunk_lang] = languages.get(chunk_lang, 0) + len(result.pages)
+                timer.chunk(result.index, len(result.pages), result.split_seconds, result.ocr_seconds)
+                if page_units:
+                    cost_model.observe(sum(page_units[p] for p in result.pages), result.ocr_seconds)
+                part_path = result.output_path
+                if checkpoint is not None:
+                    part_path = checkpoint.add(result.pages, part_path)
+                # Pages are looked up under the job's full language set: a chunk
+                # OCR'd with a narrower one (see lang_detect.py) is not stored.
+                if cache is not None and chunk_lang == lang:
+                    with timer.stage('cache_store'):
+                        cache.store_pages(part_path, [page_keys[p] for p in result.pages])
+                chunks_done += 1
+                pages_done += len(result.pages)
+                jobs.update(
+                    job_id,
+                    chunks_done=chunks_done,
+                    current_page=pages_done,
+                    ready_pages=assembler.provide(result.pages, part_path),
+                    page_parts=assembler.published,
+                    message=f"OCR parte {chunks_done} de {n_chunks} completada...",
+                    progress=10 + int((chunks_done / n_chunks) * 80),
+                    languages=languages,
+                )
+
+            with timer.stage('ocr'):
+                run_chunks(input_pdf_path, groups, chunk_dir, ocr_chunk, workers, on_done=chunk_finished)
+            if cpu_grant is not None:
+                cpu_grant.release()
+
+            jobs.update(job_id, message="Guardando PDF final...", progress=92)
+            with timer.stage('save'):
+                assembler.save(output_pdf_path)
+
+        if cache is not None:
+            with timer.stage('cache_store'):
+                cache.put_file(doc_key, output_pdf_path)
+        if checkpoint is not None:
+            checkpoint.clear()
+
+        jobs.update(
+            job_id,
+            status='completed',
+            progress=100,
+            message="Completado",
+            pages_processed=total_pages,
+        )
+
+    except Exception as e:
+        jobs.update(job_id, status='error', error=str(e), message=f"Error: {str(e)}")
+    finally:
+        if cpu_grant is not None:
+            cpu_grant.release()
+        if checkpoint is not None:
+            # Not cleared: a failed job resumes from it.
+            checkpoint.release()
+        shutil.rmtree(parts_dir, ignore_errors=True)
+        record_job(jobs, job_id, timer, input_bytes)
+
+
+def process_pdf_to_text(job_id: str, input_pdf_path: str, output_path: str) -> None:
+    """Text-only output: per-page text (and word boxes) without building a PDF.
+
+    Pages are appended to ``output_path`` in order as they are recognized
+    (see text_extract.py), so /text/<job_id> can serve them meanwhile.
+    """
+    timer = StageTimer()
+    input_bytes = 0
+    cpu_grant = None
+    try:
+        job = jobs.get(job_id) or {}
+        fmt = job.get('output_format', 'text')
+        boxes = bool(job.get('word_boxes'))
+        lang = os.environ.get('OCR_LANGUAGE', 'spa+eng')
+        # The profile caps the rasterization DPI and decides on cleanup.
+        preset = get_profile(job.get('profile'))
+        dpi = preset.max_dpi or int(os.environ.get('OCR_TEXT_DPI', '300'))
+        page_timeout = int(os.environ.get('OCR_PAGE_TIMEOUT_SECONDS', '300'))
+
+        jobs.update(job_id, status='processing', progress=3, message="Analizando PDF...")
+        input_bytes = os.path.getsize(input_pdf_path)
+        with timer.stage('analyze'):
+            total_pages = quick_page_count(input_pdf_path)
+        jobs.update(job_id, total_pages=total_pages)
+
+        # Only scanned/mixed pages go through tesseract; the rest are read
+        # from their text layer.
+        if os.environ.get('OCR_PAGE_TRIAGE', '1') != '0':
+            jobs.update(job_id, message="Clasificando páginas...")
+            with timer.stage('classify'):
+                page_kinds = classify_pages(input_pdf_path)
+            ocr_pages = [i for i, kind in enumerate(page_kinds) if kind != PAGE_TEXT]
+        else:
+            ocr_pages = list(range(total_pages))
+        jobs.update(job_id, ocr_pages=len(ocr_pages), text_pages=total_pages - len(ocr_pages))
+
+        # Pages recognized at once = cores granted by the shared budget.
+        with timer.stage('cpu_wait'):
+            cpu_grant = get_cpu_budget().acquire(job_cpu_limit(len(ocr_pages)),
+                                                 lane=job.get('priority', 'interactive'))
+        workers = cpu_grant.count
+        jobs.update(job_id, message=f"Extrayendo texto ({workers} páginas en paralelo)...", progress=10,
+                    cpu_cores=workers)
+        with timer.stage('ocr'), open(output_path, 'w', encoding='utf-8') as out:
+            pages = extract_pages(input_pdf_path, range(total_pages), ocr_pages, lang, workers,
+                                  boxes=boxes, dpi=dpi, timeout=page_timeout,
+                                  denoise_above=preset.denoise_above)
+            for done, result in enumerate(pages, 1):
+                out.write(format_page(result, fmt))
+                out.flush()
+                timer.chunk(result.page, 1, 0.0, result.seconds)
+                jobs.update(
+                    job_id,
+                    current_page=done,
+                    ready_pages=done,
+                    message=f"Página {done} de {total_pages} lista...",
+                    progress=10 + int((done / total_pages) * 85),
+                )
+
+        jobs.update(
+            job_id,
+            status='completed',
+            progress=100,
+            message="Completado",
+            pages_processed=total_pages,
+        )
 
     except Exception as e:
-        jobs[job_id]['status'] = 'error'
-        jobs[job_id]['error'] = str(e)
-        jobs[job_id]['message'] = f"Error: {str(e)}"
+        jobs.update(job_id, status='error', error=str(e), message=f"Error: {str(e)}")
+    finally:
+        if cpu_grant is not None:
+            cpu_grant.release()
+        record_job(jobs, job_id, timer, input_bytes)
+
+
+def process_job(job_id: str, input_path: str, output_path: str) -> None:
+    """Runs a job according to the output format and method requested at upload."""
+    job = jobs.get(job_id) or {}
+    if job.get('output_format', 'pdf') in TEXT_FORMATS:
+        process_pdf_to_text(job_id, input_path, output_path)
+        return
+    if job.get('method') == 'text':
+        # The fast path only applies when every page has a text layer.
+        try:
+            text_only = all(kind == PAGE_TEXT for kind in classify_pages(input_path))
+        except Exception:
+            text_only = False  # ocrmypdf reports what is wrong with the PDF
+        if text_only:
+            process_pdf_with_text(job_id, input_path, output_path)
+            return
+        jobs.update(job_id, method='ocr')
+    process_pdf_with_ocr(job_id, input_path, output_path)
+
+
+# Jobs left queued or half-done by a worker that died are picked up again
+# (see scheduler.recover); finished chunks come from their checkpoint.
+scheduler.recover(process_job, lambda job: (job['input_path'], job['output_path']))
+
+# Results are no longer deleted on download but when they expire
+# (see retention.py).
+start_sweeper(jobs, [app.config['UPLOAD_FOLDER'], app.config['OUTPUT_FOLDER']])
 
 
 @app.route('/')
@@ -205,6 +589,156 @@ def index():
     return render_template('index.html')
 
 
+def requested_output() -> Tuple[str, bool]:
+    """Output format requested in the form: ``(format, word_boxes)``.
+
+    ``output=pdf`` (default) builds the searchable PDF; ``output=text`` and
+    ``output=json`` return only per-page text (``boxes=1`` adds word boxes
+    to the JSON).
+    """
+    fmt = request.form.get('output', 'pdf').strip().lower() or 'pdf'
+    if fmt != 'pdf' and fmt not in TEXT_FORMATS:
+        raise UploadRejected(f"Formato de salida no válido: {fmt} (usa pdf, {', '.join(TEXT_FORMATS)})")
+    boxes = request.form.get('boxes', '').strip().lower() in ('1', 'true', 'yes', 'on')
+    return fmt, boxes
+
+
+def requested_profile() -> str:
+    """Preprocessing profile requested in the form (``profile=fast|balanced|quality``)."""
+    try:
+        return get_profile(request.form.get('profile', '').strip() or None).name
+    except ValueError as e:
+        raise UploadRejected(str(e))
+
+
+def requested_method() -> str:
+    """How a PDF output is built (``method=ocr``, default, or ``method=text``).
+
+    ``text`` is the fast path for born-digital PDFs: the text layer is
+    re-typeset without OCR (see process_pdf_with_text).  Documents with
+    scanned pages fall back to OCR when the job runs.
+    """
+    method = request.form.get('method', 'ocr').strip().lower() or 'ocr'
+    if method not in ('ocr', 'text'):
+        raise UploadRejected(f"Método no válido: {method} (usa ocr o text)")
+    return method
+
+
+def requested_priority(default: str | None = None) -> str | None:
+    """Scheduling lane requested in the form (``priority=interactive|bulk``)."""
+    lane = request.form.get('priority', '').strip().lower() or default
+    if lane is not None and lane not in LANES:
+        raise UploadRejected(f"Prioridad no válida: {lane} (usa {', '.join(LANES)})")
+    return lane
+
+
+def requested_pages() -> str | None:
+    """Page ranges to process (``pages=1-5,8,20-``); checked against the PDF on upload."""
+    return request.form.get('pages', '').strip() or None
+
+
+def register_upload(upload: PDFUpload, original_name: str, output_format: str = 'pdf',
+                    profile: str | None = None, priority: str | None = None, method: str = 'ocr',
+                    pages: str | None = None, **extra: Any) -> Tuple[str, Dict[str, Any], bool]:
+    """Moves a received PDF into place and creates its job record.
+
+    With ``pages`` (e.g. ``1-5,8``) only those pages are kept: the job
+    processes, and returns, a PDF with just them.
+
+    Returns ``(job_id, job_fields, cached)``; when ``cached`` the job is
+    already completed from the document cache and must not be queued.
+    Raises ``UploadRejected`` for invalid or oversized PDFs.
+    """
+    job_id = str(uuid.uuid4())
+    filename = secure_filename(original_name) or 'documento.pdf'
+    if os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], filename)):
+        # Same name already in flight (e.g. two a.pdf in one ZIP).
+        filename = f"{job_id[:8]}_{filename}"
+    # The body has already been streamed to disk, hashed and checked for
+    # the %PDF- header; the page count only reads the trailer/xref.
+    input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    try:
+        upload.save_as(input_path)
+        total_pages = quick_page_count(input_path)
+    except Exception:
+        upload.discard()
+        raise UploadRejected('El archivo subido no parece un PDF válido')
+    digest = upload.sha256
+    selection: Dict[str, Any] = {}
+    if pages:
+        try:
+            selected = parse_page_ranges(pages, total_pages)
+        except ValueError as e:
+            upload.discard()
+            raise UploadRejected(str(e))
+        if len(selected) < total_pages:
+            # The rest of the document is dropped here, before queueing, so
+            # every later stage (lane, cache, chunking) sees only the range.
+            subset_path = f"{input_path}.pages"
+            try:
+                assemble_pages([(input_path, i) for i in selected], subset_path)
+                os.replace(subset_path, input_path)
+            except Exception:
+                upload.discard()
+                if os.path.exists(subset_path):
+                    os.remove(subset_path)
+                raise UploadRejected('No se pudieron extraer las páginas pedidas del PDF')
+            selection = {'page_selection': format_page_ranges(selected), 'source_pages': total_pages}
+            total_pages = len(selected)
+            digest = None  # the upload hash no longer describes the file
+    max_pages_total = int(os.environ.get('MAX_PAGES_TOTAL', '300'))
+    if total_pages > max_pages_total:
+        upload.discard()
+        raise UploadRejected(
+            f"El PDF tiene {total_pages} páginas, supera el límite de {max_pages_total}. "
+            "Reduce el PDF o aumenta MAX_PAGES_TOTAL."
+        )
+    base_name = os.path.splitext(filename)[0]
+    extension = TEXT_FORMATS[output_format][0] if output_format in TEXT_FORMATS else 'pdf'
+    output_filename = f"{base_name}_OCR.{extension}"
+    output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
+    job_fields: Dict[str, Any] = {
+        'filename': output_filename,
+        'source_name': original_name,
+        'input_path': input_path,
+        'output_path': output_path,
+        'total_pages': total_pages,
+        'sha256': digest,
+        'output_format': output_format,
+        'profile': get_profile(profile).name,
+        # Large documents always go to the bulk lane (see scheduler.job_lane).
+        'priority': job_lane(priority, total_pages),
+        'method': method if output_format == 'pdf' else 'text',
+        **selection,
+        **extra,
+    }
+    # Same file with the same settings already processed: answer from
+    # the cache without queueing (the cache only holds OCR'd PDFs).
+    cache = get_cache()
+    if cache is not None and job_fields['method'] == 'ocr':
+        settings = ocr_options(os.environ.get('OCR_LANGUAGE', 'spa+eng'), profile)
+        doc_key = cache.document_key(input_path, settings, digest=digest)
+        if cache.get_file(doc_key, output_path):
+            jobs.create(
+                job_id,
+                status='completed',
+                progress=100,
+                message="Completado (resultado en caché)",
+                pages_processed=total_pages,
+                cache_hit=True,
+                **job_fields,
+            )
+            return job_id, job_fields, True
+    jobs.create(job_id, status='queued', progress=0, message='En cola...', **job_fields)
+    return job_id, job_fields, False
+
+
+def queue_busy_response(e: QueueFull):
+    resp = jsonify({'error': f"Servidor ocupado, inténtalo más tarde. {e}"})
+    resp.headers['Retry-After'] = '30'
+    return resp, 429
+
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     try:
@@ -215,44 +749,157 @@ def upload_file():
             return jsonify({'error': 'No se seleccionó ningún archivo'}), 400
         if not allowed_file(file.filename):
             return jsonify({'error': 'Tipo de archivo no permitido. Solo se aceptan PDFs'}), 400
-        filename = secure_filename(file.filename)
-        input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(input_path)
-        if not looks_like_pdf(input_path):
-            try:
-                os.remove(input_path)
-            except Exception:
-                pass
-            return jsonify({'error': 'El archivo subido no parece un PDF válido'}), 400
-        base_name = os.path.splitext(filename)[0]
-        output_filename = f"{base_name}_OCR.pdf"
-        output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
-        job_id = str(uuid.uuid4())
-        jobs[job_id] = {
-            'status': 'queued',
-            'progress': 0,
-            'message': 'En cola...',
-            'filename': output_filename,
-            'input_path': input_path,
-            'output_path': output_path,
-        }
-        thread = Thread(target=process_pdf_with_ocr, args=(job_id, input_path, output_path), daemon=True)
-        thread.start()
+        output_format, boxes = requested_output()
+        job_id, fields, cached = register_upload(file.stream, file.filename,
+                                                 output_format=output_format, profile=requested_profile(),
+                                                 priority=requested_priority('bulk'), method=requested_method(),
+                                                 pages=requested_pages(), word_boxes=boxes)
+        if cached:
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'message': 'Completado (resultado en caché)',
+                'method': 'cache'
+            })
+        try:
+            position = scheduler.submit(
+                job_id,
+                process_job,
+                (fields['input_path'], fields['output_path']),
+                cost=fields['total_pages'],
+                lane=fields['priority'],
+            )
+        except QueueFull as e:
+            jobs.delete(job_id)
+            file.stream.discard()
+            return queue_busy_response(e)
         return jsonify({
             'success': True,
             'job_id': job_id,
-            'message': 'Procesamiento iniciado',
-            'method': 'ocr'
+            'message': 'Procesamiento en cola',
+            'queue_position': position,
+            'method': fields['method']
         })
+    except UploadRejected:
+        raise
     except Exception as e:
         return jsonify({'error': f"Error en /upload: {str(e)}"}), 500
 
 
-@app.route('/status/<job_id>')
-def job_status(job_id: str):
-    if job_id not in jobs:
-        return jsonify({'error': 'Job no encontrado'}), 404
-    job = jobs[job_id]
+@app.route('/batch', methods=['POST'])
+def create_batch():
+    """Several PDFs (field ``files``, ZIP archives allowed) under one batch id."""
+    files = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+    if not files:
+        return jsonify({'error': 'No se envió ningún archivo'}), 400
+    output_format, boxes = requested_output()
+    profile = requested_profile()
+    priority = requested_priority('bulk')
+    method = requested_method()
+    pages = requested_pages()
+    batch_id = str(uuid.uuid4())
+    accepted: List[Tuple[str, Dict[str, Any], bool]] = []
+    rejected: List[Dict[str, str]] = []
+    for name, upload, error in expand_uploads(files, app.config['UPLOAD_FOLDER']):
+        if upload is None:
+            rejected.append({'filename': name, 'error': error or 'Archivo rechazado'})
+            continue
+        try:
+            accepted.append(register_upload(upload, name, output_format=output_format, profile=profile,
+                                            priority=priority, method=method, pages=pages,
+                                            word_boxes=boxes, batch_id=batch_id))
+        except UploadRejected as e:
+            rejected.append({'filename': name, 'error': str(e)})
+    if not accepted:
+        return jsonify({'error': 'Ningún PDF válido en el lote', 'rejected': rejected}), 400
+    try:
+        scheduler.submit_many([
+            (job_id, process_job, (fields['input_path'], fields['output_path']), fields['total_pages'],
+             fields['priority'])
+            for job_id, fields, cached in accepted if not cached
+        ])
+    except QueueFull as e:
+        for job_id, fields, _ in accepted:
+            jobs.delete(job_id)
+            for path in (fields['input_path'], fields['output_path']):
+                if os.path.exists(path):
+                    os.remove(path)
+        return queue_busy_response(e)
+    jobs.create(
+        batch_id,
+        kind='batch',
+        batch_id=batch_id,
+        job_ids=[job_id for job_id, _, _ in accepted],
+        rejected=rejected,
+    )
+    return jsonify({
+        'success': True,
+        'batch_id': batch_id,
+        'documents': [{'job_id': job_id, 'source': fields['source_name']} for job_id, fields, _ in accepted],
+        'rejected': rejected,
+    })
+
+
+@app.route('/batch/<batch_id>')
+def batch_progress(batch_id: str):
+    batch = jobs.get(batch_id)
+    if batch is None or batch.get('kind') != 'batch':
+        return jsonify({'error': 'Lote no encontrado'}), 404
+    return jsonify(batch_status(jobs, batch))
+
+
+def streaming_response(body: Iterator[Any], **kwargs: Any):
+    """Streamed response within the SSE_MAX_STREAMS cap (see job_events.py).
+
+    Each stream holds a gthread thread while open; beyond the cap the
+    answer is 503 and the page falls back to polling /status.
+    """
+    limiter = get_stream_limiter()
+    if not limiter.try_acquire():
+        body.close()
+        resp = jsonify({'error': 'Demasiadas conexiones en curso; inténtalo más tarde o consulta /status'})
+        resp.headers['Retry-After'] = '5'
+        return resp, 503
+    response = Response(stream_with_context(body), **kwargs)
+    response.call_on_close(limiter.release)
+    return response
+
+
+@app.route('/batch/<batch_id>/download')
+def batch_download(batch_id: str):
+    batch = jobs.get(batch_id)
+    if batch is None or batch.get('kind') != 'batch':
+        return jsonify({'error': 'Lote no encontrado'}), 404
+    # The ZIP is only served once every document has finished (see batches.py).
+    status = batch_status(jobs, batch)
+    if status['status'] != 'completed':
+        resp = jsonify(status)
+        resp.headers['Retry-After'] = '10'
+        return resp, 409
+
+    def stream():
+        yield from stream_batch_zip(jobs, batch)
+        # Files are kept until they expire (see retention.py).
+        for job_id in batch['job_ids']:
+            touch(jobs, job_id)
+
+    return streaming_response(
+        stream(),
+        mimetype='application/zip',
+        headers={
+            'Content-Disposition': f'attachment; filename="lote_{batch_id[:8]}_OCR.zip"',
+            'X-Accel-Buffering': 'no',
+        },
+    )
+
+
+@app.errorhandler(UploadRejected)
+def upload_rejected(e: UploadRejected):
+    # Raised while the body is still streaming (e.g. no %PDF- header).
+    return jsonify({'error': str(e)}), 400
+
+
+def job_status_payload(job: Dict[str, Any]) -> Dict[str, Any]:
     resp = {
         'status': job.get('status', 'unknown'),
         'progress': job.get('progress', 0),
@@ -260,35 +907,230 @@ def job_status(job_id: str):
         'total_pages': job.get('total_pages', 0),
         'current_page': job.get('current_page', 0),
     }
+    if resp['status'] == 'queued':
+        resp['queue_position'] = job.get('queue_position', 0)
+        resp['priority'] = job.get('priority', 'interactive')
+    if resp['status'] == 'processing':
+        resp['ready_pages'] = job.get('ready_pages', 0)
+    if job.get('output_format', 'pdf') != 'pdf':
+        resp['output_format'] = job['output_format']
+    if job.get('page_selection'):
+        # Pages of the uploaded PDF the job covers (pages= on upload).
+        resp['page_selection'] = job['page_selection']
     if resp['status'] == 'completed':
         resp['filename'] = job.get('filename')
         resp['pages_processed'] = job.get('pages_processed', 0)
     if resp['status'] == 'error':
         resp['error'] = job.get('error', 'Error desconocido')
-    return jsonify(resp)
+    if 'languages' in job:
+        # Pages recognized with each language set.
+        resp['languages'] = job['languages']
+    if 'timings' in job:
+        resp['timings'] = job['timings']
+    return resp
+
+
+def job_lookup_error(job_id: str, job: Dict[str, Any] | None):
+    """404 response when ``job`` is not an OCR job (missing, or a batch), else None."""
+    if job is None:
+        return jsonify({'error': 'Job no encontrado'}), 404
+    if job.get('kind') == 'batch':
+        # Batches have no status of their own; /batch/<id> reports it.
+        return jsonify({'error': f"Es un lote; consulta /batch/{job_id}", 'batch': f"/batch/{job_id}"}), 404
+    return None
+
+
+@app.route('/status/<job_id>')
+def job_status(job_id: str):
+    job = jobs.get(job_id)
+    error = job_lookup_error(job_id, job)
+    if error:
+        return error
+    return jsonify(job_status_payload(job))
+
+
+@app.route('/events/<job_id>')
+def job_events(job_id: str):
+    error = job_lookup_error(job_id, jobs.get(job_id))
+    if error:
+        return error
+    stream = job_event_stream(jobs, job_id, job_status_payload,
+                              last_event_id=request.headers.get('Last-Event-ID'))
+    return streaming_response(
+        stream,
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+@app.route('/text/<job_id>')
+def job_text(job_id: str):
+    """Text of an output=text/json job, served page by page as it is recognized.
+
+    Until the job starts writing pages the answer is 409 with Retry-After.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job no encontrado'}), 404
+    if job.get('output_format') not in TEXT_FORMATS:
+        return jsonify({'error': 'El trabajo no es de solo texto; usa /download'}), 400
+    output_path = job['output_path']
+    # Nothing to send until pages start coming out (queued, or waiting for
+    # cores): an idle stream would hold a thread and a stream slot.
+    if job.get('status') == 'queued' or (job.get('status') == 'processing' and not os.path.exists(output_path)):
+        resp = jsonify(dict(job_status_payload(job), error='El texto aún no está disponible'))
+        resp.headers['Retry-After'] = '5'
+        return resp, 409
+    poll = float(os.environ.get('SSE_POLL_SECONDS', '0.5'))
+
+    def finished() -> bool:
+        return (jobs.get(job_id) or {}).get('status', 'error') in ('completed', 'error')
+
+    def stream():
+        yield from follow_file(output_path, finished, poll=poll)
+        # Files are kept until they expire (see retention.py).
+        touch(jobs, job_id)
+
+    return streaming_response(
+        stream(),
+        mimetype=TEXT_FORMATS[job['output_format']][1],
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+def selected_pages(job: Dict[str, Any]) -> List[int]:
+    """Pages of the uploaded PDF that make up the job's result, in order."""
+    if job.get('page_selection'):
+        return parse_page_ranges(job['page_selection'], job['source_pages'])
+    return list(range(job.get('total_pages', 0)))
+
+
+def ready_page_sources(job: Dict[str, Any], positions: List[int]) -> Tuple[List[Tuple[str, int]], List[int]]:
+    """``(file, index)`` of each result page in ``positions``, and those not ready yet."""
+    if job.get('status') == 'completed':
+        return [(job['output_path'], i) for i in positions], []
+    published = page_sources(job.get('page_parts') or [])
+    missing = [i for i in positions if i not in published]
+    return [published[i] for i in positions if i in published], missing
+
+
+@app.route('/pages/<job_id>')
+def job_pages(job_id: str):
+    """Some pages of an OCR job (``pages=3-7``) as soon as their chunks are done.
+
+    Page numbers are those of the uploaded PDF.  ``format=pdf`` (default)
+    returns a PDF with just those pages and ``format=text``/``json`` their
+    text, as /text does.  While any of them is not ready the answer is 409
+    with the pages still missing.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job no encontrado'}), 404
+    if job.get('output_format', 'pdf') != 'pdf' or job.get('method') == 'text':
+        return jsonify({'error': 'Solo para trabajos de OCR a PDF; usa /text o /download'}), 400
+    fmt = request.args.get('format', 'pdf').strip().lower() or 'pdf'
+    if fmt != 'pdf' and fmt not in TEXT_FORMATS:
+        return jsonify({'error': f"Formato no válido: {fmt} (usa pdf, {', '.join(TEXT_FORMATS)})"}), 400
+    covered = selected_pages(job)
+    position = {page: i for i, page in enumerate(covered)}
+    try:
+        wanted = parse_page_ranges(request.args.get('pages') or format_page_ranges(covered),
+                                   job.get('source_pages', job.get('total_pages', 0)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    outside = [page for page in wanted if page not in position]
+    if outside:
+        return jsonify({
+            'error': f"Páginas que no forman parte del trabajo: {format_page_ranges(outside)}",
+        }), 400
+
+    for _ in range(2):
+        if job.get('status') == 'error':
+            return jsonify({'error': job.get('error', 'Error desconocido')}), 409
+        sources, missing = ready_page_sources(job, [position[page] for page in wanted])
+        if missing:
+            resp = jsonify({
+                'error': 'Las páginas pedidas aún no están listas',
+                'missing': format_page_ranges([covered[i] for i in missing]),
+                'ready_pages': job.get('ready_pages', 0),
+            })
+            resp.headers['Retry-After'] = '5'
+            return resp, 409
+        if all(os.path.exists(path) for path, _ in sources):
+            break
+        # Published parts are removed once the job completes: read it again.
+        job = jobs.get(job_id) or {}
+    else:
+        return jsonify({'error': 'Archivo no encontrado'}), 404
+
+    touch(jobs, job_id)
+    if fmt in TEXT_FORMATS:
+        body = []
+        for page, (path, index) in zip(wanted, sources):
+            result = text_layer_page(path, index, boxes=bool(job.get('word_boxes')))
+            result.page = page
+            body.append(format_page(result, fmt))
+        return Response(''.join(body), mimetype=TEXT_FORMATS[fmt][1])
+    with tempfile.TemporaryDirectory(prefix="ocrpages_") as tmp:
+        pages_path = os.path.join(tmp, 'pages.pdf')
+        assemble_pages(sources, pages_path)
+        with open(pages_path, 'rb') as f:
+            data = io.BytesIO(f.read())
+    spec = format_page_ranges(wanted).replace(',', '_')
+    return send_file(
+        data,
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=f"{os.path.splitext(job['filename'])[0]}_p{spec}.pdf",
+        max_age=0,
+    )
+
+
+@app.route('/metrics')
+def metrics():
+    return Response(
+        get_metrics().render(job_gauges(jobs)),
+        mimetype='text/plain; version=0.0.4; charset=utf-8',
+    )
+
+
+def send_result(job_id: str, job: Dict[str, Any]):
+    """Sends a finished job's output file.
+
+    ``send_file`` answers Range (206) and If-Range/ETag requests, so an
+    interrupted download resumes where it stopped, and the body goes out
+    via sendfile() (or X-Sendfile with USE_X_SENDFILE=1).  The file is not
+    deleted here; the sweeper removes it once it expires.
+    """
+    file_path = job.get('output_path')
+    if job.get('status') != 'completed' or not file_path or not os.path.exists(file_path):
+        return jsonify({'error': 'Archivo no encontrado'}), 404
+    touch(jobs, job_id)
+    return send_file(
+        file_path,
+        as_attachment=True,
+        download_name=job['filename'],
+        conditional=True,
+        max_age=0,
+    )
+
+
+@app.route('/result/<job_id>')
+def download_result(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job no encontrado'}), 404
+    return send_result(job_id, job)
 
 
 @app.route('/download/<filename>')
 def download_file(filename: str):
-    file_path = os.path.join(app.config['OUTPUT_FOLDER'], filename)
-    if not os.path.exists(file_path):
+    # Indexed lookup by output filename (see job_store.py).
+    found = jobs.find(filename=secure_filename(filename))
+    if found is None:
         return jsonify({'error': 'Archivo no encontrado'}), 404
-    response = send_file(file_path, as_attachment=True, download_name=filename)
-    @response.call_on_close
-    def cleanup():
-        try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-            for jid, data in list(jobs.items()):
-                if data.get('filename') == filename:
-                    in_path = data.get('input_path')
-                    if in_path and os.path.exists(in_path):
-                        os.remove(in_path)
-                    del jobs[jid]
-                    break
-        except Exception:
-            pass
-    return response
+    job_id, job = found
+    return send_result(job_id, job)
 
 
 if __name__ == '__main__':
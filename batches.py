@@ -0,0 +1,169 @@
+"""Lotes: varios PDFs (o un ZIP) bajo un mismo identificador.
+
+Cada documento del lote es un trabajo normal (con su registro en el
+almacén de trabajos y su entrada en el planificador); el lote es un
+registro más (``kind='batch'``) con la lista de trabajos, de modo que
+/batch/<id> puede agregar el progreso y, cuando han terminado todos,
+/batch/<id>/download sirve un ZIP que se escribe mientras se envía, sin
+construir el archivo en disco.  Mientras quede alguno en marcha la
+descarga responde 409: una respuesta que espera sin enviar nada retendría
+un hilo de gunicorn y no notaría que el cliente se ha ido.
+"""
+from __future__ import annotations
+
+import io
+import os
+import time
+import zipfile
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from uploads import PDFUpload, UploadRejected
+
+FINISHED = ('completed', 'error')
+
+
+def batch_limits() -> Tuple[int, int]:
+    """(máximo de documentos, máximo de bytes descomprimidos) por lote."""
+    return (
+        int(os.environ.get('OCR_BATCH_MAX_FILES', '100')),
+        int(os.environ.get('OCR_BATCH_MAX_MB', '500')) * 1024 * 1024,
+    )
+
+
+def expand_uploads(files: Sequence[Any], directory: str
+                   ) -> Iterator[Tuple[str, Optional[PDFUpload], Optional[str]]]:
+    """Recorre los archivos recibidos desempaquetando los ZIP.
+
+    Produce ``(nombre, subida, None)`` por cada PDF y ``(nombre, None,
+    error)`` por cada archivo rechazado.  Respeta los límites de
+    ``batch_limits`` (número de documentos y tamaño descomprimido).
+    """
+    max_files, max_bytes = batch_limits()
+    count = total = 0
+    for storage in files:
+        upload = storage.stream
+        if not isinstance(upload, PDFUpload) or not upload.is_zip:
+            count += 1
+            if count > max_files:
+                upload.discard()
+                yield storage.filename, None, f"El lote supera el máximo de {max_files} documentos"
+                continue
+            yield storage.filename, upload, None
+            continue
+        upload.flush()
+        try:
+            with zipfile.ZipFile(upload.path) as archive:
+                for info in archive.infolist():
+                    name = info.filename
+                    if info.is_dir() or name.startswith('__MACOSX/') or not name.lower().endswith('.pdf'):
+                        continue
+                    count += 1
+                    total += info.file_size
+                    if count > max_files:
+                        yield name, None, f"El lote supera el máximo de {max_files} documentos"
+                        continue
+                    if total > max_bytes:
+                        yield name, None, "El lote supera el tamaño máximo descomprimido"
+                        continue
+                    try:
+                        with archive.open(info) as member:
+                            yield os.path.basename(name), PDFUpload.from_fileobj(member, directory), None
+                    except (UploadRejected, zipfile.BadZipFile, OSError) as e:
+                        yield name, None, str(e)
+        except zipfile.BadZipFile:
+            yield storage.filename, None, "ZIP dañado o ilegible"
+        finally:
+            upload.discard()
+
+
+def batch_status(jobs, batch: Dict[str, Any]) -> Dict[str, Any]:
+    """Progreso agregado del lote (ponderado por páginas) y estado de cada documento."""
+    documents = []
+    weighted = weight = 0.0
+    counts = {'queued': 0, 'processing': 0, 'completed': 0, 'error': 0}
+    for job_id in batch.get('job_ids', []):
+        job = jobs.get(job_id) or {'status': 'error', 'error': 'Trabajo no encontrado'}
+        status = job.get('status', 'queued')
+        counts[status] = counts.get(status, 0) + 1
+        pages = max(1, job.get('total_pages') or 1)
+        progress = 100 if status in FINISHED else job.get('progress', 0)
+        weighted += progress * pages
+        weight += pages
+        entry = {
+            'job_id': job_id,
+            'source': job.get('source_name'),
+            'filename': job.get('filename'),
+            'status': status,
+            'progress': progress,
+            'total_pages': job.get('total_pages', 0),
+        }
+        if status == 'error':
+            entry['error'] = job.get('error', 'Error desconocido')
+        documents.append(entry)
+    finished = counts['completed'] + counts['error']
+    return {
+        'batch_id': batch.get('batch_id'),
+        'status': 'completed' if finished == len(documents) else 'processing',
+        'progress': int(weighted / weight) if weight else 100,
+        'total': len(documents),
+        'counts': counts,
+        'documents': documents,
+        'rejected': batch.get('rejected', []),
+    }
+
+
+class _ZipSink(io.RawIOBase):
+    """Destino no posicionable para ``zipfile``: acumula lo escrito hasta vaciarlo."""
+
+    def __init__(self) -> None:
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _unique(name: str, used: Set[str]) -> str:
+    base, ext = os.path.splitext(name)
+    candidate, n = name, 2
+    while candidate in used:
+        candidate = f"{base}_{n}{ext}"
+        n += 1
+    used.add(candidate)
+    return candidate
+
+
+def stream_batch_zip(jobs, batch: Dict[str, Any]) -> Iterator[bytes]:
+    """Genera un ZIP con las salidas de un lote ya terminado.
+
+    Los errores (y los archivos rechazados al recibir el lote) se listan al
+    final en ERRORES.txt.
+    """
+    sink = _ZipSink()
+    archive = zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED)
+    errors = [f"{r['filename']}: {r['error']}" for r in batch.get('rejected', [])]
+    used: Set[str] = set()
+    for job_id in batch.get('job_ids', []):
+        job = jobs.get(job_id) or {}
+        output = job.get('output_path')
+        if job.get('status') != 'completed' or not output or not os.path.exists(output):
+            errors.append(f"{job.get('source_name', job_id)}: {job.get('error', 'sin resultado')}")
+            continue
+        info = zipfile.ZipInfo(_unique(job['filename'], used), time.localtime()[:6])
+        with archive.open(info, 'w', force_zip64=True) as dest, open(output, 'rb') as src:
+            for block in iter(lambda: src.read(1024 * 1024), b''):
+                dest.write(block)
+                yield sink.drain()
+        yield sink.drain()
+    if errors:
+        archive.writestr('ERRORES.txt', '\n'.join(errors) + '\n')
+    archive.close()
+    yield sink.drain()
@@ -0,0 +1,333 @@
+"""Banco de pruebas de rendimiento de la canalización de OCR.
+
+Genera PDFs escaneados sintéticos y deterministas (texto renderizado y
+rasterizado en una imagen por página, con una ligera inclinación y ruido),
+ejecuta ``process_pdf_with_ocr`` y las etapas ``split_pdf``,
+``run_ocrmypdf`` y ``merge_pdfs`` por separado, y emite un JSON con
+páginas/segundo, latencia por etapa, pico de memoria RSS (proceso e hijos)
+y uso máximo de disco temporal.
+
+Uso:
+
+    python benchmark.py --pages 5 50 200 --dpi 200 300 --output run.json
+    python benchmark.py --pages 50 --baseline run.json
+
+La configuración de OCR se toma del entorno como en la aplicación
+(PAGES_PER_CHUNK, OCR_PARALLEL_CHUNKS, OCR_ENGINE, OCR_LANGUAGE...), así que
+para comparar dos ajustes basta con lanzar el banco dos veces en la misma
+máquina cambiando las variables.  Por defecto se desactiva la caché de
+resultados para que cada ejecución haga OCR de verdad.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import importlib
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+WORDS = (
+    "el la de que y en los se del las un por con no una su para es al lo como "
+    "más pero sus le ya o este sí porque esta entre cuando muy sin sobre también "
+    "contrato factura importe fecha cliente proveedor artículo cantidad total "
+    "the of and to in is that for it as with was on be by this document page"
+).split()
+
+A4_INCHES = (8.27, 11.69)
+
+
+# ---------------------------------------------------------------------------
+#  Generación de PDFs sintéticos
+# ---------------------------------------------------------------------------
+def render_page(page_number: int, dpi: int, seed: int):
+    from PIL import Image, ImageDraw, ImageFont
+
+    rng = random.Random(seed * 100003 + page_number)
+    width, height = int(A4_INCHES[0] * dpi), int(A4_INCHES[1] * dpi)
+    img = Image.new('L', (width, height), 255)
+    draw = ImageDraw.Draw(img)
+    font_size = max(10, dpi // 7)
+    try:
+        font = ImageFont.load_default(size=font_size)
+    except TypeError:
+        # Pillow < 10.1 no admite tamaño en la fuente por defecto.
+        font = ImageFont.load_default()
+    margin = dpi // 2
+    y = margin
+    draw.text((margin, y), f"Página {page_number + 1}", fill=0, font=font)
+    y += font_size * 2
+    while y < height - margin - font_size:
+        line = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 12)))
+        draw.text((margin, y), line.capitalize() + ".", fill=0, font=font)
+        y += int(font_size * 1.5)
+    for _ in range(width * height // 20000):
+        draw.point((rng.randrange(width), rng.randrange(height)), fill=rng.randrange(0, 128))
+    return img.rotate(rng.uniform(-1.5, 1.5), fillcolor=255)
+
+
+def generate_scanned_pdf(path: str, pages: int, dpi: int, seed: int = 1) -> str:
+    """Escribe un PDF de ``pages`` páginas escaneadas a ``dpi``.
+
+    Cada página se guarda como PDF independiente y luego se unen, para no
+    tener todas las imágenes en memoria a la vez.
+    """
+    from pdf_tools import merge_pdfs
+
+    with tempfile.TemporaryDirectory(prefix='bench_gen_') as tmp:
+        parts = []
+        for n in range(pages):
+            part = os.path.join(tmp, f"{n:05d}.pdf")
+            render_page(n, dpi, seed).save(part, 'PDF', resolution=dpi)
+            parts.append(part)
+        merge_pdfs(parts, path)
+    return path
+
+
+# ---------------------------------------------------------------------------
+#  Medición
+# ---------------------------------------------------------------------------
+def _rss_bytes(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _descendants(pid: int) -> List[int]:
+    found: List[int] = []
+    try:
+        tasks = os.listdir(f"/proc/{pid}/task")
+    except OSError:
+        return found
+    for tid in tasks:
+        try:
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                children = [int(c) for c in f.read().split()]
+        except OSError:
+            continue
+        for child in children:
+            found.append(child)
+            found.extend(_descendants(child))
+    return found
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class Sampler:
+    """Muestrea RSS (proceso + descendientes) y disco temporal en segundo plano."""
+
+    def __init__(self, temp_dir: str, interval: float = 0.05) -> None:
+        self.temp_dir = temp_dir
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_temp = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        pid = os.getpid()
+        while not self._stop.is_set():
+            rss = _rss_bytes(pid) + sum(_rss_bytes(c) for c in _descendants(pid))
+            self.peak_rss = max(self.peak_rss, rss)
+            self.peak_temp = max(self.peak_temp, _dir_size(self.temp_dir))
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> 'Sampler':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def measure(fn: Callable[[], Any], temp_dir: str) -> Dict[str, Any]:
+    with Sampler(temp_dir) as sampler:
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+    return {
+        'seconds': round(elapsed, 3),
+        'peak_rss_mb': round(sampler.peak_rss / (1024 * 1024), 1),
+        'peak_temp_mb': round(sampler.peak_temp / (1024 * 1024), 1),
+    }
+
+
+# ---------------------------------------------------------------------------
+#  Casos
+# ---------------------------------------------------------------------------
+def bench_stages(app_module, pdf_path: str, pages: int, temp_dir: str) -> Dict[str, Any]:
+    from pdf_tools import merge_pdfs, split_pdf
+
+    pages_per_chunk = int(os.environ.get('PAGES_PER_CHUNK', '25'))
+    lang = os.environ.get('OCR_LANGUAGE', 'spa+eng')
+    ocr_timeout = int(os.environ.get('OCR_TIMEOUT_SECONDS', '1200'))
+    work = tempfile.mkdtemp(dir=temp_dir)
+    try:
+        chunks: List[str] = []
+        split = measure(lambda: chunks.extend(split_pdf(pdf_path, work, pages_per_chunk)), temp_dir)
+
+        outputs = [c[:-4] + '_ocr.pdf' for c in chunks]
+        ocr_runs = []
+        for chunk, out in zip(chunks, outputs):
+            ocr_runs.append(measure(
+                lambda c=chunk, o=out: app_module.run_ocrmypdf(c, o, lang=lang, timeout=ocr_timeout),
+                temp_dir
+            ))
+        ocr_seconds = sum(r['seconds'] for r in ocr_runs)
+
+        merged = os.path.join(work, 'merged.pdf')
+        merge = measure(lambda: merge_pdfs(outputs, merged), temp_dir)
+        return {
+            'split_pdf': split,
+            'run_ocrmypdf': {
+                'chunks': len(ocr_runs),
+                'seconds': round(ocr_seconds, 3),
+                'seconds_per_chunk': [r['seconds'] for r in ocr_runs],
+                'pages_per_second': round(pages / ocr_seconds, 3) if ocr_seconds else None,
+                'peak_rss_mb': max((r['peak_rss_mb'] for r in ocr_runs), default=0),
+                'peak_temp_mb': max((r['peak_temp_mb'] for r in ocr_runs), default=0),
+            },
+            'merge_pdfs': merge,
+        }
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def bench_pipeline(app_module, pdf_path: str, pages: int, temp_dir: str) -> Dict[str, Any]:
+    job_id = f"bench-{os.getpid()}-{time.time_ns()}"
+    output = os.path.join(temp_dir, f"{job_id}.pdf")
+    app_module.jobs.create(job_id, status='queued', progress=0, message='')
+    try:
+        result = measure(lambda: app_module.process_pdf_with_ocr(job_id, pdf_path, output), temp_dir)
+        job = app_module.jobs.get(job_id) or {}
+        if job.get('status') != 'completed':
+            raise RuntimeError(f"process_pdf_with_ocr terminó con estado {job.get('status')}: {job.get('error')}")
+        result['pages_per_second'] = round(pages / result['seconds'], 3) if result['seconds'] else None
+        result['output_mb'] = round(os.path.getsize(output) / (1024 * 1024), 2)
+        return result
+    finally:
+        app_module.jobs.delete(job_id)
+        if os.path.exists(output):
+            os.remove(output)
+
+
+def environment_info() -> Dict[str, Any]:
+    keys = (
+        'PAGES_PER_CHUNK', 'OCR_PARALLEL_CHUNKS', 'OCR_ENGINE', 'OCR_ENGINE_WORKERS',
+        'OCR_LANGUAGE', 'OCR_PAGE_TRIAGE', 'OCR_CACHE', 'OCR_TIMEOUT_SECONDS',
+    )
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'config': {k: os.environ[k] for k in keys if k in os.environ},
+    }
+
+
+def compare(results: Dict[str, Any], baseline_path: str) -> List[str]:
+    with open(baseline_path) as f:
+        baseline = {c['case']: c for c in json.load(f)['cases']}
+    lines = []
+    for case in results['cases']:
+        old = baseline.get(case['case'])
+        if not old or 'pipeline' not in old or 'pipeline' not in case:
+            continue
+        before, after = old['pipeline']['seconds'], case['pipeline']['seconds']
+        lines.append(f"{case['case']}: {before:.2f}s -> {after:.2f}s (x{before / after:.2f})")
+    return lines
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--pages', type=int, nargs='+', default=[5, 25, 100])
+    parser.add_argument('--dpi', type=int, nargs='+', default=[300])
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--app', default='app_fixed', help='módulo con process_pdf_with_ocr (app o app_fixed)')
+    parser.add_argument('--skip-stages', action='store_true', help='medir solo process_pdf_with_ocr')
+    parser.add_argument('--skip-pipeline', action='store_true', help='medir solo las etapas')
+    parser.add_argument('--use-cache', action='store_true', help='no desactivar la caché de resultados')
+    parser.add_argument('--corpus-dir', help='dónde guardar/reutilizar los PDFs sintéticos')
+    parser.add_argument('--output', help='archivo JSON de resultados (por defecto, stdout)')
+    parser.add_argument('--baseline', help='JSON de una ejecución anterior con la que comparar')
+    parser.add_argument('--profile', help='perfil de preprocesado (fast, balanced, quality; ver preprocess.py)')
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('JOB_STORE', 'memory')
+    if args.profile:
+        os.environ['OCR_PROFILE'] = args.profile
+    if not args.use_cache:
+        os.environ['OCR_CACHE'] = '0'
+
+    # Todo lo temporal (fragmentos, ocrmypdf) va a un directorio propio
+    # para poder medir su tamaño.
+    temp_dir = tempfile.mkdtemp(prefix='ocr_bench_')
+    os.environ['TMPDIR'] = temp_dir
+    tempfile.tempdir = temp_dir
+    corpus_dir = args.corpus_dir or os.path.join(temp_dir, 'corpus')
+    os.makedirs(corpus_dir, exist_ok=True)
+
+    app_module = importlib.import_module(args.app)
+    results: Dict[str, Any] = {
+        'environment': environment_info(),
+        'app': args.app,
+        'profile': os.environ.get('OCR_PROFILE', 'balanced'),
+        'cases': [],
+    }
+    try:
+        for dpi in args.dpi:
+            for pages in args.pages:
+                case = f"{pages}p_{dpi}dpi"
+                pdf_path = os.path.join(corpus_dir, f"synthetic_{case}_s{args.seed}.pdf")
+                if not os.path.exists(pdf_path):
+                    generate_scanned_pdf(pdf_path, pages, dpi, args.seed)
+                entry: Dict[str, Any] = {
+                    'case': case,
+                    'pages': pages,
+                    'dpi': dpi,
+                    'input_mb': round(os.path.getsize(pdf_path) / (1024 * 1024), 2),
+                }
+                print(f"[bench] {case}...", file=sys.stderr)
+                if not args.skip_stages:
+                    entry['stages'] = bench_stages(app_module, pdf_path, pages, temp_dir)
+                if not args.skip_pipeline:
+                    entry['pipeline'] = bench_pipeline(app_module, pdf_path, pages, temp_dir)
+                results['cases'].append(entry)
+    finally:
+        # Los PDFs de --corpus-dir quedan fuera de temp_dir y se conservan.
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.baseline:
+        for line in compare(results, args.baseline):
+            print(line, file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
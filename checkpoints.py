@@ -0,0 +1,180 @@
+"""Puntos de control por fragmento para reanudar trabajos interrumpidos.
+
+Cada fragmento reconocido se guarda en un directorio persistente
+(OCR_CHECKPOINT_DIR) junto con un manifiesto JSON que indica qué páginas
+del documento contiene.  El directorio se identifica por el contenido del
+PDF y la configuración de OCR, así que lo encuentran tanto el mismo
+trabajo cuando se reanuda tras reiniciar un worker como un trabajo nuevo
+si el usuario vuelve a subir el mismo archivo.
+
+Dos trabajos sobre el mismo documento (hilos o procesos distintos)
+comparten el directorio: cada uno mantiene mientras lo usa un bloqueo
+compartido sobre ``<directorio>.users`` y los cambios se hacen con el
+bloqueo exclusivo de ``<directorio>.lock``, ambos con ``flock`` como en
+cpu_budget.py.  El punto de control se borra cuando termina el último
+trabajo que lo usa; los abandonados se eliminan pasadas
+OCR_CHECKPOINT_TTL_HOURS.  OCR_CHECKPOINTS=0 lo desactiva.
+"""
+from __future__ import annotations
+
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from typing import IO, Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from ocr_cache import file_digest, settings_digest
+
+MANIFEST = 'manifest.json'
+LOCK_SUFFIXES = ('.lock', '.users')
+
+
+def _open_locked(path: str, operation: int) -> IO[str]:
+    """Abre ``path`` y toma sobre él el ``flock`` ``operation``."""
+    while True:
+        f = open(path, 'a')
+        fcntl.flock(f, operation)
+        # El barrido pudo borrar el archivo mientras se esperaba el bloqueo:
+        # un bloqueo sobre un archivo que ya no existe no excluye a nadie.
+        try:
+            if os.fstat(f.fileno()).st_ino == os.stat(path).st_ino:
+                return f
+        except OSError:
+            pass
+        f.close()
+
+
+def _remove_if_unused(directory: str) -> bool:
+    """Borra ``directory`` si ningún trabajo lo usa; con su ``.lock`` ya tomado."""
+    users = open(directory + '.users', 'a')
+    try:
+        fcntl.flock(users, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        users.close()
+        return False
+    shutil.rmtree(directory, ignore_errors=True)
+    users.close()
+    return True
+
+
+class ChunkCheckpoint:
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        os.makedirs(os.path.dirname(directory), exist_ok=True)
+        # Presencia de este trabajo hasta ``clear`` o ``release``.
+        self._user: Optional[IO[str]] = _open_locked(directory + '.users', fcntl.LOCK_SH)
+        os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        f = _open_locked(self.directory + '.lock', fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            f.close()
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.directory, MANIFEST)
+
+    def _read(self) -> Dict[str, Any]:
+        try:
+            with open(self._manifest_path()) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'chunks': []}
+
+    def _write(self, manifest: Dict[str, Any]) -> None:
+        manifest['updated_at'] = time.time()
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, self._manifest_path())
+
+    def completed(self) -> List[Tuple[List[int], str]]:
+        """Fragmentos ya reconocidos: (páginas del documento, PDF con OCR)."""
+        with self._locked():
+            chunks = self._read()['chunks']
+        result = []
+        for chunk in chunks:
+            path = os.path.join(self.directory, chunk['file'])
+            if os.path.exists(path):
+                result.append((chunk['pages'], path))
+        return result
+
+    def add(self, pages: Sequence[int], ocr_pdf_path: str) -> str:
+        """Mueve ``ocr_pdf_path`` al punto de control y devuelve su nueva ruta."""
+        name = f"pages_{pages[0] + 1:05d}_{pages[-1] + 1:05d}_{len(pages)}.pdf"
+        dest = os.path.join(self.directory, name)
+        with self._locked():
+            os.makedirs(self.directory, exist_ok=True)
+            shutil.move(ocr_pdf_path, dest)
+            manifest = self._read()
+            manifest['chunks'] = [c for c in manifest['chunks'] if c['file'] != name]
+            manifest['chunks'].append({'pages': list(pages), 'file': name})
+            self._write(manifest)
+        return dest
+
+    def clear(self) -> None:
+        """Deja de usar el punto de control y lo borra si nadie más lo usa."""
+        with self._locked():
+            self.release()
+            _remove_if_unused(self.directory)
+
+    def release(self) -> None:
+        """Deja de usar el punto de control sin borrarlo (para reanudar)."""
+        user, self._user = self._user, None
+        if user is not None:
+            user.close()
+
+
+def _sweep(root: str, ttl_seconds: float) -> None:
+    now = time.time()
+    try:
+        entries = os.listdir(root)
+    except OSError:
+        return
+    for name in entries:
+        path = os.path.join(root, name)
+        if name.endswith(LOCK_SUFFIXES):
+            # Los archivos de bloqueo de puntos de control ya borrados.
+            stamp_path, path = path, os.path.splitext(path)[0]
+            if os.path.exists(path):
+                continue
+        else:
+            # Sin manifiesto: el trabajo no llegó a terminar ningún fragmento.
+            stamp_path = os.path.join(path, MANIFEST)
+            if not os.path.exists(stamp_path):
+                stamp_path = path
+        try:
+            stamp = os.path.getmtime(stamp_path)
+        except OSError:
+            continue
+        if now - stamp > ttl_seconds:
+            lock = _open_locked(path + '.lock', fcntl.LOCK_EX)
+            try:
+                if _remove_if_unused(path):
+                    for suffix in LOCK_SUFFIXES:
+                        try:
+                            os.unlink(path + suffix)
+                        except OSError:
+                            pass
+            finally:
+                lock.close()
+
+
+def open_checkpoint(pdf_path: str, settings: Dict[str, Any],
+                    digest: Optional[str] = None) -> Optional[ChunkCheckpoint]:
+    """Punto de control de ``pdf_path`` con ``settings``, o ``None`` si está desactivado.
+
+    ``digest`` es el SHA-256 del archivo si ya se calculó al recibirlo.
+    """
+    if os.environ.get('OCR_CHECKPOINTS', '1') == '0':
+        return None
+    root = os.environ.get('OCR_CHECKPOINT_DIR', '/tmp/ocr_checkpoints')
+    _sweep(root, float(os.environ.get('OCR_CHECKPOINT_TTL_HOURS', '24')) * 3600)
+    key = hashlib.sha256(f"{digest or file_digest(pdf_path)}:{settings_digest(settings)}".encode()).hexdigest()
+    return ChunkCheckpoint(os.path.join(root, key))
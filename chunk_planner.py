@@ -0,0 +1,201 @@
+"""Tamaño de fragmento adaptado al coste medido de las páginas.
+
+En lugar de cortar cada PAGES_PER_CHUNK páginas, se estima el coste de
+cada página en "unidades" (1.0 = página A4 escaneada a 300 ppp) a partir
+de la resolución y el tamaño de sus imágenes, y se convierte a segundos
+con ``CostModel``, que aprende de los segundos por unidad observados en
+los fragmentos recientes.
+
+``plan_chunks`` reparte las páginas en fragmentos contiguos de coste
+parecido, en un número múltiplo de los workers (para que ninguno quede
+parado con un fragmento enorme al lado de otros triviales), sin superar
+PAGES_PER_CHUNK páginas ni una fracción de OCR_TIMEOUT_SECONDS por
+fragmento.  OCR_ADAPTIVE_CHUNKS=0 vuelve al corte fijo.
+"""
+from __future__ import annotations
+
+import os
+import json
+import math
+import tempfile
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from ocr_pipeline import chunk_groups
+from pdf_tools import page_image_stats
+
+# Página de referencia: A4 a 300 ppp, unos 500 KB de imagen comprimida.
+REFERENCE_DPI = 300
+REFERENCE_PIXELS = 8.27 * 11.69 * REFERENCE_DPI * REFERENCE_DPI
+REFERENCE_BYTES = 500 * 1024
+
+# Fracción de OCR_TIMEOUT_SECONDS que puede ocupar un fragmento estimado:
+# deja margen para errores de la estimación.
+TIMEOUT_SAFETY = 0.5
+
+
+def page_cost_units(stats: Sequence[Tuple[int, int, float]]) -> List[float]:
+    """Coste relativo de cada página a partir de ``pdf_tools.page_image_stats``.
+
+    Tesseract escala aproximadamente con los píxeles; el tamaño comprimido
+    añade algo de peso a las páginas con mucho contenido o ruido.  Una
+    página sin imágenes se rasteriza, así que cuenta como su área a
+    REFERENCE_DPI.
+    """
+    units = []
+    for pixels, size, area in stats:
+        if not pixels:
+            pixels = area * REFERENCE_DPI * REFERENCE_DPI
+        pixel_ratio = min(pixels / REFERENCE_PIXELS, 4.0)
+        byte_ratio = min(size / REFERENCE_BYTES, 4.0)
+        units.append(0.15 + 0.85 * (0.8 * pixel_ratio + 0.2 * byte_ratio))
+    return units
+
+
+class CostModel:
+    """Segundos de OCR por unidad de coste (media móvil exponencial).
+
+    Con ``path`` el valor se guarda en un JSON compartido por todos los
+    procesos y sobrevive a los reinicios.
+    """
+
+    def __init__(self, initial: float, path: Optional[str] = None, alpha: float = 0.3) -> None:
+        self.path = path
+        self.alpha = alpha
+        self._value = initial
+        self._mtime = 0.0
+        self._lock = threading.Lock()
+        if path and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def _reload(self) -> None:
+        if not self.path:
+            return
+        try:
+            mtime = os.path.getmtime(self.path)
+            if mtime != self._mtime:
+                with open(self.path) as f:
+                    self._value = float(json.load(f)['seconds_per_unit'])
+                self._mtime = mtime
+        except (OSError, ValueError, KeyError):
+            pass
+
+    @property
+    def seconds_per_unit(self) -> float:
+        with self._lock:
+            self._reload()
+            return self._value
+
+    def observe(self, units: float, seconds: float) -> None:
+        if units <= 0 or seconds <= 0:
+            return
+        with self._lock:
+            self._reload()
+            # Un fragmento anómalo no puede mover la estimación más de x4.
+            observed = min(max(seconds / units, self._value / 4), self._value * 4)
+            self._value += self.alpha * (observed - self._value)
+            if self.path:
+                fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.', suffix='.tmp')
+                with os.fdopen(fd, 'w') as f:
+                    json.dump({'seconds_per_unit': self._value}, f)
+                os.replace(tmp, self.path)
+                self._mtime = os.path.getmtime(self.path)
+
+
+def _pack(units: Sequence[float], cap: float, max_pages: int) -> List[int]:
+    """Índices de inicio de cada fragmento al llenar hasta ``cap`` unidades."""
+    starts = [0]
+    current = 0.0
+    for i, u in enumerate(units):
+        if i > starts[-1] and (i - starts[-1] >= max_pages or current + u > cap):
+            starts.append(i)
+            current = 0.0
+        current += u
+    return starts
+
+
+def plan_chunks(pages: Sequence[int], units: Sequence[float], workers: int,
+                seconds_per_unit: float, timeout: float, max_pages: int,
+                min_chunk_seconds: float = 20.0) -> List[List[int]]:
+    """Agrupa ``pages`` (con coste ``units``) en fragmentos contiguos equilibrados.
+
+    Elige el número de fragmentos (múltiplo de ``workers``) y después el
+    menor coste máximo por fragmento con el que caben en ese número.
+    """
+    pages = list(pages)
+    if not pages:
+        return []
+    workers = max(1, workers)
+    max_pages = max(1, max_pages)
+    total = sum(units)
+    budget = max(timeout * TIMEOUT_SAFETY / seconds_per_unit, max(units))
+
+    needed = len(_pack(units, budget, max_pages))
+    n = max(workers, math.ceil(total / budget), needed)
+    # Cada fragmento arranca ocrmypdf de nuevo: por debajo de
+    # ``min_chunk_seconds`` solo compensa repartir entre workers.
+    if total * seconds_per_unit / n < min_chunk_seconds:
+        n = min(n, math.floor(total * seconds_per_unit / min_chunk_seconds))
+    n = max(workers, n, needed)
+    # Un múltiplo de los workers, salvo que no haya páginas para tantos.
+    n = min(math.ceil(n / workers) * workers, len(pages))
+
+    low, high = max(max(units), total / n), budget
+    for _ in range(30):
+        mid = (low + high) / 2
+        if len(_pack(units, mid, max_pages)) <= n:
+            high = mid
+        else:
+            low = mid
+    starts = _pack(units, high, max_pages)
+    # El empaquetado puede dejar menos fragmentos que ``n``: se parten los
+    # más caros (partir no supera ningún tope).
+    while len(starts) < n:
+        starts = _split_heaviest(units, starts)
+    starts.append(len(pages))
+    return [pages[a:b] for a, b in zip(starts, starts[1:])]
+
+
+def _split_heaviest(units: Sequence[float], starts: List[int]) -> List[int]:
+    """``starts`` con el fragmento más caro de más de una página partido en dos."""
+    bounds = list(zip(starts, starts[1:] + [len(units)]))
+    a, b = max((bound for bound in bounds if bound[1] - bound[0] > 1),
+               key=lambda bound: sum(units[bound[0]:bound[1]]))
+    # Corte por el punto que deja las dos mitades más parecidas.
+    total = sum(units[a:b])
+    best, prefix, cut = total, 0.0, a + 1
+    for i in range(a + 1, b):
+        prefix += units[i - 1]
+        if max(prefix, total - prefix) < best:
+            best, cut = max(prefix, total - prefix), i
+    return sorted(starts + [cut])
+
+
+def plan_document_chunks(pdf_path: str, pages: Sequence[int], workers: int, timeout: float,
+                         max_pages: int) -> Tuple[List[List[int]], Dict[int, float]]:
+    """Fragmentos para ``pages`` de ``pdf_path`` y coste estimado de cada página.
+
+    Con OCR_ADAPTIVE_CHUNKS=0 se corta cada ``max_pages`` páginas y no se
+    devuelven costes (no hay nada que aprender).
+    """
+    if os.environ.get('OCR_ADAPTIVE_CHUNKS', '1') == '0' or not pages:
+        return chunk_groups(pages, max_pages), {}
+    units = page_cost_units(page_image_stats(pdf_path, pages))
+    groups = plan_chunks(pages, units, workers, get_cost_model().seconds_per_unit, timeout, max_pages)
+    return groups, dict(zip(pages, units))
+
+
+_model: Optional[CostModel] = None
+_model_lock = threading.Lock()
+
+
+def get_cost_model() -> CostModel:
+    """Modelo configurado con OCR_SECONDS_PER_PAGE / OCR_COST_MODEL_PATH."""
+    global _model
+    with _model_lock:
+        if _model is None:
+            path = None
+            if os.environ.get('JOB_STORE', 'sqlite').strip().lower() != 'memory':
+                path = os.environ.get('OCR_COST_MODEL_PATH', '/tmp/ocr_jobs/cost_model.json')
+            _model = CostModel(float(os.environ.get('OCR_SECONDS_PER_PAGE', '3')), path)
+        return _model
@@ -0,0 +1,161 @@
+"""Presupuesto global de núcleos para el OCR.
+
+Cada trabajo pide núcleos antes de empezar a reconocer y los devuelve al
+terminar.  El total (OCR_CPU_BUDGET, por defecto el número de CPUs) lo
+comparten todos los hilos y procesos de la máquina, workers de gunicorn
+incluidos: cada núcleo es un archivo de OCR_CPU_BUDGET_DIR sobre el que se
+toma un ``flock``, que el sistema libera solo si el proceso muere.
+
+Un trabajo recibe entre 1 y lo que pide (como mucho OCR_JOB_MAX_CPUS)
+según lo que esté libre en ese momento, y lo reparte con ``split_cores``
+entre fragmentos en paralelo y páginas en paralelo dentro de cada
+fragmento (``--jobs`` de ocrmypdf).  Así un documento de pocas páginas
+subido con la máquina libre usa todos los núcleos, y varios trabajos a la
+vez no piden entre todos más núcleos de los que hay.
+
+Carriles (ver scheduler.py): un trabajo ``interactive`` reserva sus
+núcleos para todo el trabajo y, mientras espera o trabaja, mantiene un
+bloqueo compartido sobre ``interactive.lock``.  Los trabajos ``bulk`` piden
+núcleos fragmento a fragmento y, si ven ese bloqueo, dejan libres los
+OCR_INTERACTIVE_CPUS primeros núcleos: un documento interactivo que llega
+durante un lote grande empieza en cuanto termina el fragmento en curso.
+"""
+from __future__ import annotations
+
+import os
+import time
+import fcntl
+import threading
+from typing import IO, Iterable, List, Optional, Tuple
+
+
+def cpu_total() -> int:
+    return max(1, int(os.environ.get('OCR_CPU_BUDGET', str(os.cpu_count() or 1))))
+
+
+def job_cpu_limit(pages: int) -> int:
+    """Núcleos que pide un trabajo con ``pages`` páginas por reconocer."""
+    cap = int(os.environ.get('OCR_JOB_MAX_CPUS', str(cpu_total())))
+    return max(1, min(pages, cap, cpu_total()))
+
+
+def interactive_reserve() -> int:
+    """Núcleos que los trabajos ``bulk`` dejan libres si hay trabajo interactivo."""
+    total = cpu_total()
+    return max(1, min(total, int(os.environ.get('OCR_INTERACTIVE_CPUS', str(max(1, total // 2))))))
+
+
+def split_cores(cores: int, chunks: int, max_workers: Optional[int] = None) -> Tuple[int, int]:
+    """(fragmentos en paralelo, ``--jobs`` de cada uno) para ``cores`` núcleos."""
+    workers = max(1, min(cores, chunks, max_workers or cores))
+    return workers, max(1, cores // workers)
+
+
+class CpuGrant:
+    """Núcleos concedidos a un trabajo; se devuelven con ``release``."""
+
+    def __init__(self, files: List[IO[str]], presence: Optional[IO[str]] = None) -> None:
+        self._files = files
+        self._presence = presence
+
+    @property
+    def count(self) -> int:
+        return len(self._files)
+
+    def release(self) -> None:
+        files, self._files = self._files, []
+        if self._presence is not None:
+            files.append(self._presence)
+            self._presence = None
+        for f in files:
+            f.close()
+
+    def __enter__(self) -> 'CpuGrant':
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.release()
+
+
+class CpuBudget:
+    def __init__(self, directory: str, total: int) -> None:
+        self.directory = directory
+        self.total = max(1, total)
+        os.makedirs(directory, exist_ok=True)
+
+    def _open(self, name: str) -> IO[str]:
+        return open(os.path.join(self.directory, name), 'a')
+
+    def _try(self, index: int) -> Optional[IO[str]]:
+        f = self._open(f"cpu_{index:03d}.lock")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return None
+        return f
+
+    def interactive_active(self) -> bool:
+        """Si algún trabajo interactivo (de cualquier proceso) espera o trabaja."""
+        with self._open('interactive.lock') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return True
+            fcntl.flock(f, fcntl.LOCK_UN)
+            return False
+
+    def _indices(self, lane: str) -> Iterable[int]:
+        # Los interactivos empiezan por abajo y los bulk por arriba; con
+        # trabajo interactivo presente, los bulk no bajan de la reserva.
+        if lane != 'bulk':
+            return range(self.total)
+        low = interactive_reserve() if self.interactive_active() else 0
+        return range(self.total - 1, low - 1, -1)
+
+    def try_acquire(self, want: int, lane: str = 'interactive') -> CpuGrant:
+        """Hasta ``want`` núcleos libres ahora mismo (puede ser ninguno)."""
+        held: List[IO[str]] = []
+        for index in self._indices(lane):
+            if len(held) >= want:
+                break
+            f = self._try(index)
+            if f is not None:
+                held.append(f)
+        return CpuGrant(held)
+
+    def acquire(self, want: int, lane: str = 'interactive', poll: float = 0.2) -> CpuGrant:
+        """Entre 1 y ``want`` núcleos; espera si no hay ninguno libre."""
+        want = max(1, min(want, self.total))
+        presence = None
+        if lane != 'bulk':
+            presence = self._open('interactive.lock')
+            fcntl.flock(presence, fcntl.LOCK_SH)
+        try:
+            while True:
+                grant = self.try_acquire(want, lane)
+                if grant.count:
+                    grant._presence = presence
+                    return grant
+                time.sleep(poll)
+        except BaseException:
+            if presence is not None:
+                presence.close()
+            raise
+
+    def available(self) -> int:
+        with self.try_acquire(self.total) as grant:
+            return grant.count
+
+
+_budget: Optional[CpuBudget] = None
+_budget_lock = threading.Lock()
+
+
+def get_cpu_budget() -> CpuBudget:
+    """Presupuesto configurado con OCR_CPU_BUDGET / OCR_CPU_BUDGET_DIR."""
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            _budget = CpuBudget(os.environ.get('OCR_CPU_BUDGET_DIR', '/tmp/ocr_jobs/cpu'), cpu_total())
+        return _budget
@@ -0,0 +1,106 @@
+"""Flujo Server-Sent Events con el progreso de un trabajo.
+
+Sustituye al sondeo de /status: el servidor revisa el contador ``version``
+del almacén de trabajos (una lectura local y barata) y solo envía un
+evento cuando cambian los campos visibles (estado, progreso, mensaje o
+página actual).  Cada evento lleva como ``id`` la versión del registro, de
+modo que un cliente que se reconecta con ``Last-Event-ID`` no recibe otra
+vez el mismo estado.
+
+Cada conexión ocupa un hilo del worker mientras dura, así que el flujo se
+cierra tras SSE_MAX_SECONDS (EventSource se reconecta solo y continúa
+donde lo dejó) y, sobre todo, cada proceso admite como mucho
+SSE_MAX_STREAMS respuestas en flujo a la vez (``get_stream_limiter``; lo
+comparten /events, /text y la descarga de lotes).  Pasado el límite la
+respuesta es 503 y la página vuelve a consultar /status, de modo que los
+flujos no dejan sin hilos a /upload, /status o /result.
+"""
+from __future__ import annotations
+
+import os
+import json
+import time
+import threading
+from typing import Any, Callable, Dict, Iterator, Optional
+
+WATCHED_FIELDS = ('status', 'progress', 'message', 'current_page', 'queue_position', 'ready_pages')
+FINAL_STATUSES = ('completed', 'error')
+
+
+def _event(payload: Dict[str, Any], event_id: int) -> str:
+    data = json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+    return f"id: {event_id}\ndata: {data}\n\n"
+
+
+def job_event_stream(jobs, job_id: str, payload: Callable[[Dict[str, Any]], Dict[str, Any]],
+                     last_event_id: Optional[str] = None) -> Iterator[str]:
+    """Genera los eventos SSE de ``job_id`` hasta que termina o se agota el tiempo.
+
+    ``payload`` convierte el registro del trabajo en el JSON que se envía
+    (el mismo que devuelve /status).
+    """
+    poll = float(os.environ.get('SSE_POLL_SECONDS', '0.5'))
+    heartbeat = float(os.environ.get('SSE_HEARTBEAT_SECONDS', '15'))
+    max_seconds = float(os.environ.get('SSE_MAX_SECONDS', '60'))
+
+    started = last_sent = time.monotonic()
+    try:
+        seen_version = int(last_event_id) if last_event_id else -1
+    except ValueError:
+        seen_version = -1
+    last_fields = None
+    first = True
+
+    yield f"retry: {int(poll * 2000)}\n\n"
+    while True:
+        version = jobs.version(job_id)
+        if version == 0:
+            yield _event({'status': 'error', 'error': 'Job no encontrado'}, 0)
+            return
+        if version != seen_version or first:
+            job = jobs.get(job_id) or {}
+            fields = tuple(job.get(k) for k in WATCHED_FIELDS)
+            # Si el cliente retoma con Last-Event-ID ya tiene esta versión.
+            if fields != last_fields and version != seen_version:
+                yield _event(payload(job), version)
+                last_sent = time.monotonic()
+            last_fields = fields
+            seen_version = version
+            first = False
+            if job.get('status') in FINAL_STATUSES:
+                return
+        now = time.monotonic()
+        if now - started >= max_seconds:
+            return
+        if now - last_sent >= heartbeat:
+            # Comentario SSE: mantiene viva la conexión a través de proxies.
+            yield ": ping\n\n"
+            last_sent = now
+        time.sleep(poll)
+
+
+class StreamLimiter:
+    """Tope de respuestas en flujo abiertas a la vez en este proceso."""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = max(1, limit)
+        self._slots = threading.BoundedSemaphore(self.limit)
+
+    def try_acquire(self) -> bool:
+        return self._slots.acquire(blocking=False)
+
+    def release(self) -> None:
+        self._slots.release()
+
+
+_limiter: Optional[StreamLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_stream_limiter() -> StreamLimiter:
+    """Límite configurado con SSE_MAX_STREAMS (por defecto 2 por proceso)."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = StreamLimiter(int(os.environ.get('SSE_MAX_STREAMS', '2')))
+        return _limiter
@@ -0,0 +1,212 @@
+"""Almacén del estado de los trabajos.
+
+El estado de cada trabajo es un registro pequeño (un diccionario JSON) que
+deben ver todos los procesos: los workers de gunicorn que atienden
+/status y /download y los procesos que ejecutan el OCR.  El backend se
+elige con JOB_STORE:
+
+* ``sqlite`` (por defecto): base de datos SQLite en modo WAL en
+  JOB_STORE_PATH, compartida por todos los procesos de la máquina.
+* ``memory``: diccionario en memoria del proceso (solo sirve con un único
+  worker; útil para desarrollo).
+
+Las actualizaciones son atómicas: ``update`` fusiona los campos dados en
+el registro dentro de una transacción y solo escribe si algo cambió, en
+cuyo caso incrementa ``version``.  ``update_if`` además exige que ciertos
+campos tengan un valor dado (comparar y asignar), p. ej. para que un solo
+proceso reclame un trabajo huérfano.
+
+``find`` por un campo de INDEXED_FIELDS (p. ej. ``filename``, que usa
+/download/<filename>) consulta un índice de SQLite sobre ese campo del
+JSON en lugar de recorrer todos los registros.
+"""
+from __future__ import annotations
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1,
+    updated_at REAL NOT NULL
+)
+"""
+
+# Campos del registro con índice propio en SQLite (ver ``find``).
+INDEXED_FIELDS = ('filename',)
+
+
+class MemoryJobStore:
+    """Backend en memoria; solo visible dentro del proceso actual."""
+
+    def __init__(self) -> None:
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._jobs
+
+    def create(self, job_id: str, **fields: Any) -> None:
+        with self._lock:
+            self._jobs[job_id] = dict(fields)
+            self._versions[job_id] = 1
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            data = self._jobs.get(job_id)
+            return dict(data) if data is not None else None
+
+    def version(self, job_id: str) -> int:
+        with self._lock:
+            return self._versions.get(job_id, 0)
+
+    def update(self, job_id: str, **fields: Any) -> bool:
+        return self.update_if(job_id, {}, **fields)
+
+    def update_if(self, job_id: str, expected: Dict[str, Any], **fields: Any) -> bool:
+        with self._lock:
+            data = self._jobs.get(job_id)
+            if data is None or any(data.get(k) != v for k, v in expected.items()):
+                return False
+            if any(data.get(k, _MISSING) != v for k, v in fields.items()):
+                data.update(fields)
+                self._versions[job_id] += 1
+            return True
+
+    def delete(self, job_id: str) -> None:
+        with self._lock:
+            self._jobs.pop(job_id, None)
+            self._versions.pop(job_id, None)
+
+    def find(self, **criteria: Any) -> Optional[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            for job_id, data in self._jobs.items():
+                if all(data.get(k) == v for k, v in criteria.items()):
+                    return job_id, dict(data)
+        return None
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            snapshot = [(job_id, dict(data)) for job_id, data in self._jobs.items()]
+        return iter(snapshot)
+
+
+class SQLiteJobStore:
+    """Backend SQLite (WAL) compartido entre procesos."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute(_SCHEMA)
+        for key in INDEXED_FIELDS:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS jobs_{key} ON jobs (json_extract(data, '$.{key}'))")
+
+    def _conn(self) -> sqlite3.Connection:
+        # Una conexión por hilo y por proceso (las conexiones no sobreviven
+        # a un fork, p. ej. con gunicorn --preload).
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def __contains__(self, job_id: str) -> bool:
+        row = self._conn().execute('SELECT 1 FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return row is not None
+
+    def create(self, job_id: str, **fields: Any) -> None:
+        self._conn().execute(
+            'INSERT OR REPLACE INTO jobs (job_id, data, version, updated_at) VALUES (?, ?, 1, ?)',
+            (job_id, _dumps(fields), time.time())
+        )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute('SELECT data FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def version(self, job_id: str) -> int:
+        row = self._conn().execute('SELECT version FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return row[0] if row else 0
+
+    def update(self, job_id: str, **fields: Any) -> bool:
+        return self.update_if(job_id, {}, **fields)
+
+    def update_if(self, job_id: str, expected: Dict[str, Any], **fields: Any) -> bool:
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT data FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+            data = json.loads(row[0]) if row else None
+            if data is None or any(data.get(k) != v for k, v in expected.items()):
+                conn.execute('ROLLBACK')
+                return False
+            if any(data.get(k, _MISSING) != v for k, v in fields.items()):
+                data.update(fields)
+                conn.execute(
+                    'UPDATE jobs SET data = ?, version = version + 1, updated_at = ? WHERE job_id = ?',
+                    (_dumps(data), time.time(), job_id)
+                )
+            conn.execute('COMMIT')
+            return True
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def delete(self, job_id: str) -> None:
+        self._conn().execute('DELETE FROM jobs WHERE job_id = ?', (job_id,))
+
+    def find(self, **criteria: Any) -> Optional[Tuple[str, Dict[str, Any]]]:
+        indexed = [k for k in criteria if k in INDEXED_FIELDS]
+        if indexed:
+            # La expresión debe coincidir con la del índice para que se use.
+            rows = self._conn().execute(
+                f"SELECT job_id, data FROM jobs WHERE json_extract(data, '$.{indexed[0]}') = ?",
+                (criteria[indexed[0]],)
+            ).fetchall()
+            candidates = ((job_id, json.loads(data)) for job_id, data in rows)
+        else:
+            candidates = self.items()
+        for job_id, data in candidates:
+            if all(data.get(k) == v for k, v in criteria.items()):
+                return job_id, data
+        return None
+
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        rows = self._conn().execute('SELECT job_id, data FROM jobs').fetchall()
+        return ((job_id, json.loads(data)) for job_id, data in rows)
+
+
+class _Missing:
+    pass
+
+
+_MISSING = _Missing()
+
+
+def _dumps(data: Dict[str, Any]) -> str:
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+
+
+def create_job_store():
+    """Crea el backend configurado en JOB_STORE / JOB_STORE_PATH."""
+    backend = os.environ.get('JOB_STORE', 'sqlite').strip().lower()
+    if backend == 'memory':
+        return MemoryJobStore()
+    if backend == 'sqlite':
+        return SQLiteJobStore(os.environ.get('JOB_STORE_PATH', '/tmp/ocr_jobs/jobs.sqlite3'))
+    raise ValueError(f"JOB_STORE desconocido: {backend!r} (usa sqlite o memory)")
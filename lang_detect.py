@@ -0,0 +1,119 @@
+"""Idiomas de OCR por fragmento.
+
+Con OCR_LANGUAGE=spa+eng tesseract reconoce cada página con los dos
+modelos, lo que casi duplica el coste por página aunque la mayoría de los
+documentos estén solo en español.  Antes de reconocer un fragmento se
+toman OCR_LANG_SAMPLE_PAGES páginas de muestra, se leen de forma barata
+(la capa de texto si la tienen; si no, tesseract a OCR_LANG_DETECT_DPI con
+todos los idiomas) y se cuentan las palabras vacías ("de", "the"...) de
+cada idioma configurado.  El fragmento se reconoce solo con los idiomas
+que aportan al menos OCR_LANG_MIN_SHARE de esas palabras.
+
+Si la muestra no da para decidir (poco texto, error al leerla) se usan
+todos los idiomas configurados, como antes.  Los idiomas sin lista de
+palabras vacías aquí (p. ej. ``osd`` o ``chi_sim``) se conservan siempre.
+OCR_LANG_DETECT=0 desactiva la detección.
+"""
+from __future__ import annotations
+
+import os
+import re
+from typing import Dict, List, Sequence
+
+from pdf_tools import quick_page_count
+from text_extract import ocr_page, text_layer_page
+
+# Palabras vacías frecuentes y poco compartidas entre idiomas.
+STOPWORDS: Dict[str, frozenset] = {
+    'spa': frozenset(
+        'de la que el en y los del se las por un para con una su al lo como más pero sus le ya '
+        'este porque esta entre cuando muy sin sobre también hasta hay donde quien desde todo nos '
+        'durante todos uno les ni contra otros ese eso ante ellos esto antes algunos qué unos yo '
+        'otro otras otra él tanto esa estos mucho quienes nada muchos cual poco ella estar estas '
+        'algunas algo nosotros según año años'.split()
+    ),
+    'eng': frozenset(
+        'the of and to in is that for it with as was on be by this are from or have an they which '
+        'but not had at his her she you we been were their has will would there what all can more '
+        'if its also into than them these so other our only should'.split()
+    ),
+    'fra': frozenset(
+        'le les des du et est une dans pour qui pas sur au avec ce il elle sont ont mais ou par '
+        'plus nous vous leur cette été aux ses être'.split()
+    ),
+    'deu': frozenset(
+        'der die und den das ist nicht mit sich des auf für im dem eine als auch es werden aus er '
+        'hat dass sie nach wird bei einer um am sind noch wie einem über einen zum war haben nur '
+        'oder aber vor zur bis mehr durch man'.split()
+    ),
+    'por': frozenset(
+        'não uma os do da em com mais dos mas foi ao ele das tem à seu sua ou ser quando muito há '
+        'já está só pelo pela até isso ela era depois sem mesmo aos ter seus quem nas esse eles '
+        'estão você'.split()
+    ),
+    'ita': frozenset(
+        'di che il è per non sono della si con gli dei nel alla anche più ma questo ha delle nella '
+        'ci essere ancora dopo molto'.split()
+    ),
+    'cat': frozenset(
+        'i les del per és amb els com més però ho ja aquest aquesta també seva va fer'.split()
+    ),
+}
+
+_WORD_RE = re.compile(r"[^\W\d_]+")
+
+# Palabras vacías mínimas en la muestra para fiarse del recuento.
+MIN_HITS = 8
+
+
+def split_languages(lang: str) -> List[str]:
+    return [code for code in lang.split('+') if code]
+
+
+def score_text(text: str, candidates: Sequence[str]) -> Dict[str, int]:
+    """Palabras vacías de cada idioma de ``candidates`` que aparecen en ``text``."""
+    scores = {code: 0 for code in candidates if code in STOPWORDS}
+    for word in _WORD_RE.findall(text.lower()):
+        for code in scores:
+            if word in STOPWORDS[code]:
+                scores[code] += 1
+    return scores
+
+
+def choose_languages(scores: Dict[str, int], candidates: Sequence[str],
+                     min_share: float = 0.15) -> List[str]:
+    """Idiomas de ``candidates`` que se conservan según ``scores`` (en su orden)."""
+    total = sum(scores.values())
+    if total < MIN_HITS:
+        return list(candidates)
+    chosen = [code for code in candidates
+              if code not in scores or scores[code] >= min_share * total]
+    return chosen or list(candidates)
+
+
+def _sample(pdf_path: str, count: int) -> List[int]:
+    total = quick_page_count(pdf_path)
+    if total <= count:
+        return list(range(total))
+    # Repartidas por el fragmento, evitando la primera (suele ser portada).
+    return sorted({(total * (i + 1)) // (count + 1) for i in range(count)})
+
+
+def detect_languages(pdf_path: str, lang: str) -> str:
+    """Idiomas (formato de tesseract, ``spa+eng``) con los que reconocer ``pdf_path``."""
+    candidates = split_languages(lang)
+    if len(candidates) < 2 or os.environ.get('OCR_LANG_DETECT', '1') == '0':
+        return lang
+    sample_pages = int(os.environ.get('OCR_LANG_SAMPLE_PAGES', '2'))
+    dpi = int(os.environ.get('OCR_LANG_DETECT_DPI', '150'))
+    min_share = float(os.environ.get('OCR_LANG_MIN_SHARE', '0.15'))
+    texts = []
+    try:
+        for page in _sample(pdf_path, sample_pages):
+            text = text_layer_page(pdf_path, page, timeout=60).text
+            if len(_WORD_RE.findall(text)) < 20:
+                text = ocr_page(pdf_path, page, lang, dpi=dpi, timeout=120).text
+            texts.append(text)
+    except Exception:
+        return lang
+    return '+'.join(choose_languages(score_text('\n'.join(texts), candidates), candidates, min_share))
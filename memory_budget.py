@@ -0,0 +1,213 @@
+"""Presupuesto de memoria para el OCR.
+
+Lo que tumba la instancia no es el número de páginas (MAX_PAGES_TOTAL)
+sino los píxeles: unos pocos escaneos A3 a 600 ppp en trabajos
+simultáneos llevan a ghostscript y unpaper por encima de la RAM y el OOM
+killer se lleva el worker de gunicorn entero.
+
+Antes de reconocer un fragmento se estima su pico de memoria con
+``chunk_peak_bytes``: para cada página, las imágenes descomprimidas
+(ancho × alto × bits por componente, ver ``pdf_tools.page_raster_stats``)
+más OCR_MEMORY_RASTER_COPIES copias de la página rasterizada a la
+resolución de su imagen (RGB, 3 bytes por píxel); con ``--jobs N`` se
+suman las N páginas más pesadas, más OCR_MEMORY_BASE_MB por proceso.
+
+El fragmento solo empieza cuando cabe en OCR_MEMORY_BUDGET_MB (por
+defecto, el 75 % de la memoria del contenedor), que comparten todos los
+hilos y procesos de la máquina igual que los núcleos de cpu_budget.py.
+Las reservas se apuntan en un único registro de OCR_MEMORY_BUDGET_DIR
+(``ledger.json``: proceso y bytes de cada una) que se lee y reescribe bajo
+un ``flock`` de ``ledger.lock``; las reservas de procesos que ya no viven
+se descartan al leerlo.  Un fragmento que por sí solo supera el
+presupuesto espera a tenerlo entero.
+
+Además, con OCR_PROCESS_MEMORY_MB cada proceso de OCR (ocrmypdf y los
+ghostscript, unpaper y tesseract que lanza) corre con ese límite de
+memoria virtual, aplicado con ``prlimit`` de util-linux (``preexec_fn`` no
+es seguro con los hilos de gunicorn): si la estimación se queda corta
+falla el fragmento, no la instancia.
+"""
+from __future__ import annotations
+
+import os
+import json
+import time
+import fcntl
+import shutil
+import resource
+import itertools
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from pdf_tools import page_raster_stats
+from scheduler import process_alive, process_token
+
+MB = 1024 * 1024
+
+# Resolución a la que ocrmypdf rasteriza las páginas sin imágenes.
+DEFAULT_DPI = 300.0
+
+
+def _container_memory() -> int:
+    # Límite del cgroup (Docker/Render) o, si no hay, la RAM de la máquina.
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 2048 * MB
+
+
+def memory_total() -> int:
+    """Bytes del presupuesto (OCR_MEMORY_BUDGET_MB)."""
+    configured = os.environ.get('OCR_MEMORY_BUDGET_MB')
+    if configured:
+        return max(1, int(configured)) * MB
+    return int(_container_memory() * 0.75)
+
+
+def page_peak_bytes(decoded: int, dpi: float, area: float) -> int:
+    """Pico estimado al reconocer una página (ver ``page_raster_stats``)."""
+    copies = float(os.environ.get('OCR_MEMORY_RASTER_COPIES', '3'))
+    raster = area * (dpi or DEFAULT_DPI) ** 2 * 3
+    return int(decoded + copies * raster)
+
+
+def chunk_peak_bytes(pdf_path: str, jobs: int, pages: Optional[Sequence[int]] = None) -> int:
+    """Pico estimado de un ocrmypdf sobre ``pdf_path`` con ``--jobs jobs``."""
+    base = int(os.environ.get('OCR_MEMORY_BASE_MB', '150')) * MB
+    peaks = sorted((page_peak_bytes(*s) for s in page_raster_stats(pdf_path, pages)), reverse=True)
+    return base + sum(peaks[:max(1, jobs)])
+
+
+class MemoryGrant:
+    """Memoria concedida a un fragmento; se devuelve con ``release``."""
+
+    def __init__(self, budget: 'MemoryBudget', grant_id: str, nbytes: int) -> None:
+        self._budget: Optional[MemoryBudget] = budget
+        self._grant_id = grant_id
+        self._nbytes = nbytes
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes if self._budget is not None else 0
+
+    def release(self) -> None:
+        budget, self._budget = self._budget, None
+        if budget is not None:
+            budget._release(self._grant_id)
+
+    def __enter__(self) -> 'MemoryGrant':
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.release()
+
+
+class MemoryBudget:
+    def __init__(self, directory: str, total: int) -> None:
+        self.directory = directory
+        self.total = max(1, total)
+        self._ids = itertools.count(1)
+        os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def _ledger(self) -> Iterator[Dict[str, Dict[str, Any]]]:
+        """Reservas vigentes, bajo el bloqueo; lo que se cambie se guarda al salir."""
+        with open(os.path.join(self.directory, 'ledger.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            path = os.path.join(self.directory, 'ledger.json')
+            try:
+                with open(path) as f:
+                    grants = json.load(f)
+            except (OSError, ValueError):
+                grants = {}
+            live = {key: grant for key, grant in grants.items()
+                    if isinstance(grant, dict) and process_alive(str(grant.get('owner')))}
+            yield live
+            if live != grants:
+                tmp = f"{path}.{os.getpid()}.tmp"
+                with open(tmp, 'w') as f:
+                    json.dump(live, f)
+                os.replace(tmp, path)
+
+    def reserved(self) -> int:
+        """Bytes reservados ahora mismo en la máquina."""
+        with self._ledger() as grants:
+            return sum(int(grant['bytes']) for grant in grants.values())
+
+    def try_acquire(self, nbytes: int) -> Optional[MemoryGrant]:
+        """``nbytes`` (como mucho todo el presupuesto) si caben ahora; si no, None."""
+        want = max(1, min(self.total, nbytes))
+        owner = process_token()
+        with self._ledger() as grants:
+            # Todo o nada: dos fragmentos grandes con media reserva cada uno
+            # se bloquearían mutuamente.
+            if sum(int(grant['bytes']) for grant in grants.values()) + want > self.total:
+                return None
+            grant_id = f"{owner}:{threading.get_ident()}:{next(self._ids)}"
+            grants[grant_id] = {'owner': owner, 'bytes': want}
+        return MemoryGrant(self, grant_id, want)
+
+    def _release(self, grant_id: str) -> None:
+        with self._ledger() as grants:
+            grants.pop(grant_id, None)
+
+    def acquire(self, nbytes: int, poll: float = 0.5) -> MemoryGrant:
+        """Reserva ``nbytes`` (como mucho todo el presupuesto); espera si no caben."""
+        while True:
+            grant = self.try_acquire(nbytes)
+            if grant is not None:
+                return grant
+            time.sleep(poll)
+
+
+_budget: Optional[MemoryBudget] = None
+_budget_lock = threading.Lock()
+
+
+def get_memory_budget() -> MemoryBudget:
+    """Presupuesto configurado con OCR_MEMORY_BUDGET_MB / OCR_MEMORY_BUDGET_DIR."""
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            _budget = MemoryBudget(
+                os.environ.get('OCR_MEMORY_BUDGET_DIR', '/tmp/ocr_jobs/mem'),
+                memory_total(),
+            )
+        return _budget
+
+
+def _process_memory_limit() -> int:
+    return max(0, int(os.environ.get('OCR_PROCESS_MEMORY_MB', '0'))) * MB
+
+
+def limit_process_memory() -> None:
+    """Aplica OCR_PROCESS_MEMORY_MB al proceso actual."""
+    limit = _process_memory_limit()
+    if limit:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def memory_limited(cmd: List[str]) -> List[str]:
+    """``cmd`` precedido de ``prlimit`` con el límite de OCR_PROCESS_MEMORY_MB.
+
+    Sin límite, sin ``prlimit`` instalado o si ``cmd[0]`` no existe (para
+    que subprocess siga lanzando FileNotFoundError) devuelve ``cmd`` tal cual.
+    """
+    limit = _process_memory_limit()
+    prlimit = shutil.which('prlimit')
+    if not limit or prlimit is None or shutil.which(cmd[0]) is None:
+        return list(cmd)
+    return [prlimit, f"--as={limit}", '--', *cmd]
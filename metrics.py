@@ -0,0 +1,269 @@
+"""Métricas de rendimiento del OCR.
+
+Dos niveles:
+
+* por trabajo: ``StageTimer`` mide cada etapa (análisis, clasificación,
+  caché, OCR, guardado...) y ``record_job`` deja los tiempos en el
+  registro del trabajo (``timings``) junto con los de cada fragmento
+  (``chunk_timings``), de modo que /status o el almacén muestran a dónde
+  fue el tiempo de un trabajo lento;
+* agregado: histogramas y contadores en formato de texto de Prometheus,
+  servidos en /metrics.
+
+Los valores agregados deben sumar lo que hacen todos los workers de
+gunicorn, así que, igual que el almacén de trabajos, se guardan en SQLite
+(METRICS_PATH) salvo con JOB_STORE=memory.  Solo se escribe una vez por
+fragmento y por trabajo (una transacción corta), por lo que el coste es
+despreciable frente al OCR.  METRICS=0 desactiva la recogida.
+"""
+from __future__ import annotations
+
+import os
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# nombre -> (ayuda, límites de los buckets en segundos)
+HISTOGRAMS: Dict[str, Tuple[str, Sequence[float]]] = {
+    'ocr_page_seconds': (
+        'Tiempo de OCR por página (tiempo del fragmento / páginas).',
+        (0.5, 1, 2, 5, 10, 20, 30, 60, 120),
+    ),
+    'ocr_chunk_seconds': (
+        'Tiempo de ocrmypdf por fragmento.',
+        (1, 5, 10, 30, 60, 120, 300, 600, 1200),
+    ),
+    'ocr_queue_wait_seconds': (
+        'Espera en la cola del planificador antes de empezar el trabajo.',
+        (0.1, 1, 5, 15, 30, 60, 120, 300, 600, 1800),
+    ),
+    'ocr_stage_seconds': (
+        'Duración de cada etapa de un trabajo (etiqueta stage).',
+        (0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 1200),
+    ),
+}
+
+COUNTERS: Dict[str, str] = {
+    'ocr_jobs_total': 'Trabajos terminados por estado final.',
+    'ocr_pages_total': 'Páginas de trabajos completados.',
+    'ocr_bytes_processed_total': 'Bytes de PDFs de entrada procesados.',
+}
+
+GAUGES: Dict[str, str] = {
+    'ocr_active_jobs': 'Trabajos en proceso ahora mismo.',
+    'ocr_queued_jobs': 'Trabajos esperando en cola.',
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    metric TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    suffix TEXT NOT NULL,
+    le TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (metric, labels, suffix, le)
+)
+"""
+
+# (métrica, etiquetas, sufijo, le)
+_Key = Tuple[str, str, str, str]
+
+
+def _labels(labels: Dict[str, Any]) -> str:
+    return ','.join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+
+
+def _fmt(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _MemoryBackend:
+    def __init__(self) -> None:
+        self._values: Dict[_Key, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, rows: List[Tuple[_Key, float]]) -> None:
+        with self._lock:
+            for key, delta in rows:
+                self._values[key] = self._values.get(key, 0.0) + delta
+
+    def snapshot(self) -> Dict[_Key, float]:
+        with self._lock:
+            return dict(self._values)
+
+
+class _SQLiteBackend:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn().execute(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def add(self, rows: List[Tuple[_Key, float]]) -> None:
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT INTO samples (metric, labels, suffix, le, value) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(metric, labels, suffix, le) DO UPDATE SET value = value + excluded.value',
+                [(*key, delta) for key, delta in rows]
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def snapshot(self) -> Dict[_Key, float]:
+        rows = self._conn().execute('SELECT metric, labels, suffix, le, value FROM samples').fetchall()
+        return {(m, l, s, le): v for m, l, s, le, v in rows}
+
+
+class Metrics:
+    """Registro de histogramas y contadores (ver HISTOGRAMS / COUNTERS)."""
+
+    def __init__(self, backend=None) -> None:
+        self.backend = backend
+
+    def observe(self, name: str, value: float, count: int = 1, **labels: Any) -> None:
+        """Añade ``count`` observaciones de ``value`` al histograma ``name``."""
+        if self.backend is None or count <= 0:
+            return
+        label_str = _labels(labels)
+        rows: List[Tuple[_Key, float]] = [
+            ((name, label_str, '_bucket', _fmt(le)), count)
+            for le in HISTOGRAMS[name][1] if value <= le
+        ]
+        rows += [
+            ((name, label_str, '_bucket', '+Inf'), count),
+            ((name, label_str, '_sum', ''), value * count),
+            ((name, label_str, '_count', ''), count),
+        ]
+        self.backend.add(rows)
+
+    def inc(self, name: str, amount: float = 1, **labels: Any) -> None:
+        if self.backend is None or name not in COUNTERS:
+            return
+        self.backend.add([((name, _labels(labels), '', ''), amount)])
+
+    def render(self, gauges: Optional[Dict[str, float]] = None) -> str:
+        """Texto de exposición de Prometheus (versión 0.0.4)."""
+        values = self.backend.snapshot() if self.backend is not None else {}
+        lines: List[str] = []
+        for name, (help_text, buckets) in HISTOGRAMS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+            label_sets = sorted({k[1] for k in values if k[0] == name and k[2] == '_count'})
+            for label_str in label_sets:
+                prefix = f'{label_str},' if label_str else ''
+                for le in [_fmt(b) for b in buckets] + ['+Inf']:
+                    value = values.get((name, label_str, '_bucket', le), 0)
+                    lines.append(f'{name}_bucket{{{prefix}le="{le}"}} {_fmt(value)}')
+                for suffix in ('_sum', '_count'):
+                    value = values.get((name, label_str, suffix, ''), 0)
+                    series = f'{{{label_str}}}' if label_str else ''
+                    lines.append(f'{name}{suffix}{series} {_fmt(value)}')
+        for name, help_text in COUNTERS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            series = sorted((k[1], v) for k, v in values.items() if k[0] == name)
+            for label_str, value in series or [('', 0)]:
+                lines.append(f"{name}{f'{{{label_str}}}' if label_str else ''} {_fmt(value)}")
+        for name, value in (gauges or {}).items():
+            lines += [f'# HELP {name} {GAUGES.get(name, name)}', f'# TYPE {name} gauge', f'{name} {_fmt(value)}']
+        return '\n'.join(lines) + '\n'
+
+
+class StageTimer:
+    """Acumula la duración de las etapas de un trabajo."""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.chunks: List[Dict[str, Any]] = []
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def chunk(self, index: int, pages: int, split_seconds: float, ocr_seconds: float) -> None:
+        self.add('split', split_seconds)
+        self.add('chunk_ocr', ocr_seconds)
+        self.chunks.append({
+            'chunk': index + 1,
+            'pages': pages,
+            'split_seconds': round(split_seconds, 3),
+            'ocr_seconds': round(ocr_seconds, 3),
+        })
+        metrics = get_metrics()
+        metrics.observe('ocr_chunk_seconds', ocr_seconds)
+        if pages:
+            metrics.observe('ocr_page_seconds', ocr_seconds / pages, count=pages)
+
+    def as_dict(self) -> Dict[str, float]:
+        result = {name: round(seconds, 3) for name, seconds in self.stages.items()}
+        result['total'] = round(time.perf_counter() - self.started, 3)
+        return result
+
+
+def record_job(jobs, job_id: str, timer: StageTimer, input_bytes: int = 0) -> None:
+    """Guarda los tiempos en el registro del trabajo y actualiza las métricas."""
+    timings = timer.as_dict()
+    jobs.update(job_id, timings=timings, chunk_timings=timer.chunks)
+    job = jobs.get(job_id) or {}
+    status = job.get('status', 'unknown')
+    metrics = get_metrics()
+    for name, seconds in timings.items():
+        metrics.observe('ocr_stage_seconds', seconds, stage=name)
+    metrics.inc('ocr_jobs_total', status=status)
+    if status == 'completed':
+        metrics.inc('ocr_pages_total', job.get('pages_processed', 0))
+        metrics.inc('ocr_bytes_processed_total', input_bytes)
+
+
+def job_gauges(jobs) -> Dict[str, float]:
+    active = queued = 0
+    for _, data in jobs.items():
+        status = data.get('status')
+        if status == 'processing':
+            active += 1
+        elif status == 'queued':
+            queued += 1
+    return {'ocr_active_jobs': active, 'ocr_queued_jobs': queued}
+
+
+_metrics: Optional[Metrics] = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> Metrics:
+    """Registro configurado por entorno (METRICS, JOB_STORE, METRICS_PATH)."""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            if os.environ.get('METRICS', '1') == '0':
+                backend = None
+            elif os.environ.get('JOB_STORE', 'sqlite').strip().lower() == 'memory':
+                backend = _MemoryBackend()
+            else:
+                backend = _SQLiteBackend(os.environ.get('METRICS_PATH', '/tmp/ocr_jobs/metrics.sqlite3'))
+            _metrics = Metrics(backend)
+        return _metrics
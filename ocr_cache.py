@@ -0,0 +1,185 @@
+"""Caché de resultados de OCR direccionada por contenido.
+
+Las claves combinan un hash del contenido (el PDF completo o una página)
+con un hash de la configuración de OCR (idioma y opciones de ocrmypdf), de
+modo que un cambio de configuración nunca reutiliza resultados antiguos.
+
+Hay dos niveles:
+
+* documento: el PDF de salida completo, reutilizado si se vuelve a subir
+  exactamente el mismo archivo;
+* página: cada página ya reconocida se guarda como PDF de una página, de
+  modo que las páginas repetidas entre documentos (membretes, anexos) no
+  vuelven a pasar por OCR.
+
+Los archivos viven en OCR_CACHE_DIR y un índice SQLite lleva el tamaño, el
+último uso (para expulsar por LRU al superar OCR_CACHE_MAX_MB) y los
+contadores de aciertos y fallos.  OCR_CACHE=0 desactiva la caché.
+"""
+from __future__ import annotations
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import sqlite3
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+from pdf_tools import split_pdf
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+def settings_digest(settings: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class OcrCache:
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        os.makedirs(directory, exist_ok=True)
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(os.path.join(self.directory, 'index.sqlite3'),
+                                   timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.pdf")
+
+    def _count(self, name: str) -> None:
+        self._conn().execute(
+            'INSERT INTO counters (name, value) VALUES (?, 1) '
+            'ON CONFLICT(name) DO UPDATE SET value = value + 1',
+            (name,)
+        )
+
+    def get_file(self, key: str, dest_path: str, kind: str = 'doc') -> bool:
+        """Copia la entrada ``key`` a ``dest_path``; devuelve si hubo acierto."""
+        path = self._path(key)
+        conn = self._conn()
+        row = conn.execute('SELECT 1 FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is not None:
+            try:
+                shutil.copyfile(path, dest_path)
+            except FileNotFoundError:
+                conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            else:
+                conn.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+                self._count(f'{kind}_hits')
+                return True
+        self._count(f'{kind}_misses')
+        return False
+
+    def put_file(self, key: str, src_path: str) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        os.close(fd)
+        shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, path)
+        self._conn().execute(
+            'INSERT OR REPLACE INTO entries (key, size, last_used) VALUES (?, ?, ?)',
+            (key, os.path.getsize(path), time.time())
+        )
+        self._evict()
+
+    def _evict(self) -> None:
+        conn = self._conn()
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        while total > self.max_bytes:
+            row = conn.execute('SELECT key, size FROM entries ORDER BY last_used LIMIT 1').fetchone()
+            if row is None:
+                break
+            key, size = row
+            conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            total -= size
+            self._count('evictions')
+
+    def stats(self) -> Dict[str, int]:
+        conn = self._conn()
+        result = dict(conn.execute('SELECT name, value FROM counters').fetchall())
+        entries, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        result.update(entries=entries, bytes=size)
+        return result
+
+    # -- nivel documento -------------------------------------------------
+    def document_key(self, pdf_path: str, settings: Dict[str, Any],
+                     digest: Optional[str] = None) -> str:
+        """Clave del documento; ``digest`` evita releer el archivo si ya se conoce su SHA-256."""
+        return hashlib.sha256(
+            f"doc:{digest or file_digest(pdf_path)}:{settings_digest(settings)}".encode()
+        ).hexdigest()
+
+    # -- nivel página ----------------------------------------------------
+    def page_keys(self, fingerprints: Sequence[str], settings: Dict[str, Any]) -> List[str]:
+        digest = settings_digest(settings)
+        return [
+            hashlib.sha256(f"page:{fp}:{digest}".encode()).hexdigest()
+            for fp in fingerprints
+        ]
+
+    def fetch_pages(self, keys: Sequence[str], out_dir: str) -> List[Optional[str]]:
+        """Recupera páginas cacheadas; ``None`` donde no hay entrada."""
+        found: List[Optional[str]] = []
+        for n, key in enumerate(keys):
+            dest = os.path.join(out_dir, f"cached_{n:04d}.pdf")
+            found.append(dest if self.get_file(key, dest, kind='page') else None)
+        return found
+
+    def store_pages(self, ocr_pdf_path: str, keys: Sequence[str]) -> None:
+        """Guarda cada página de ``ocr_pdf_path`` bajo la clave correspondiente."""
+        with tempfile.TemporaryDirectory(prefix='ocrcache_', dir=self.directory) as tmp:
+            for page_path, key in zip(split_pdf(ocr_pdf_path, tmp, 1), keys):
+                self.put_file(key, page_path)
+
+
+_cache: Optional[OcrCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[OcrCache]:
+    """Caché configurada por entorno, o ``None`` si OCR_CACHE=0."""
+    global _cache
+    if os.environ.get('OCR_CACHE', '1') == '0':
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = OcrCache(
+                os.environ.get('OCR_CACHE_DIR', '/tmp/ocr_cache'),
+                int(os.environ.get('OCR_CACHE_MAX_MB', '500')) * 1024 * 1024,
+            )
+        return _cache
@@ -0,0 +1,219 @@
+"""Motores de OCR intercambiables.
+
+``subprocess`` lanza la CLI de ocrmypdf para cada fragmento (comportamiento
+original).  ``api`` usa la API de Python de ocrmypdf desde un conjunto de
+procesos persistentes: el intérprete, la importación de ocrmypdf y el
+descubrimiento de plugins se pagan una sola vez por proceso en lugar de una
+vez por fragmento.  Se elige con la variable de entorno OCR_ENGINE.
+
+Ambos motores reciben las mismas opciones (nombres de la API de ocrmypdf),
+de modo que se pueden comparar con la misma configuración.
+"""
+from __future__ import annotations
+
+import os
+import time
+import signal
+import subprocess
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+from typing import Any, Dict, List, Optional
+
+from memory_budget import limit_process_memory, memory_limited
+
+ENGINES = ('subprocess', 'api')
+
+# Segundos para que un fragmento que superó su plazo se detenga (ver ``_stop_task``).
+KILL_GRACE_SECONDS = 10
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = Lock()
+
+
+def ocr_engine_name() -> str:
+    name = os.environ.get('OCR_ENGINE', 'subprocess').strip().lower()
+    if name not in ENGINES:
+        raise ValueError(f"OCR_ENGINE desconocido: {name!r} (usa {', '.join(ENGINES)})")
+    return name
+
+
+def ocrmypdf_cli_args(options: Dict[str, Any]) -> List[str]:
+    """Traduce opciones de la API de ocrmypdf a argumentos de la CLI."""
+    args: List[str] = []
+    for key, value in options.items():
+        if value is None or value is False:
+            continue
+        if key == 'language':
+            args += ['-l', value]
+            continue
+        if key == 'plugins':
+            # En la API es una lista; en la CLI, un --plugin por cada uno.
+            for plugin in value:
+                args += ['--plugin', str(plugin)]
+            continue
+        flag = '--' + key.replace('_', '-')
+        if value is True:
+            args.append(flag)
+        else:
+            args += [flag, str(value)]
+    return args
+
+
+def run_subprocess(input_path: str, output_path: str, options: Dict[str, Any], timeout: int) -> None:
+    # OCR_PROCESS_MEMORY_MB, heredado por gs, unpaper y tesseract.
+    cmd = memory_limited(['ocrmypdf', *ocrmypdf_cli_args(options), input_path, output_path])
+    try:
+        result = subprocess.run(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            timeout=timeout,
+        )
+    except FileNotFoundError:
+        raise RuntimeError('ocrmypdf no está instalado')
+    if result.returncode != 0:
+        tail = (result.stdout or '').splitlines()[-30:]
+        raise RuntimeError("ocrmypdf falló. Log (últimas líneas):\n" + "\n".join(tail))
+
+
+def _init_worker() -> None:
+    # Cada proceso del pool encabeza su propio grupo, que heredan los gs,
+    # unpaper y tesseract que lanza ocrmypdf (ver ``_stop_task``).
+    os.setsid()
+    # Importar ocrmypdf aquí carga los plugins una sola vez por proceso.
+    import ocrmypdf  # noqa: F401
+    limit_process_memory()
+
+
+def _ocr_in_worker(input_path: str, output_path: str, options: Dict[str, Any], pid_path: str) -> None:
+    import ocrmypdf
+
+    # Qué proceso del pool ejecuta este fragmento, por si vence el plazo.
+    with open(pid_path, 'w') as f:
+        f.write(str(os.getpid()))
+
+    kwargs = dict(options)
+    kwargs['language'] = kwargs['language'].split('+')
+    try:
+        exit_code = ocrmypdf.ocr(input_path, output_path, progress_bar=False, **kwargs)
+    except Exception as e:
+        # Las excepciones de ocrmypdf no siempre se pueden serializar entre
+        # procesos; se devuelven como RuntimeError con el mismo mensaje.
+        raise RuntimeError(f"ocrmypdf falló: {type(e).__name__}: {e}") from None
+    if int(exit_code) != 0:
+        raise RuntimeError(f"ocrmypdf falló con código {int(exit_code)}")
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = int(os.environ.get('OCR_ENGINE_WORKERS', str(os.cpu_count() or 1)))
+            # "spawn" evita heredar el estado de los hilos de gunicorn.
+            _pool = ProcessPoolExecutor(
+                max_workers=max(1, workers),
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+            )
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor, kill: bool = False) -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    # ``shutdown`` olvida los procesos: hay que tomarlos antes.
+    processes = list((pool._processes or {}).values()) if kill else []
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+
+def _kill_children(pid: int) -> None:
+    """Mata los procesos del grupo de ``pid`` salvo ``pid`` (el proceso del pool)."""
+    for name in os.listdir('/proc'):
+        if not name.isdigit() or int(name) == pid:
+            continue
+        try:
+            if os.getpgid(int(name)) == pid:
+                os.kill(int(name), signal.SIGKILL)
+        except OSError:
+            pass
+
+
+def _stop_task(future: Future, pid_path: str) -> bool:
+    """Detiene el fragmento de ``future`` sin tocar los demás del pool.
+
+    Se matan los gs, unpaper y tesseract de su proceso del pool, con lo que
+    ocrmypdf falla y el proceso queda libre.  Devuelve False si no termina
+    en KILL_GRACE_SECONDS (p. ej. atascado en código Python).
+    """
+    if future.cancel():
+        return True
+    try:
+        with open(pid_path) as f:
+            pid = int(f.read())
+    except (OSError, ValueError):
+        return False
+    deadline = time.monotonic() + KILL_GRACE_SECONDS
+    while time.monotonic() < deadline:
+        _kill_children(pid)
+        try:
+            future.exception(timeout=0.5)
+            return True
+        except FutureTimeout:
+            continue
+    return False
+
+
+def run_api(input_path: str, output_path: str, options: Dict[str, Any], timeout: int) -> None:
+    pool = _get_pool()
+    pid_path = output_path + '.worker'
+    future = pool.submit(_ocr_in_worker, input_path, output_path, options, pid_path)
+    try:
+        future.result(timeout=timeout)
+    except FutureTimeout:
+        # ``cancel`` no detiene un fragmento que ya se está ejecutando: sus
+        # procesos seguirían ocupando núcleos y memoria fuera de los
+        # presupuestos.  Solo si no se consigue detenerlo se mata el pool
+        # entero (los fragmentos que lo compartían fallan como con
+        # BrokenProcessPool) y los siguientes usan uno nuevo.
+        if not _stop_task(future, pid_path):
+            _discard_pool(pool, kill=True)
+        raise RuntimeError(f"OCR superó el tiempo límite de {timeout} s")
+    except BrokenProcessPool:
+        # Un proceso murió (p. ej. por falta de memoria): se recrea el pool
+        # para los siguientes fragmentos.
+        _discard_pool(pool)
+        raise RuntimeError("El proceso de OCR terminó inesperadamente")
+    finally:
+        try:
+            os.remove(pid_path)
+        except OSError:
+            pass
+
+
+def run_ocr(input_path: str, output_path: str, options: Dict[str, Any], timeout: int,
+            engine: Optional[str] = None) -> None:
+    """Ejecuta OCR con el motor indicado (o el de OCR_ENGINE)."""
+    engine = engine or ocr_engine_name()
+    if engine == 'api':
+        run_api(input_path, output_path, options, timeout)
+    else:
+        run_subprocess(input_path, output_path, options, timeout)
+
+
+def shutdown() -> None:
+    """Detiene los procesos persistentes del motor ``api`` si existen."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
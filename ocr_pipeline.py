@@ -0,0 +1,90 @@
+"""Etapa de OCR por fragmentos en tubería.
+
+En lugar de dividir todo el PDF, reconocer todos los fragmentos y unir al
+final, ``run_chunks`` solapa las tres fases: el fragmento N+1 se escribe
+mientras los anteriores están en OCR, cada fragmento terminado se entrega
+de inmediato (para ensamblarlo en la salida) y la entrada de cada
+fragmento se borra en cuanto deja de hacer falta.  En el directorio de
+trabajo solo hay, como mucho, ``workers + 1`` fragmentos pendientes.
+"""
+from __future__ import annotations
+
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import pikepdf
+
+
+@dataclass
+class ChunkResult:
+    index: int          # posición del fragmento (desde 0)
+    pages: List[int]    # páginas del documento original (desde 0)
+    output_path: str    # PDF con OCR de esas páginas, en el mismo orden
+    split_seconds: float = 0.0  # escritura del fragmento
+    ocr_seconds: float = 0.0    # ocr_chunk sobre el fragmento
+
+
+def chunk_groups(pages: Sequence[int], pages_per_chunk: int) -> List[List[int]]:
+    pages = list(pages)
+    return [pages[start:start + pages_per_chunk] for start in range(0, len(pages), pages_per_chunk)]
+
+
+def _write_chunk(src, pages: Sequence[int], path: str) -> None:
+    with pikepdf.new() as chunk:
+        for i in pages:
+            chunk.pages.append(src.pages[i])
+        chunk.save(path)
+
+
+def _timed(func: Callable[[str, str], None], chunk_path: str, output_path: str) -> float:
+    start = time.perf_counter()
+    func(chunk_path, output_path)
+    return time.perf_counter() - start
+
+
+def run_chunks(input_pdf_path: str, groups: Sequence[Sequence[int]], work_dir: str,
+               ocr_chunk: Callable[[str, str], None], workers: int,
+               on_done: Optional[Callable[[ChunkResult], None]] = None) -> List[ChunkResult]:
+    """Reconoce los grupos de páginas ``groups`` con hasta ``workers`` a la vez.
+
+    ``ocr_chunk(entrada, salida)`` procesa un fragmento.  ``on_done`` se
+    llama desde el hilo que invoca, en orden de finalización, con cada
+    fragmento terminado.  Si un fragmento falla se cancelan los pendientes
+    y se propaga la excepción.
+    """
+    results: List[Optional[ChunkResult]] = [None] * len(groups)
+    in_flight: Dict[Future, Tuple[int, str, str, float]] = {}
+    next_idx = 0
+    with pikepdf.open(input_pdf_path) as src, ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            while next_idx < len(groups) or in_flight:
+                # Un fragmento más que hilos: el siguiente ya está escrito
+                # cuando un hilo queda libre.
+                while next_idx < len(groups) and len(in_flight) <= workers:
+                    chunk_path = os.path.join(work_dir, f"chunk_{next_idx + 1:04d}.pdf")
+                    output_path = os.path.join(work_dir, f"chunk_{next_idx + 1:04d}_ocr.pdf")
+                    start = time.perf_counter()
+                    _write_chunk(src, groups[next_idx], chunk_path)
+                    split_seconds = time.perf_counter() - start
+                    future = pool.submit(_timed, ocr_chunk, chunk_path, output_path)
+                    in_flight[future] = (next_idx, chunk_path, output_path, split_seconds)
+                    next_idx += 1
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    idx, chunk_path, output_path, split_seconds = in_flight.pop(future)
+                    try:
+                        os.remove(chunk_path)
+                    except OSError:
+                        pass
+                    ocr_seconds = future.result()
+                    result = ChunkResult(idx, list(groups[idx]), output_path, split_seconds, ocr_seconds)
+                    results[idx] = result
+                    if on_done is not None:
+                        on_done(result)
+        except BaseException:
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+    return [r for r in results if r is not None]
@@ -0,0 +1,134 @@
+"""Proceso de OCR separado de la aplicación web.
+
+    python -m ocr_worker [--app app_fixed] [--lanes interactive,bulk]
+
+Reclama trabajos de la cola de spool.py y los ejecuta con el
+``process_job`` de la aplicación (``--app``, por defecto OCR_WORKER_APP o
+``app``), que escribe el resultado en OUTPUT_FOLDER y el estado en el
+almacén de trabajos; la web solo encola y sirve.  Debe ver los mismos
+UPLOAD_FOLDER, OUTPUT_FOLDER, JOB_STORE_PATH y OCR_SPOOL_PATH que la web.
+
+Se pueden arrancar tantos como se quiera, aquí o en otras máquinas con
+esos directorios compartidos; ``--concurrency`` ejecuta varios trabajos en
+el mismo proceso y ``--lanes interactive`` deja un proceso solo para el
+carril interactivo.  Los núcleos se siguen repartiendo con cpu_budget.py.
+Con SIGTERM termina los trabajos en curso y sale; si muere sin terminar,
+otro proceso devuelve su trabajo a la cola (``Spool.requeue_stale``).
+"""
+from __future__ import annotations
+
+import os
+import sys
+import time
+import signal
+import argparse
+import importlib
+import threading
+from typing import Any, Callable, List, Optional, Sequence
+
+from metrics import get_metrics
+from scheduler import LANES, process_token
+from spool import Spool, SpoolEntry, get_spool, publish_positions, requeue_stale_jobs, stale_seconds
+
+
+class OCRWorker:
+    def __init__(self, spool: Spool, jobs, process_job: Callable[[str, str, str], Any],
+                 lanes: Sequence[str] = LANES, poll: float = 1.0) -> None:
+        self.spool = spool
+        self.jobs = jobs
+        self.process_job = process_job
+        self.lanes = tuple(lanes)
+        self.poll = poll
+        self.token = process_token()
+        self.stopping = threading.Event()
+
+    def _heartbeat(self, job_id: str, done: threading.Event) -> None:
+        interval = max(1.0, stale_seconds() / 4)
+        while not done.wait(interval):
+            self.spool.heartbeat(job_id, self.token)
+
+    def run_one(self, entry: SpoolEntry) -> None:
+        job = self.jobs.get(entry.job_id)
+        if job is None or job.get('status') not in ('queued', 'processing'):
+            # Borrado (caducado) o ya terminado mientras esperaba.
+            self.spool.done(entry.job_id)
+            return
+        waited = max(0.0, time.time() - entry.enqueued_at)
+        self.jobs.update(entry.job_id, owner=self.token, queue_position=0,
+                         queue_wait_seconds=round(waited, 3))
+        publish_positions(self.spool, self.jobs)
+        get_metrics().observe('ocr_queue_wait_seconds', waited, lane=entry.lane)
+        done = threading.Event()
+        beat = threading.Thread(target=self._heartbeat, args=(entry.job_id, done), daemon=True)
+        beat.start()
+        try:
+            self.process_job(entry.job_id, job['input_path'], job['output_path'])
+        except Exception as e:
+            print(f"Error en trabajo {entry.job_id}: {e}")
+        finally:
+            done.set()
+            self.spool.done(entry.job_id)
+
+    def loop(self) -> None:
+        while not self.stopping.is_set():
+            entry = self.spool.claim(self.token, self.lanes)
+            if entry is None:
+                self.stopping.wait(self.poll)
+                continue
+            self.run_one(entry)
+
+    def reaper(self) -> None:
+        # Trabajos reclamados por procesos de OCR que ya no existen.
+        while not self.stopping.wait(max(1.0, stale_seconds() / 4)):
+            requeue_stale_jobs(self.spool, self.jobs)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='ocr_worker', description='Ejecuta trabajos de OCR de la cola.')
+    parser.add_argument('--app', default=os.environ.get('OCR_WORKER_APP', 'app'),
+                        help='módulo de la aplicación cuyo process_job se usa (app o app_fixed)')
+    parser.add_argument('--lanes', default=','.join(LANES),
+                        help='carriles que atiende, separados por comas')
+    parser.add_argument('--concurrency', type=int, default=int(os.environ.get('OCR_SLOTS', '1')),
+                        help='trabajos simultáneos en este proceso')
+    parser.add_argument('--poll', type=float, default=1.0,
+                        help='segundos entre consultas con la cola vacía')
+    args = parser.parse_args(argv)
+
+    lanes = [lane.strip() for lane in args.lanes.split(',') if lane.strip()]
+    unknown = [lane for lane in lanes if lane not in LANES]
+    if not lanes or unknown:
+        parser.error(f"carriles desconocidos: {', '.join(unknown) or args.lanes!r} (usa {', '.join(LANES)})")
+
+    # La aplicación se importa ya en modo spool: su planificador solo
+    # encola y no arranca hilos de OCR propios.
+    os.environ['OCR_EXECUTOR'] = 'spool'
+    try:
+        module = importlib.import_module(args.app)
+    except ValueError as e:
+        parser.error(str(e))
+
+    worker = OCRWorker(get_spool(), module.jobs, module.process_job, lanes, args.poll)
+
+    def stop(signum, frame):
+        print("Terminando los trabajos en curso...")
+        worker.stopping.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    threads = [threading.Thread(target=worker.reaper, name='ocr-reaper', daemon=True)]
+    threads += [threading.Thread(target=worker.loop, name=f"ocr-worker-{n + 1}")
+                for n in range(max(1, args.concurrency))]
+    for t in threads:
+        t.start()
+    print(f"ocr_worker {worker.token}: {args.app}, carriles {', '.join(lanes)}, "
+          f"{max(1, args.concurrency)} a la vez")
+    for t in threads[1:]:
+        while t.is_alive():
+            t.join(timeout=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
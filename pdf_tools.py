@@ -0,0 +1,544 @@
+"""Utilidades PDF compartidas por la canalización de OCR.
+
+Incluye la división y unión de PDFs por fragmentos y un clasificador de
+páginas que decide, sin rasterizar, si una página necesita OCR.
+
+La división y la unión usan pikepdf (enlace de Python a qpdf, instalado
+como dependencia de ocrmypdf); el análisis de páginas usa PyPDF2.
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import hashlib
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import pikepdf
+from PyPDF2 import PdfReader
+from PyPDF2.generic import ContentStream
+
+# Clasificación de páginas
+PAGE_TEXT = 'text'      # ya tiene capa de texto: se copia sin OCR
+PAGE_IMAGE = 'image'    # escaneada, sin texto: necesita OCR
+PAGE_MIXED = 'mixed'    # texto + imágenes grandes: necesita OCR
+
+# Caracteres mínimos para considerar que una página tiene texto y fracción
+# mínima de la página cubierta por imágenes para considerar que las
+# imágenes pueden contener texto.
+MIN_TEXT_CHARS = 50
+MIN_IMAGE_COVERAGE = 0.15
+
+_Matrix = Tuple[float, float, float, float, float, float]
+_IDENTITY: _Matrix = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+
+
+def pdf_page_count(pdf_path: str) -> int:
+    reader = PdfReader(pdf_path)
+    return len(reader.pages)
+
+
+def quick_page_count(pdf_path: str) -> int:
+    """Número de páginas leyendo solo el trailer, la xref y /Root/Pages.
+
+    No recorre el árbol de páginas ni analiza su contenido, así que sirve
+    para validar una subida antes de encolarla.  Lanza excepción si el
+    archivo no se puede abrir como PDF.
+    """
+    with pikepdf.open(pdf_path) as pdf:
+        return int(pdf.Root.Pages.Count)
+
+
+def split_pdf(pdf_path: str, out_dir: str, pages_per_chunk: int,
+              pages: Optional[Sequence[int]] = None) -> List[str]:
+    """Divide el PDF en fragmentos de ``pages_per_chunk`` páginas.
+
+    ``pages`` (índices desde 0) limita los fragmentos a un subconjunto de
+    páginas; por defecto se incluyen todas.  Usa pikepdf (qpdf), que lee
+    los objetos bajo demanda y copia los flujos al escribir, así que la
+    memoria no crece con el tamaño del documento.
+    """
+    chunk_paths: List[str] = []
+    with pikepdf.open(pdf_path) as src:
+        if pages is None:
+            pages = range(len(src.pages))
+        pages = list(pages)
+        idx = 1
+        for start in range(0, len(pages), pages_per_chunk):
+            with pikepdf.new() as chunk:
+                for i in pages[start:start + pages_per_chunk]:
+                    chunk.pages.append(src.pages[i])
+                chunk_path = os.path.join(out_dir, f"chunk_{idx:04d}.pdf")
+                chunk.save(chunk_path)
+            chunk_paths.append(chunk_path)
+            idx += 1
+    return chunk_paths
+
+
+def _signature(obj: Any, h: Any, depth: int = 0) -> None:
+    """Añade al hash una representación estructural de un objeto PDF."""
+    if depth > 8:
+        return
+    if isinstance(obj, pikepdf.Stream):
+        h.update(b'S' + hashlib.sha256(obj.read_raw_bytes()).digest())
+        _signature(obj.stream_dict, h, depth + 1)
+    elif isinstance(obj, pikepdf.Dictionary):
+        for key in sorted(obj.keys()):
+            if key != '/Length':
+                h.update(key.encode())
+                _signature(obj[key], h, depth + 1)
+    elif isinstance(obj, pikepdf.Array):
+        h.update(b'[')
+        for item in obj:
+            _signature(item, h, depth + 1)
+        h.update(b']')
+    else:
+        h.update(repr(obj).encode())
+
+
+def _dedupe_fonts(pdf: Any) -> int:
+    """Hace que las páginas compartan una sola copia de cada fuente idéntica.
+
+    Cada fragmento de ocrmypdf incrusta su propia copia de la fuente de la
+    capa de texto; al unirlos, las copias sobrantes quedan sin referencias
+    y no se escriben.  Devuelve el número de referencias reemplazadas.
+    """
+    canonical: Dict[str, Any] = {}
+    replaced = 0
+    for page in pdf.pages:
+        resources = page.obj.get('/Resources')
+        fonts = resources.get('/Font') if resources is not None else None
+        if fonts is None:
+            continue
+        for name in list(fonts.keys()):
+            font = fonts[name]
+            if not font.is_indirect:
+                continue
+            h = hashlib.sha256()
+            _signature(font, h)
+            first = canonical.setdefault(h.hexdigest(), font)
+            if first.objgen != font.objgen:
+                fonts[name] = first
+                replaced += 1
+    return replaced
+
+
+def assemble_pages(sources: Sequence[Tuple[str, int]], output_pdf_path: str) -> None:
+    """Escribe un PDF con las páginas ``(archivo, índice)`` en ese orden.
+
+    Los archivos de origen se abren una sola vez y de forma perezosa; los
+    flujos (imágenes) se copian directamente al escribir la salida.
+    """
+    opened: Dict[str, Any] = {}
+    try:
+        with pikepdf.new() as out:
+            for path, index in sources:
+                src = opened.get(path)
+                if src is None:
+                    src = opened[path] = pikepdf.open(path)
+                out.pages.append(src.pages[index])
+            _dedupe_fonts(out)
+            out.save(output_pdf_path)
+    finally:
+        for src in opened.values():
+            src.close()
+
+
+class PageAssembler:
+    """Construye el PDF de salida en orden de página a medida que llegan partes.
+
+    Cada página se añade al documento de salida en cuanto están disponibles
+    ella y todas las anteriores, de modo que al terminar el último
+    fragmento solo queda escribir el archivo.  ``ready_pages`` indica
+    cuántas páginas iniciales del resultado ya están resueltas.
+    """
+
+    def __init__(self, total_pages: int, publish_dir: Optional[str] = None) -> None:
+        self.total_pages = total_pages
+        self.ready_pages = 0
+        self.publish_dir = publish_dir
+        # [ruta, páginas, índices en la ruta] de cada parte publicada (ver
+        # ``page_sources``); se guarda tal cual en el registro del trabajo.
+        self.published: List[List[Any]] = []
+        self._links: Dict[str, str] = {}
+        self._sources: Dict[int, Tuple[str, int]] = {}
+        self._opened: Dict[str, Any] = {}
+        self._out = pikepdf.new()
+        if publish_dir:
+            os.makedirs(publish_dir, exist_ok=True)
+
+    def _publish(self, pages: Sequence[int], path: str, source_pages: Sequence[int],
+                 durable: bool) -> None:
+        # Las partes en directorios temporales se enlazan (o copian) en
+        # ``publish_dir`` para que otros procesos puedan leerlas mientras
+        # el trabajo sigue en marcha.
+        if not durable:
+            dest = self._links.get(path)
+            if dest is None:
+                dest = os.path.join(self.publish_dir, f"part_{len(self._links):05d}.pdf")
+                try:
+                    os.link(path, dest)
+                except OSError:
+                    shutil.copyfile(path, dest)
+                self._links[path] = dest
+            path = dest
+        self.published.append([path, list(pages), list(source_pages)])
+
+    def provide(self, pages: Sequence[int], path: str,
+                source_pages: Optional[Sequence[int]] = None, durable: bool = False) -> int:
+        """Registra que las páginas ``pages`` están en ``path``.
+
+        ``source_pages`` son sus índices dentro de ``path`` (por defecto
+        0, 1, 2...).  Con ``publish_dir``, ``durable`` indica que ``path``
+        dura lo que el trabajo (p. ej. el PDF subido) y no hace falta
+        publicar una copia.  Devuelve el nuevo valor de ``ready_pages``.
+        """
+        if source_pages is None:
+            source_pages = range(len(pages))
+        if self.publish_dir and pages:
+            self._publish(pages, path, source_pages, durable)
+        for page, index in zip(pages, source_pages):
+            self._sources[page] = (path, index)
+        while self.ready_pages in self._sources:
+            path, index = self._sources.pop(self.ready_pages)
+            src = self._opened.get(path)
+            if src is None:
+                src = self._opened[path] = pikepdf.open(path)
+            self._out.pages.append(src.pages[index])
+            self.ready_pages += 1
+        return self.ready_pages
+
+    def save(self, output_pdf_path: str) -> None:
+        if self.ready_pages != self.total_pages:
+            raise RuntimeError(
+                f"Faltan páginas por ensamblar ({self.ready_pages} de {self.total_pages})"
+            )
+        _dedupe_fonts(self._out)
+        self._out.save(output_pdf_path)
+
+    def close(self) -> None:
+        self._out.close()
+        for src in self._opened.values():
+            src.close()
+        self._opened.clear()
+
+    def __enter__(self) -> 'PageAssembler':
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+def page_sources(published: Sequence[Sequence[Any]]) -> Dict[int, Tuple[str, int]]:
+    """Página -> ``(archivo, índice)`` a partir de ``PageAssembler.published``."""
+    sources: Dict[int, Tuple[str, int]] = {}
+    for path, pages, indices in published:
+        for page, index in zip(pages, indices):
+            sources[page] = (path, index)
+    return sources
+
+
+def parse_page_ranges(spec: str, total_pages: int) -> List[int]:
+    """Páginas (desde 0, ordenadas y sin repetir) de un rango como ``1-5,8,20-``.
+
+    Los números empiezan en 1; ``20-`` llega hasta la última página y
+    ``-5`` empieza en la primera.  Lanza ValueError si el rango no es
+    válido o se sale del documento.
+    """
+    pages = set()
+    for part in spec.replace(' ', '').split(','):
+        if not part:
+            continue
+        first, dash, last = part.partition('-')
+        try:
+            start = int(first) if first else 1
+            end = (int(last) if last else total_pages) if dash else start
+        except ValueError:
+            raise ValueError(f"Rango de páginas no válido: {part!r} (usa p. ej. 1-5,8,20-)")
+        if start > end:
+            raise ValueError(f"Rango de páginas no válido: {part!r} (usa p. ej. 1-5,8,20-)")
+        if start < 1 or end > total_pages:
+            raise ValueError(f"Rango de páginas fuera del documento: {part!r} (tiene {total_pages} páginas)")
+        pages.update(range(start - 1, end))
+    if not pages:
+        raise ValueError("No se indicó ninguna página")
+    return sorted(pages)
+
+
+def format_page_ranges(pages: Sequence[int]) -> str:
+    """Forma compacta (``1-5,8``) de una lista ordenada de páginas desde 0."""
+    parts: List[str] = []
+    start = prev = None
+    for page in list(pages) + [None]:
+        if start is not None and page == prev + 1:
+            prev = page
+            continue
+        if start is not None:
+            parts.append(f"{start + 1}-{prev + 1}" if prev > start else f"{start + 1}")
+        start = prev = page
+    return ','.join(parts)
+
+
+def merge_pdfs(pdf_paths: List[str], output_pdf_path: str) -> None:
+    sources: List[Tuple[str, int]] = []
+    for path in pdf_paths:
+        with pikepdf.open(path) as pdf:
+            n_pages = len(pdf.pages)
+        sources.extend((path, i) for i in range(n_pages))
+    assemble_pages(sources, output_pdf_path)
+
+
+def splice_pages(original_pdf_path: str, ocr_parts: List[str], ocr_pages: Sequence[int],
+                 output_pdf_path: str) -> None:
+    """Reconstruye el documento sustituyendo solo las páginas con OCR.
+
+    ``ocr_parts`` contiene, en orden, las páginas ``ocr_pages`` (índices
+    desde 0) ya procesadas; el resto se copia tal cual del original.
+    """
+    replaced: Dict[int, Tuple[str, int]] = {}
+    pending = iter(ocr_pages)
+    for path in ocr_parts:
+        with pikepdf.open(path) as pdf:
+            n_pages = len(pdf.pages)
+        for i in range(n_pages):
+            replaced[next(pending)] = (path, i)
+    with pikepdf.open(original_pdf_path) as original:
+        total = len(original.pages)
+    assemble_pages(
+        [replaced.get(i, (original_pdf_path, i)) for i in range(total)],
+        output_pdf_path
+    )
+
+
+def _mult(m: _Matrix, n: _Matrix) -> _Matrix:
+    a, b, c, d, e, f = m
+    a2, b2, c2, d2, e2, f2 = n
+    return (
+        a * a2 + b * c2, a * b2 + b * d2,
+        c * a2 + d * c2, c * b2 + d * d2,
+        e * a2 + f * c2 + e2, e * b2 + f * d2 + f2,
+    )
+
+
+def _text_len(operand: Any) -> int:
+    if isinstance(operand, (str, bytes)):
+        return len(operand.strip())
+    if isinstance(operand, list):
+        return sum(_text_len(o) for o in operand)
+    return 0
+
+
+def _scan_content(content: Any, resources: Any, pdf: PdfReader, ctm: _Matrix,
+                  stats: Dict[str, float], depth: int = 0) -> None:
+    """Recorre un flujo de contenido acumulando texto y área de imágenes."""
+    if content is None or depth > 3:
+        return
+    xobjects = {}
+    if resources is not None and '/XObject' in resources:
+        xobjects = resources['/XObject'].get_object()
+    stack: List[_Matrix] = []
+    render_mode = 0
+    for operands, operator in ContentStream(content, pdf).operations:
+        if operator == b'q':
+            stack.append(ctm)
+        elif operator == b'Q':
+            ctm = stack.pop() if stack else ctm
+        elif operator == b'cm':
+            ctm = _mult(tuple(float(x) for x in operands), ctm)
+        elif operator == b'Tr':
+            render_mode = int(operands[0])
+        elif operator in (b'Tj', b'TJ', b"'", b'"'):
+            key = 'invisible_chars' if render_mode == 3 else 'text_chars'
+            stats[key] += _text_len(operands[-1])
+        elif operator == b'INLINE IMAGE':
+            a, b, c, d = ctm[:4]
+            stats['image_area'] += abs(a * d - b * c)
+        elif operator == b'Do' and operands[0] in xobjects:
+            xobj = xobjects[operands[0]].get_object()
+            subtype = xobj.get('/Subtype')
+            if subtype == '/Image':
+                a, b, c, d = ctm[:4]
+                stats['image_area'] += abs(a * d - b * c)
+            elif subtype == '/Form':
+                matrix = tuple(float(x) for x in xobj.get('/Matrix', _IDENTITY))
+                _scan_content(xobj, xobj.get('/Resources'), pdf, _mult(matrix, ctm),
+                              stats, depth + 1)
+
+
+def classify_page(page: Any, pdf: PdfReader) -> str:
+    """Clasifica una página como texto, imagen o mixta.
+
+    Se basa en los operadores de texto del contenido (el texto invisible,
+    modo 3, es una capa OCR previa) y en la fracción de la página cubierta
+    por imágenes según la matriz de transformación de cada una.
+    """
+    stats = {'text_chars': 0.0, 'invisible_chars': 0.0, 'image_area': 0.0}
+    try:
+        _scan_content(page.get_contents(), page.get('/Resources'), pdf, _IDENTITY, stats)
+    except Exception:
+        # Contenido que no sabemos interpretar: mejor pasar por OCR.
+        return PAGE_IMAGE
+    box = page.mediabox
+    page_area = abs(float(box.width) * float(box.height)) or 1.0
+    coverage = min(stats['image_area'] / page_area, 1.0)
+    has_text = stats['text_chars'] + stats['invisible_chars'] >= MIN_TEXT_CHARS
+    has_images = coverage >= MIN_IMAGE_COVERAGE
+    if not has_images:
+        return PAGE_TEXT
+    if not has_text:
+        return PAGE_IMAGE
+    if stats['invisible_chars'] >= MIN_TEXT_CHARS:
+        # Escaneo con capa OCR previa: el texto ya existe.
+        return PAGE_TEXT
+    return PAGE_MIXED
+
+
+def _hash_stream(h: Any, obj: Any, seen: set, depth: int = 0) -> None:
+    """Añade al hash un flujo y los XObjects que referencia."""
+    obj = obj.get_object()
+    if id(obj) in seen or depth > 3:
+        return
+    seen.add(id(obj))
+    # Datos tal como están en el archivo (sin descomprimir): basta para
+    # identificar el contenido y evita decodificar imágenes grandes.
+    data = getattr(obj, '_data', None)
+    if data is None and hasattr(obj, 'get_data'):
+        data = obj.get_data()
+    if data:
+        h.update(hashlib.sha256(data).digest())
+    resources = obj.get('/Resources') if hasattr(obj, 'get') else None
+    if resources is None:
+        return
+    resources = resources.get_object()
+    if '/XObject' in resources:
+        for name, xobj in sorted(resources['/XObject'].get_object().items()):
+            h.update(name.encode())
+            _hash_stream(h, xobj, seen, depth + 1)
+    if '/Font' in resources:
+        for name, font in sorted(resources['/Font'].get_object().items()):
+            h.update(f"{name}={font.get_object().get('/BaseFont')}".encode())
+
+
+def page_fingerprint(page: Any) -> str:
+    """Huella del contenido visible de una página.
+
+    Dos páginas con la misma huella se rasterizan igual, así que su
+    resultado de OCR es intercambiable aunque estén en PDFs distintos.
+    """
+    h = hashlib.sha256()
+    h.update(repr([float(x) for x in page.mediabox]).encode())
+    h.update(str(page.get('/Rotate', 0)).encode())
+    contents = page.get('/Contents')
+    if contents is not None:
+        contents = contents.get_object()
+        for stream in (contents if isinstance(contents, list) else [contents]):
+            _hash_stream(h, stream, set())
+    _hash_stream(h, page, set())
+    return h.hexdigest()
+
+
+def page_fingerprints(pdf_path: str, pages: Sequence[int]) -> List[str]:
+    reader = PdfReader(pdf_path)
+    return [page_fingerprint(reader.pages[i]) for i in pages]
+
+
+def classify_pages(pdf_path: str) -> List[str]:
+    """Clasifica todas las páginas del PDF (ver ``classify_page``)."""
+    reader = PdfReader(pdf_path)
+    return [classify_page(page, reader) for page in reader.pages]
+
+
+def _image_stats(resources: Any, seen: set, depth: int = 0) -> Tuple[int, int]:
+    pixels = size = 0
+    if resources is None or '/XObject' not in resources or depth > 3:
+        return pixels, size
+    for _, xobj in resources.XObject.items():
+        if xobj.objgen in seen and xobj.objgen != (0, 0):
+            continue
+        seen.add(xobj.objgen)
+        subtype = xobj.get('/Subtype')
+        if subtype == '/Image':
+            pixels += int(xobj.get('/Width', 0)) * int(xobj.get('/Height', 0))
+            size += int(xobj.get('/Length', 0))
+        elif subtype == '/Form':
+            p, s = _image_stats(xobj.get('/Resources'), seen, depth + 1)
+            pixels += p
+            size += s
+    return pixels, size
+
+
+def page_image_stats(pdf_path: str, pages: Sequence[int]) -> List[Tuple[int, int, float]]:
+    """Píxeles y bytes (comprimidos) de las imágenes de cada página, y su área.
+
+    Solo lee diccionarios de los XObjects, sin descomprimir imágenes; el
+    área se da en pulgadas cuadradas (MediaBox / 72²).
+    """
+    stats = []
+    with pikepdf.open(pdf_path) as pdf:
+        for i in pages:
+            page = pdf.pages[i]
+            x0, y0, x1, y1 = (float(v) for v in page.mediabox)
+            pixels, size = _image_stats(page.obj.get('/Resources'), set())
+            stats.append((pixels, size, abs(x1 - x0) * abs(y1 - y0) / (72 * 72)))
+    return stats
+
+
+def _components(colorspace: Any) -> int:
+    # Canales por píxel del espacio de color de una imagen.
+    if isinstance(colorspace, pikepdf.Array) and len(colorspace):
+        family = colorspace[0]
+        if family == '/ICCBased':
+            return int(colorspace[1].get('/N', 3))
+        if family in ('/Indexed', '/Separation'):
+            return 1
+        if family == '/DeviceN':
+            return len(colorspace[1])
+        return _components(family)
+    if colorspace in ('/DeviceGray', '/CalGray', '/G'):
+        return 1
+    if colorspace in ('/DeviceCMYK', '/CMYK'):
+        return 4
+    return 3
+
+
+def _decoded_images(resources: Any, seen: set, depth: int = 0) -> Tuple[int, int]:
+    decoded = largest = 0
+    if resources is None or '/XObject' not in resources or depth > 3:
+        return decoded, largest
+    for _, xobj in resources.XObject.items():
+        if xobj.objgen in seen and xobj.objgen != (0, 0):
+            continue
+        seen.add(xobj.objgen)
+        subtype = xobj.get('/Subtype')
+        if subtype == '/Image':
+            pixels = int(xobj.get('/Width', 0)) * int(xobj.get('/Height', 0))
+            if xobj.get('/ImageMask', False):
+                bits = 1
+            else:
+                bits = int(xobj.get('/BitsPerComponent', 8)) * _components(xobj.get('/ColorSpace'))
+            decoded += pixels * bits // 8
+            largest = max(largest, pixels)
+        elif subtype == '/Form':
+            d, p = _decoded_images(xobj.get('/Resources'), seen, depth + 1)
+            decoded += d
+            largest = max(largest, p)
+    return decoded, largest
+
+
+def page_raster_stats(pdf_path: str, pages: Optional[Sequence[int]] = None) -> List[Tuple[int, float, float]]:
+    """Bytes de las imágenes ya descomprimidas, su resolución y el área de cada página.
+
+    Como ``page_image_stats``, solo lee los diccionarios de los XObjects
+    (ancho, alto, bits por componente y espacio de color).  La resolución
+    (ppp) es la de la imagen más grande suponiendo que ocupa toda la
+    página, que es el caso de las páginas escaneadas; 0 si no hay imágenes.
+    """
+    stats = []
+    with pikepdf.open(pdf_path) as pdf:
+        for i in (range(len(pdf.pages)) if pages is None else pages):
+            page = pdf.pages[i]
+            x0, y0, x1, y1 = (float(v) for v in page.mediabox)
+            area = abs(x1 - x0) * abs(y1 - y0) / (72 * 72)
+            decoded, largest = _decoded_images(page.obj.get('/Resources'), set())
+            dpi = (largest / area) ** 0.5 if area and largest else 0.0
+            stats.append((decoded, dpi, area))
+    return stats
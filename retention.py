@@ -0,0 +1,134 @@
+"""Limpieza diferida de resultados y archivos subidos.
+
+Antes el PDF de salida se borraba en cuanto se cerraba la primera
+respuesta de /download, de modo que una descarga interrumpida no se podía
+reanudar.  Ahora los archivos de un trabajo terminado se conservan
+RESULT_TTL_MINUTES desde la última vez que se escribieron o se descargaron
+(``last_access``), y un hilo por proceso los borra, junto con el registro
+del trabajo, cada RESULT_SWEEP_SECONDS.
+
+El barrido también elimina los archivos de UPLOAD_FOLDER y OUTPUT_FOLDER
+más antiguos que el TTL que no pertenecen a ningún trabajo en curso
+(subidas a medias, restos de un reinicio con JOB_STORE=memory...), y los
+directorios ``<job_id>.parts`` (partes publicadas para /pages) que dejó un
+proceso muerto.
+Varios procesos pueden barrer a la vez: borrar dos veces no es un error.
+"""
+from __future__ import annotations
+
+import os
+import time
+import shutil
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set
+
+FINISHED = ('completed', 'error')
+
+_started: Set[int] = set()
+_started_lock = threading.Lock()
+
+
+def result_ttl() -> float:
+    """Segundos que se conservan los archivos de un trabajo terminado."""
+    return float(os.environ.get('RESULT_TTL_MINUTES', '60')) * 60
+
+
+def _mtime(path: Optional[str]) -> Optional[float]:
+    if not path:
+        return None
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def _remove(path: Optional[str]) -> None:
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _job_paths(job: Dict[str, Any]) -> List[str]:
+    return [p for p in (job.get('input_path'), job.get('output_path')) if p]
+
+
+def job_expired(job: Dict[str, Any], ttl: float, now: float) -> bool:
+    """Si ``job`` terminó y nadie lo ha tocado en ``ttl`` segundos."""
+    if job.get('status') not in FINISHED:
+        return False
+    stamps = [t for t in [job.get('last_access')] + [_mtime(p) for p in _job_paths(job)] if t]
+    # Sin archivos ni descargas no hay nada que conservar.
+    return not stamps or now - max(stamps) > ttl
+
+
+def sweep(jobs, folders: Sequence[str], ttl: Optional[float] = None,
+          now: Optional[float] = None) -> int:
+    """Borra los trabajos caducados y los archivos huérfanos; devuelve cuántos trabajos."""
+    ttl = result_ttl() if ttl is None else ttl
+    now = time.time() if now is None else now
+    removed = 0
+    in_use: Set[str] = set()
+    active: Set[str] = set()
+    batches: List[tuple] = []
+    for job_id, job in jobs.items():
+        if job.get('kind') == 'batch':
+            batches.append((job_id, job))
+            continue
+        if job_expired(job, ttl, now):
+            for path in _job_paths(job):
+                _remove(path)
+            jobs.delete(job_id)
+            removed += 1
+        else:
+            in_use.update(_job_paths(job))
+            active.add(job_id)
+    # Un lote desaparece cuando ya no queda ninguno de sus trabajos.
+    for batch_id, batch in batches:
+        if not any(job_id in jobs for job_id in batch.get('job_ids', [])):
+            jobs.delete(batch_id)
+    for folder in folders:
+        try:
+            names = os.listdir(folder)
+        except OSError:
+            continue
+        for name in names:
+            path = os.path.join(folder, name)
+            if name.endswith('.parts') and name[:-len('.parts')] not in active and os.path.isdir(path):
+                stamp = _mtime(path)
+                if stamp is not None and now - stamp > ttl:
+                    shutil.rmtree(path, ignore_errors=True)
+                continue
+            if path in in_use or not os.path.isfile(path):
+                continue
+            stamp = _mtime(path)
+            if stamp is not None and now - stamp > ttl:
+                _remove(path)
+    return removed
+
+
+def touch(jobs, job_id: str) -> None:
+    """Anota una descarga: el plazo de conservación vuelve a empezar."""
+    jobs.update(job_id, last_access=time.time())
+
+
+def start_sweeper(jobs, folders: Iterable[str], interval: Optional[float] = None) -> None:
+    """Arranca (una vez por proceso) el hilo que ejecuta ``sweep`` periódicamente."""
+    with _started_lock:
+        if os.getpid() in _started:
+            return
+        _started.add(os.getpid())
+    interval = float(os.environ.get('RESULT_SWEEP_SECONDS', '300')) if interval is None else interval
+    folders = list(folders)
+
+    def loop() -> None:
+        while True:
+            try:
+                sweep(jobs, folders)
+            except Exception as e:
+                print(f"Error en la limpieza de resultados: {e}")
+            time.sleep(interval)
+
+    threading.Thread(target=loop, name='result-sweeper', daemon=True).start()
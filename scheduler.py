@@ -0,0 +1,286 @@
+"""Planificador de trabajos de OCR.
+
+Sustituye al hilo por subida: los trabajos entran en una cola acotada
+(OCR_QUEUE_MAX) y un número fijo de hilos (OCR_SLOTS) los ejecutan.  Si la
+cola está llena, ``submit`` lanza ``QueueFull`` y la ruta /upload responde
+429.
+
+El orden favorece a los documentos pequeños (menor coste primero), pero
+cada segundo de espera descuenta OCR_QUEUE_AGING unidades de coste, de
+modo que un documento grande no espera indefinidamente.  La posición en la
+cola se escribe en el almacén de trabajos (``queue_position``) para que
+/status la muestre desde cualquier worker; al empezar, el tiempo de espera
+queda en ``queue_wait_seconds``.
+
+Cada trabajo encolado lleva en ``owner`` el proceso que lo tiene en su
+cola.  Si ese proceso muere (gunicorn mata un worker por timeout, Render
+reinicia el servicio), ``recover`` permite que otro proceso reclame sus
+trabajos pendientes y los vuelva a encolar; con los puntos de control de
+checkpoints.py continúan desde el último fragmento terminado.
+
+Hay dos carriles (``priority`` del trabajo): ``interactive`` para quien
+espera el resultado delante de la pantalla y ``bulk`` para lotes y
+automatizaciones.  Los interactivos van siempre antes en la cola y,
+además de los OCR_SLOTS hilos comunes, tienen OCR_INTERACTIVE_SLOTS hilos
+propios, de modo que un lote grande en marcha no los deja esperando un
+hilo; los núcleos se reparten según cpu_budget.py, donde un trabajo bulk
+cede la reserva interactiva al terminar cada fragmento.  Cada carril tiene
+su propio tope de OCR_QUEUE_MAX trabajos en espera.
+
+Con OCR_EXECUTOR=spool el OCR no se ejecuta en los procesos web: los
+trabajos se anotan en una cola durable y los ejecutan procesos aparte
+(``python -m ocr_worker``), ver spool.py.
+"""
+from __future__ import annotations
+
+import os
+import time
+import socket
+import itertools
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from metrics import get_metrics
+
+
+LANES = ('interactive', 'bulk')
+
+
+class QueueFull(Exception):
+    """La cola de trabajos ha alcanzado OCR_QUEUE_MAX."""
+
+
+def job_lane(requested: Optional[str], pages: int) -> str:
+    """Carril de un trabajo: el pedido o, si no se indica, según su tamaño.
+
+    Un documento de más de OCR_INTERACTIVE_MAX_PAGES páginas va siempre al
+    carril ``bulk``, aunque se pida ``interactive``.
+    """
+    lane = (requested or '').strip().lower() or 'interactive'
+    if lane not in LANES:
+        raise ValueError(f"Prioridad desconocida: {lane!r} (usa {', '.join(LANES)})")
+    if pages > int(os.environ.get('OCR_INTERACTIVE_MAX_PAGES', '50')):
+        return 'bulk'
+    return lane
+
+
+def _start_time(pid: int) -> Optional[str]:
+    # Instante de arranque del proceso (campo 22 de /proc/<pid>/stat):
+    # distingue un pid reutilizado tras un reinicio.
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(')', 1)[1].split()[19]
+    except (OSError, IndexError):
+        return None
+
+
+def process_token(pid: Optional[int] = None) -> str:
+    pid = pid or os.getpid()
+    return f"{socket.gethostname()}:{pid}:{_start_time(pid)}"
+
+
+def process_alive(token: str) -> bool:
+    """Si el proceso identificado por ``token`` sigue vivo.
+
+    Un proceso de otra máquina se considera vivo: desde aquí no se puede
+    saber y es preferible no robarle el trabajo.
+    """
+    try:
+        host, pid, _ = token.rsplit(':', 2)
+        pid_number = int(pid)
+    except ValueError:
+        return False
+    if host != socket.gethostname():
+        return True
+    return process_token(pid_number) == token
+
+
+@dataclass
+class _Entry:
+    job_id: str
+    func: Callable[..., Any]
+    args: Tuple[Any, ...]
+    cost: float
+    seq: int
+    lane: str = 'interactive'
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class JobScheduler:
+    def __init__(self, jobs, slots: int, max_queued: int, aging: float,
+                 interactive_slots: int = 1, clock: Callable[[], float] = time.monotonic) -> None:
+        self.jobs = jobs
+        self.slots = max(1, slots)
+        self.interactive_slots = max(0, interactive_slots)
+        self.max_queued = max(1, max_queued)
+        self.aging = aging
+        # Reloj de la espera en cola y del envejecimiento (inyectable en pruebas).
+        self.clock = clock
+        self._queue: List[_Entry] = []
+        self._running = 0
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self.token = process_token()
+
+    def _effective_cost(self, entry: _Entry, now: float) -> float:
+        return entry.cost - self.aging * (now - entry.enqueued_at)
+
+    def _ordered(self) -> List[_Entry]:
+        now = self.clock()
+        return sorted(self._queue, key=lambda e: (e.lane != 'interactive', self._effective_cost(e, now), e.seq))
+
+    def _check_room(self, lane: str) -> None:
+        waiting = sum(1 for e in self._queue if e.lane == lane)
+        if waiting >= self.max_queued:
+            raise QueueFull(f"Cola llena ({self.max_queued} trabajos en espera)")
+
+    def _publish_positions(self) -> None:
+        # Se llama con self._cond adquirido; la cola es pequeña (acotada).
+        for position, entry in enumerate(self._ordered(), start=1):
+            self.jobs.update(
+                entry.job_id,
+                queue_position=position,
+                message=f"En cola (posición {position})...",
+            )
+
+    def _ensure_threads(self) -> None:
+        if self._threads:
+            return
+        for n in range(self.slots):
+            t = threading.Thread(target=self._worker, args=(LANES,), name=f"ocr-slot-{n + 1}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        for n in range(self.interactive_slots):
+            t = threading.Thread(target=self._worker, args=(('interactive',),),
+                                 name=f"ocr-interactive-{n + 1}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, job_id: str, func: Callable[..., Any], args: Tuple[Any, ...], cost: float,
+               lane: str = 'interactive') -> int:
+        """Encola un trabajo en el carril ``lane`` y devuelve su posición inicial."""
+        with self._cond:
+            self._check_room(lane)
+            self._ensure_threads()
+            self._queue.append(_Entry(job_id, func, args, cost, next(self._seq), lane, self.clock()))
+            self.jobs.update(job_id, owner=self.token)
+            self._publish_positions()
+            # Hay hilos que solo atienden el carril interactivo: se despierta
+            # a todos para que el trabajo lo recoja uno que pueda.
+            self._cond.notify_all()
+            return self.queue_position(job_id) or 1
+
+    def submit_many(self, items: List[Tuple[str, Callable[..., Any], Tuple[Any, ...], float, str]]) -> None:
+        """Encola varios trabajos a la vez (un lote): ``(job_id, func, args, cost, lane)``.
+
+        El lote se admite entero si queda sitio en la cola de sus carriles,
+        aunque con él se supere OCR_QUEUE_MAX: el tamaño de los lotes ya lo
+        limita OCR_BATCH_MAX_FILES.
+        """
+        with self._cond:
+            for lane in {item[4] for item in items}:
+                self._check_room(lane)
+            self._ensure_threads()
+            for job_id, func, args, cost, lane in items:
+                self._queue.append(_Entry(job_id, func, args, cost, next(self._seq), lane, self.clock()))
+                self.jobs.update(job_id, owner=self.token)
+            self._publish_positions()
+            self._cond.notify_all()
+
+    def recover(self, func: Callable[..., Any],
+                args_for: Callable[[Dict[str, Any]], Tuple[Any, ...]]) -> List[str]:
+        """Reencola los trabajos pendientes cuyo proceso ya no existe.
+
+        ``args_for`` obtiene del registro los argumentos para ``func``.
+        Devuelve los trabajos reclamados.
+        """
+        recovered = []
+        for job_id, data in list(self.jobs.items()):
+            owner = data.get('owner')
+            if data.get('status') not in ('queued', 'processing') or not owner:
+                continue
+            if owner == self.token or process_alive(owner):
+                continue
+            # Solo un proceso gana el trabajo aunque varios arranquen a la vez.
+            if not self.jobs.update_if(job_id, {'owner': owner}, owner=self.token, status='queued',
+                                       message='Reanudando trabajo interrumpido...'):
+                continue
+            try:
+                self.submit(job_id, func, args_for(data), cost=data.get('total_pages') or 1,
+                            lane=data.get('priority', 'interactive'))
+            except (QueueFull, KeyError) as e:
+                self.jobs.update(job_id, status='error', error=str(e),
+                                 message=f"No se pudo reanudar el trabajo: {e}")
+                continue
+            recovered.append(job_id)
+        return recovered
+
+    def queue_position(self, job_id: str) -> Optional[int]:
+        with self._cond:
+            for position, entry in enumerate(self._ordered(), start=1):
+                if entry.job_id == job_id:
+                    return position
+        return None
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'queued': len(self._queue),
+                'queued_by_lane': {lane: sum(1 for e in self._queue if e.lane == lane) for lane in LANES},
+                'running': self._running,
+                'slots': self.slots,
+                'interactive_slots': self.interactive_slots,
+            }
+
+    def _next(self, lanes: Tuple[str, ...]) -> _Entry:
+        with self._cond:
+            while not any(e.lane in lanes for e in self._queue):
+                self._cond.wait()
+            entry = next(e for e in self._ordered() if e.lane in lanes)
+            self._queue.remove(entry)
+            self._running += 1
+            self.jobs.update(
+                entry.job_id,
+                queue_position=0,
+                queue_wait_seconds=round(self.clock() - entry.enqueued_at, 3),
+            )
+            self._publish_positions()
+            return entry
+
+    def _worker(self, lanes: Tuple[str, ...]) -> None:
+        while True:
+            entry = self._next(lanes)
+            get_metrics().observe('ocr_queue_wait_seconds', self.clock() - entry.enqueued_at,
+                                  lane=entry.lane)
+            try:
+                entry.func(entry.job_id, *entry.args)
+            except Exception as e:
+                print(f"Error en trabajo {entry.job_id}: {e}")
+            finally:
+                with self._cond:
+                    self._running -= 1
+
+
+def create_scheduler(jobs):
+    """Crea el planificador con OCR_SLOTS / OCR_INTERACTIVE_SLOTS / OCR_QUEUE_MAX / OCR_QUEUE_AGING.
+
+    OCR_EXECUTOR elige dónde se ejecuta el OCR: ``threads`` (por defecto,
+    hilos del propio proceso) o ``spool`` (procesos de ocr_worker.py).
+    """
+    executor = os.environ.get('OCR_EXECUTOR', 'threads').strip().lower()
+    if executor == 'spool':
+        from spool import SpoolScheduler, get_spool
+        if os.environ.get('JOB_STORE', 'sqlite').strip().lower() == 'memory':
+            raise ValueError("OCR_EXECUTOR=spool necesita un almacén compartido (JOB_STORE=sqlite)")
+        return SpoolScheduler(jobs, get_spool(), max_queued=int(os.environ.get('OCR_QUEUE_MAX', '10')))
+    if executor != 'threads':
+        raise ValueError(f"OCR_EXECUTOR desconocido: {executor!r} (usa threads o spool)")
+    return JobScheduler(
+        jobs,
+        slots=int(os.environ.get('OCR_SLOTS', '1')),
+        max_queued=int(os.environ.get('OCR_QUEUE_MAX', '10')),
+        aging=float(os.environ.get('OCR_QUEUE_AGING', '1.0')),
+        interactive_slots=int(os.environ.get('OCR_INTERACTIVE_SLOTS', '1')),
+    )
@@ -0,0 +1,240 @@
+"""Cola durable para procesos de OCR separados de gunicorn.
+
+Con OCR_EXECUTOR=spool la aplicación web ya no ejecuta el OCR en sus
+hilos: ``submit`` solo anota el trabajo en una tabla SQLite
+(OCR_SPOOL_PATH) y los procesos ``python -m ocr_worker`` lo reclaman, lo
+procesan con el mismo ``process_job`` de la aplicación y escriben el
+resultado en el almacén de trabajos y en OUTPUT_FOLDER, de donde lo sirve
+la web.  Así el OCR no depende de ``--timeout`` ni del reciclado de los
+workers de gunicorn, y se pueden arrancar tantos procesos de OCR como se
+quiera, en esta máquina o en otras que compartan el directorio (con un
+sistema de archivos con bloqueos fiables).
+
+El orden es el de scheduler.py: primero el carril interactivo y, dentro
+de cada carril, menor coste con envejecimiento (OCR_QUEUE_AGING).
+Reclamar es atómico (``BEGIN IMMEDIATE``).  Cada proceso de OCR renueva
+``heartbeat`` mientras trabaja; si muere, ``requeue_stale`` devuelve su
+trabajo a la cola (enseguida si era de esta máquina, tras
+OCR_SPOOL_STALE_SECONDS sin latido si era de otra) y el trabajo continúa
+desde su último punto de control.
+"""
+from __future__ import annotations
+
+import os
+import time
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from scheduler import LANES, QueueFull, process_alive
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS spool (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT UNIQUE NOT NULL,
+    lane TEXT NOT NULL,
+    cost REAL NOT NULL,
+    enqueued_at REAL NOT NULL,
+    claimed_by TEXT,
+    claimed_at REAL,
+    heartbeat REAL
+)
+"""
+
+
+@dataclass
+class SpoolEntry:
+    job_id: str
+    lane: str
+    cost: float
+    enqueued_at: float
+
+
+class Spool:
+    def __init__(self, path: str, aging: float = 1.0) -> None:
+        self.path = path
+        self.aging = aging
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn().execute(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # Una conexión por hilo y por proceso, como en job_store.py.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _order(self) -> Tuple[str, Tuple[Any, ...]]:
+        return ("ORDER BY lane != 'interactive', cost - ? * (? - enqueued_at), seq",
+                (self.aging, time.time()))
+
+    def enqueue(self, items: Sequence[Tuple[str, str, float]], max_queued: int) -> None:
+        """Anota ``(job_id, lane, cost)``; lanza QueueFull si algún carril está lleno."""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for lane in {lane for _, lane, _ in items}:
+                waiting = conn.execute(
+                    'SELECT COUNT(*) FROM spool WHERE lane = ? AND claimed_by IS NULL', (lane,)
+                ).fetchone()[0]
+                if waiting >= max_queued:
+                    raise QueueFull(f"Cola llena ({max_queued} trabajos en espera)")
+            now = time.time()
+            conn.executemany(
+                'INSERT OR REPLACE INTO spool (job_id, lane, cost, enqueued_at) VALUES (?, ?, ?, ?)',
+                [(job_id, lane, cost, now) for job_id, lane, cost in items],
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def waiting(self) -> List[str]:
+        """Trabajos sin reclamar, en el orden en que se atenderán."""
+        order, params = self._order()
+        rows = self._conn().execute(
+            f'SELECT job_id FROM spool WHERE claimed_by IS NULL {order}', params
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def claim(self, token: str, lanes: Sequence[str] = LANES) -> Optional[SpoolEntry]:
+        """Reclama el siguiente trabajo de ``lanes`` para el proceso ``token``."""
+        order, params = self._order()
+        marks = ','.join('?' * len(lanes))
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                f'SELECT job_id, lane, cost, enqueued_at FROM spool '
+                f'WHERE claimed_by IS NULL AND lane IN ({marks}) {order} LIMIT 1',
+                (*lanes, *params),
+            ).fetchone()
+            if row is not None:
+                now = time.time()
+                conn.execute('UPDATE spool SET claimed_by = ?, claimed_at = ?, heartbeat = ? WHERE job_id = ?',
+                             (token, now, now, row[0]))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return SpoolEntry(*row) if row else None
+
+    def heartbeat(self, job_id: str, token: str) -> None:
+        self._conn().execute('UPDATE spool SET heartbeat = ? WHERE job_id = ? AND claimed_by = ?',
+                             (time.time(), job_id, token))
+
+    def done(self, job_id: str) -> None:
+        self._conn().execute('DELETE FROM spool WHERE job_id = ?', (job_id,))
+
+    def requeue_stale(self, stale_after: float) -> List[str]:
+        """Devuelve a la cola los trabajos de procesos de OCR muertos."""
+        now = time.time()
+        rows = self._conn().execute(
+            'SELECT job_id, claimed_by, heartbeat FROM spool WHERE claimed_by IS NOT NULL'
+        ).fetchall()
+        requeued = []
+        for job_id, token, beat in rows:
+            # process_alive da por vivo a un proceso de otra máquina: para
+            # esos manda el latido.
+            if process_alive(token) and now - (beat or 0) <= stale_after:
+                continue
+            updated = self._conn().execute(
+                'UPDATE spool SET claimed_by = NULL, claimed_at = NULL, heartbeat = NULL '
+                'WHERE job_id = ? AND claimed_by = ?', (job_id, token)
+            ).rowcount
+            if updated:
+                requeued.append(job_id)
+        return requeued
+
+    def stats(self) -> Dict[str, Any]:
+        rows = self._conn().execute(
+            'SELECT lane, claimed_by IS NOT NULL, COUNT(*) FROM spool GROUP BY 1, 2'
+        ).fetchall()
+        queued = {lane: 0 for lane in LANES}
+        running = 0
+        for lane, claimed, count in rows:
+            if claimed:
+                running += count
+            else:
+                queued[lane] = queued.get(lane, 0) + count
+        return {'queued': sum(queued.values()), 'queued_by_lane': queued, 'running': running}
+
+
+class SpoolScheduler:
+    """Planificador de la web con OCR_EXECUTOR=spool: solo encola.
+
+    Tiene la interfaz de ``JobScheduler`` para que las rutas no cambien;
+    el trabajo lo hacen los procesos de ocr_worker.py.
+    """
+
+    def __init__(self, jobs, spool: Spool, max_queued: int) -> None:
+        self.jobs = jobs
+        self.spool = spool
+        self.max_queued = max(1, max_queued)
+
+    def submit(self, job_id: str, func: Callable[..., Any], args: Tuple[Any, ...], cost: float,
+               lane: str = 'interactive') -> int:
+        self.spool.enqueue([(job_id, lane, cost)], self.max_queued)
+        publish_positions(self.spool, self.jobs)
+        return self.queue_position(job_id) or 1
+
+    def submit_many(self, items: List[Tuple[str, Callable[..., Any], Tuple[Any, ...], float, str]]) -> None:
+        self.spool.enqueue([(job_id, lane, cost) for job_id, _, _, cost, lane in items], self.max_queued)
+        publish_positions(self.spool, self.jobs)
+
+    def recover(self, func: Callable[..., Any],
+                args_for: Callable[[Dict[str, Any]], Tuple[Any, ...]]) -> List[str]:
+        # Los trabajos ya están en la cola durable; solo hay que devolver a
+        # ella los de procesos de OCR muertos.
+        return requeue_stale_jobs(self.spool, self.jobs)
+
+    def queue_position(self, job_id: str) -> Optional[int]:
+        waiting = self.spool.waiting()
+        return waiting.index(job_id) + 1 if job_id in waiting else None
+
+    def stats(self) -> dict:
+        return dict(self.spool.stats(), executor='spool')
+
+
+def stale_seconds() -> float:
+    return float(os.environ.get('OCR_SPOOL_STALE_SECONDS', '120'))
+
+
+def publish_positions(spool: Spool, jobs) -> None:
+    """Escribe en el almacén la posición de cada trabajo que espera."""
+    for position, job_id in enumerate(spool.waiting(), start=1):
+        jobs.update(job_id, queue_position=position, message=f"En cola (posición {position})...")
+
+
+def requeue_stale_jobs(spool: Spool, jobs) -> List[str]:
+    """``Spool.requeue_stale`` y el registro de cada trabajo de nuevo en cola."""
+    requeued = spool.requeue_stale(stale_seconds())
+    for job_id in requeued:
+        jobs.update(job_id, status='queued', message='Reanudando trabajo interrumpido...')
+    if requeued:
+        publish_positions(spool, jobs)
+    return requeued
+
+
+_spool: Optional[Spool] = None
+_spool_lock = threading.Lock()
+
+
+def get_spool() -> Spool:
+    """Cola configurada con OCR_SPOOL_PATH / OCR_QUEUE_AGING."""
+    global _spool
+    with _spool_lock:
+        if _spool is None:
+            _spool = Spool(
+                os.environ.get('OCR_SPOOL_PATH', '/tmp/ocr_jobs/spool.sqlite3'),
+                aging=float(os.environ.get('OCR_QUEUE_AGING', '1.0')),
+            )
+        return _spool
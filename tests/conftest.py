@@ -0,0 +1,24 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+# The modules live at the top level of the repository, not in a package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """``app_fixed`` imported with an in-memory job store and temporary folders."""
+    base = tmp_path_factory.mktemp('app')
+    with pytest.MonkeyPatch.context() as mp:
+        for name, value in {
+            'JOB_STORE': 'memory',
+            'OCR_EXECUTOR': 'threads',
+            'UPLOAD_FOLDER': str(base / 'uploads'),
+            'OUTPUT_FOLDER': str(base / 'outputs'),
+            'RESULT_SWEEP_SECONDS': '3600',
+        }.items():
+            mp.setenv(name, value)
+        yield importlib.import_module('app_fixed')
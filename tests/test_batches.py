@@ -0,0 +1,64 @@
+import io
+import zipfile
+
+import pytest
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def batch(app_module, tmp_path):
+    jobs = app_module.jobs
+    output = tmp_path / 'a_OCR.pdf'
+    output.write_bytes(b'%PDF-a')
+    jobs.create('b-job1', status='completed', progress=100, filename='a_OCR.pdf', source_name='a.pdf',
+                output_path=str(output))
+    jobs.create('b-job2', status='processing', progress=40, filename='b_OCR.pdf', source_name='b.pdf',
+                output_path=str(tmp_path / 'b_OCR.pdf'))
+    jobs.create('batch1', kind='batch', batch_id='batch1', job_ids=['b-job1', 'b-job2'],
+                rejected=[{'filename': 'c.txt', 'error': 'No es un PDF'}])
+    yield 'batch1'
+    for job_id in ('batch1', 'b-job1', 'b-job2'):
+        jobs.delete(job_id)
+
+
+def test_status_of_a_batch_points_to_batch_endpoint(client, batch):
+    for route in ('/status/', '/events/'):
+        resp = client.get(route + batch)
+        assert resp.status_code == 404
+        assert resp.get_json()['batch'] == f"/batch/{batch}"
+    assert client.get(f"/batch/{batch}").get_json()['status'] == 'processing'
+
+
+def test_status_of_a_job(client, batch):
+    resp = client.get('/status/b-job2')
+    assert resp.status_code == 200
+    assert resp.get_json()['status'] == 'processing'
+    assert client.get('/status/missing').status_code == 404
+
+
+def test_download_waits_for_every_document(app_module, client, batch):
+    resp = client.get(f"/batch/{batch}/download")
+    assert resp.status_code == 409
+    assert resp.headers['Retry-After'] == '10'
+    body = resp.get_json()
+    assert body['status'] == 'processing'
+    assert body['counts']['processing'] == 1
+    # No stream slot is taken while waiting.
+    assert app_module.get_stream_limiter().try_acquire()
+    app_module.get_stream_limiter().release()
+
+
+def test_download_when_finished(app_module, client, batch):
+    app_module.jobs.update('b-job2', status='error', error='OCR falló')
+    resp = client.get(f"/batch/{batch}/download")
+    assert resp.status_code == 200
+    assert resp.mimetype == 'application/zip'
+    with zipfile.ZipFile(io.BytesIO(resp.data)) as archive:
+        assert archive.namelist() == ['a_OCR.pdf', 'ERRORES.txt']
+        assert archive.read('a_OCR.pdf') == b'%PDF-a'
+        assert archive.read('ERRORES.txt').decode() == 'c.txt: No es un PDF\nb.pdf: OCR falló\n'
+    assert 'last_access' in app_module.jobs.get('b-job1')
@@ -0,0 +1,66 @@
+import multiprocessing
+import os
+
+from checkpoints import ChunkCheckpoint, _sweep
+
+
+def make_part(tmp_path, name):
+    path = tmp_path / name
+    path.write_bytes(b'%PDF')
+    return str(path)
+
+
+def test_clear_keeps_checkpoint_in_use(tmp_path):
+    directory = str(tmp_path / 'root' / 'key')
+    first, second = ChunkCheckpoint(directory), ChunkCheckpoint(directory)
+    kept = first.add([0, 1], make_part(tmp_path, 'a.pdf'))
+    first.clear()
+    assert os.path.exists(kept)
+    second.add([2], make_part(tmp_path, 'b.pdf'))
+    assert sorted(pages for pages, _ in second.completed()) == [[0, 1], [2]]
+    second.clear()
+    assert not os.path.exists(directory)
+
+
+def test_add_after_clear_recreates_directory(tmp_path):
+    directory = str(tmp_path / 'root' / 'key')
+    first = ChunkCheckpoint(directory)
+    first.clear()
+    second = ChunkCheckpoint(directory)
+    path = second.add([3], make_part(tmp_path, 'a.pdf'))
+    assert os.path.exists(path)
+    assert second.completed() == [([3], path)]
+
+
+def _hold(directory, ready, done):
+    checkpoint = ChunkCheckpoint(directory)
+    ready.set()
+    done.wait(10)
+    checkpoint.release()
+
+
+def test_clear_keeps_checkpoint_used_by_another_process(tmp_path):
+    directory = str(tmp_path / 'root' / 'key')
+    ctx = multiprocessing.get_context('spawn')
+    ready, done = ctx.Event(), ctx.Event()
+    other = ctx.Process(target=_hold, args=(directory, ready, done))
+    other.start()
+    try:
+        assert ready.wait(10)
+        checkpoint = ChunkCheckpoint(directory)
+        checkpoint.add([0], make_part(tmp_path, 'a.pdf'))
+        checkpoint.clear()
+        assert os.path.exists(directory)
+    finally:
+        done.set()
+        other.join()
+
+
+def test_sweep_skips_checkpoints_in_use(tmp_path):
+    root = tmp_path / 'root'
+    checkpoint = ChunkCheckpoint(str(root / 'key'))
+    _sweep(str(root), -1)
+    assert os.path.exists(root / 'key')
+    checkpoint.release()
+    _sweep(str(root), -1)
+    assert os.listdir(root) == []
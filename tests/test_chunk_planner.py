@@ -0,0 +1,70 @@
+import random
+
+import pytest
+
+from chunk_planner import TIMEOUT_SAFETY, plan_chunks
+
+
+def random_case(rng):
+    n_pages = rng.randint(1, 200)
+    first = rng.randint(0, 50)
+    pages = list(range(first, first + n_pages))
+    shape = rng.choice(['uniform', 'mixed', 'spiky'])
+    if shape == 'uniform':
+        units = [rng.uniform(0.9, 1.1) for _ in pages]
+    elif shape == 'mixed':
+        units = [rng.uniform(0.15, 4.0) for _ in pages]
+    else:
+        units = [rng.choice([0.15, 0.2, 4.0, 12.0]) for _ in pages]
+    return dict(
+        pages=pages,
+        units=units,
+        workers=rng.randint(1, 8),
+        seconds_per_unit=rng.uniform(0.5, 20.0),
+        timeout=rng.choice([60, 300, 1200, 3600]),
+        max_pages=rng.randint(1, 50),
+        min_chunk_seconds=rng.choice([0.0, 20.0, 120.0]),
+    )
+
+
+@pytest.mark.parametrize('seed', range(500))
+def test_plan_chunks_properties(seed):
+    case = random_case(random.Random(seed))
+    pages, units, workers = case['pages'], case['units'], case['workers']
+    chunks = plan_chunks(**case)
+
+    # Every page exactly once, in order, in non-empty contiguous chunks.
+    assert all(chunks)
+    assert [p for chunk in chunks for p in chunk] == pages
+
+    # As many chunks as workers, or a multiple, unless there are not enough
+    # pages for that and each page is already its own chunk.
+    assert len(chunks) % workers == 0 or all(len(chunk) == 1 for chunk in chunks)
+    assert len(chunks) >= min(workers, len(pages))
+
+    # No chunk over the page cap or the time budget (unless a single page is).
+    cost = dict(zip(pages, units))
+    cap = max(case['timeout'] * TIMEOUT_SAFETY / case['seconds_per_unit'], max(units))
+    for chunk in chunks:
+        assert len(chunk) <= case['max_pages']
+        assert sum(cost[p] for p in chunk) <= cap * (1 + 1e-9)
+
+
+def test_plan_chunks_empty():
+    assert plan_chunks([], [], 4, 3.0, 1200, 25) == []
+
+
+def test_plan_chunks_balances_cost():
+    # One heavy page in the middle: it gets a chunk with few neighbours.
+    units = [1.0] * 20
+    units[10] = 10.0
+    chunks = plan_chunks(list(range(20)), units, 2, 3.0, 1200, 25, min_chunk_seconds=0)
+    costs = [sum(units[p] for p in chunk) for chunk in chunks]
+    assert len(chunks) == 2
+    assert max(costs) <= 19
+
+
+def test_plan_chunks_small_documents_use_few_chunks():
+    # 4 pages at 3 s each: not worth more than one ocrmypdf per worker.
+    chunks = plan_chunks(list(range(4)), [1.0] * 4, 2, 3.0, 1200, 25)
+    assert len(chunks) == 2
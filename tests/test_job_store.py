@@ -0,0 +1,120 @@
+import pytest
+
+from job_store import MemoryJobStore, SQLiteJobStore
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryJobStore()
+    return SQLiteJobStore(str(tmp_path / 'jobs.sqlite3'))
+
+
+def test_create_and_get(store):
+    store.create('a', status='queued', progress=0)
+    assert 'a' in store
+    assert store.get('a') == {'status': 'queued', 'progress': 0}
+    assert store.version('a') == 1
+    assert store.get('missing') is None
+    assert store.version('missing') == 0
+
+
+def test_get_returns_a_copy(store):
+    store.create('a', status='queued')
+    store.get('a')['status'] = 'changed'
+    assert store.get('a')['status'] == 'queued'
+
+
+def test_version_bumps_only_on_change(store):
+    store.create('a', status='queued', progress=0)
+    assert store.update('a', status='queued', progress=0)
+    assert store.version('a') == 1
+    assert store.update('a', progress=10)
+    assert store.version('a') == 2
+    assert store.update('a', progress=10, status='queued')
+    assert store.version('a') == 2
+    # A new field is a change even if its value is falsy.
+    assert store.update('a', error=None)
+    assert store.version('a') == 3
+    assert store.get('a') == {'status': 'queued', 'progress': 10, 'error': None}
+
+
+def test_update_missing_job(store):
+    assert not store.update('missing', status='queued')
+    assert 'missing' not in store
+
+
+def test_update_if_compare_and_set(store):
+    store.create('a', owner='p1', status='queued')
+    assert not store.update_if('a', {'owner': 'p2'}, owner='p3')
+    assert store.get('a')['owner'] == 'p1'
+    assert store.version('a') == 1
+    assert store.update_if('a', {'owner': 'p1'}, owner='p3', status='processing')
+    assert store.get('a') == {'owner': 'p3', 'status': 'processing'}
+    assert store.version('a') == 2
+    # The first claim wins; a second one with the old value is stale.
+    assert not store.update_if('a', {'owner': 'p1'}, owner='p4')
+    assert store.get('a')['owner'] == 'p3'
+
+
+def test_update_if_absent_field_matches_none(store):
+    store.create('a', status='queued')
+    assert store.update_if('a', {'owner': None}, owner='p1')
+    assert not store.update_if('a', {'owner': None}, owner='p2')
+
+
+def test_find(store):
+    store.create('a', filename='a_OCR.pdf', status='completed')
+    store.create('b', filename='b_OCR.pdf', status='processing')
+    assert store.find(filename='b_OCR.pdf') == ('b', {'filename': 'b_OCR.pdf', 'status': 'processing'})
+    assert store.find(filename='c_OCR.pdf') is None
+    assert store.find(filename='a_OCR.pdf', status='processing') is None
+    assert store.find(status='completed')[0] == 'a'
+    store.update('a', filename='renamed.pdf')
+    assert store.find(filename='a_OCR.pdf') is None
+    assert store.find(filename='renamed.pdf')[0] == 'a'
+
+
+def test_delete_and_items(store):
+    store.create('a', n=1)
+    store.create('b', n=2)
+    assert sorted(store.items()) == [('a', {'n': 1}), ('b', {'n': 2})]
+    store.delete('a')
+    store.delete('a')
+    assert 'a' not in store
+    assert store.version('a') == 0
+    assert [job_id for job_id, _ in store.items()] == ['b']
+
+
+def test_create_replaces_and_resets_version(store):
+    store.create('a', n=1)
+    store.update('a', n=2)
+    store.create('a', m=1)
+    assert store.get('a') == {'m': 1}
+    assert store.version('a') == 1
+
+
+def test_backends_agree(tmp_path):
+    stores = [MemoryJobStore(), SQLiteJobStore(str(tmp_path / 'jobs.sqlite3'))]
+    results = []
+    for s in stores:
+        trace = []
+        s.create('a', status='queued', filename='x.pdf', progress=0)
+        trace.append(s.update('a', progress=0))
+        trace.append(s.update('a', progress=5, message='OCR'))
+        trace.append(s.update_if('a', {'status': 'processing'}, status='completed'))
+        trace.append(s.update_if('a', {'status': 'queued'}, status='processing'))
+        trace.append(s.update('b', status='queued'))
+        trace.append((s.get('a'), s.version('a'), s.find(filename='x.pdf')))
+        results.append(trace)
+    assert results[0] == results[1]
+
+
+def test_sqlite_shared_between_instances(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite3')
+    first, second = SQLiteJobStore(path), SQLiteJobStore(path)
+    first.create('a', owner='p1')
+    assert second.update_if('a', {'owner': 'p1'}, owner='p2')
+    assert not first.update_if('a', {'owner': 'p1'}, owner='p3')
+    assert first.get('a') == {'owner': 'p2'}
+    assert first.version('a') == second.version('a') == 2
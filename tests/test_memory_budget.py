@@ -0,0 +1,94 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+
+from memory_budget import MB, MemoryBudget
+from scheduler import process_token
+
+
+def test_grants_fit_in_total_and_release(tmp_path):
+    budget = MemoryBudget(str(tmp_path), 1000 * MB)
+    first = budget.try_acquire(600 * MB)
+    assert first is not None and first.nbytes == 600 * MB
+    # All or nothing: 500 MB do not fit next to 600 MB.
+    assert budget.try_acquire(500 * MB) is None
+    assert budget.reserved() == 600 * MB
+    with budget.try_acquire(400 * MB) as second:
+        assert second.nbytes == 400 * MB
+        assert budget.try_acquire(1) is None
+    assert budget.reserved() == 600 * MB
+    first.release()
+    first.release()
+    assert budget.reserved() == 0
+
+
+def test_oversized_request_waits_for_the_whole_budget(tmp_path):
+    budget = MemoryBudget(str(tmp_path), 1000 * MB)
+    small = budget.try_acquire(1 * MB)
+    assert budget.try_acquire(5000 * MB) is None
+    small.release()
+    grant = budget.try_acquire(5000 * MB)
+    assert grant is not None and grant.nbytes == 1000 * MB
+    grant.release()
+
+
+def test_one_ledger_regardless_of_budget_size(tmp_path):
+    budget = MemoryBudget(str(tmp_path), 64 * 1024 * MB)
+    grants = [budget.try_acquire(700 * MB) for _ in range(50)]
+    assert all(grants)
+    assert sorted(os.listdir(tmp_path)) == ['ledger.json', 'ledger.lock']
+    for grant in grants:
+        grant.release()
+    assert budget.reserved() == 0
+
+
+def test_concurrent_threads_never_overcommit(tmp_path):
+    budget = MemoryBudget(str(tmp_path), 10 * MB)
+    peak = []
+    lock = threading.Lock()
+
+    def worker():
+        for _ in range(20):
+            grant = budget.acquire(3 * MB, poll=0.001)
+            with lock:
+                peak.append(budget.reserved())
+            grant.release()
+
+    threads = [threading.Thread(target=worker) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert max(peak) <= 9 * MB
+    assert budget.reserved() == 0
+
+
+def test_grants_of_dead_processes_are_dropped(tmp_path):
+    budget = MemoryBudget(str(tmp_path), 1000 * MB)
+    dead = f"{socket.gethostname()}:999999999:1"
+    remote = 'other-host:1:1'
+    with open(tmp_path / 'ledger.json', 'w') as f:
+        json.dump({f"{dead}:1:1": {'owner': dead, 'bytes': 900 * MB},
+                   f"{remote}:1:1": {'owner': remote, 'bytes': 100 * MB}}, f)
+    # The remote grant is kept (it cannot be checked from here).
+    assert budget.reserved() == 100 * MB
+    assert budget.try_acquire(900 * MB) is not None
+
+
+def test_grant_of_an_exited_process_is_freed(tmp_path):
+    code = (
+        'import sys; sys.path.insert(0, sys.argv[1]);'
+        'from memory_budget import MB, MemoryBudget;'
+        'assert MemoryBudget(sys.argv[2], 1000 * MB).try_acquire(800 * MB)'
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, '-c', code, root, str(tmp_path)], check=True)
+    budget = MemoryBudget(str(tmp_path), 1000 * MB)
+    # The child exited without releasing; its grant is pruned on the next read.
+    assert budget.try_acquire(800 * MB) is not None
+    with open(tmp_path / 'ledger.json') as f:
+        owners = {grant['owner'] for grant in json.load(f).values()}
+    assert owners == {process_token()}
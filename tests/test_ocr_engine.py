@@ -0,0 +1,70 @@
+import os
+import subprocess
+import threading
+import time
+
+import pytest
+
+import ocr_engine
+
+FAKE_OCRMYPDF = '''
+import subprocess
+
+
+def ocr(input_path, output_path, progress_bar=False, language=None, sleep=0, **kwargs):
+    # Like tesseract: the work happens in a child process.
+    subprocess.run(['sleep', str(sleep)], check=True)
+    with open(output_path, 'w') as f:
+        f.write('ok')
+    return 0
+'''
+
+
+@pytest.fixture
+def fake_api(tmp_path, monkeypatch):
+    (tmp_path / 'ocrmypdf.py').write_text(FAKE_OCRMYPDF)
+    monkeypatch.setenv('PYTHONPATH', str(tmp_path))
+    monkeypatch.setenv('OCR_ENGINE_WORKERS', '2')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    yield tmp_path
+    ocr_engine.shutdown()
+
+
+def sleeping(seconds):
+    out = subprocess.run(['pgrep', '-f', f"^sleep {seconds}$"], capture_output=True, text=True).stdout
+    return out.split()
+
+
+def test_timeout_kills_only_that_chunk(fake_api):
+    results = {}
+
+    def run(name, sleep, timeout):
+        start = time.monotonic()
+        try:
+            ocr_engine.run_api('in.pdf', str(fake_api / f"{name}.pdf"),
+                               {'language': 'spa', 'sleep': sleep}, timeout)
+            results[name] = ('ok', time.monotonic() - start)
+        except RuntimeError as e:
+            results[name] = (str(e), time.monotonic() - start)
+
+    # Warm up both workers so the timeout is not spent starting them.
+    ocr_engine._get_pool()
+    run('warm1', 0, 60)
+    pool = ocr_engine._pool
+    threads = [threading.Thread(target=run, args=('slow', 37, 3)),
+               threading.Thread(target=run, args=('other', 6, 60))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    message, elapsed = results['slow']
+    assert 'tiempo límite de 3 s' in message
+    assert elapsed < 3 + ocr_engine.KILL_GRACE_SECONDS
+    assert results['other'][0] == 'ok'
+    assert sleeping(37) == []
+    # The pool survives and its processes are reused.
+    assert ocr_engine._pool is pool
+    run('after', 0, 60)
+    assert results['after'][0] == 'ok'
+    assert not os.path.exists(fake_api / 'slow.pdf.worker')
@@ -0,0 +1,66 @@
+import shutil
+
+import pikepdf
+import pytest
+
+import ocr_cache
+
+
+def make_pdf(path, widths):
+    pdf = pikepdf.new()
+    for width in widths:
+        pdf.add_blank_page(page_size=(width, 100))
+    pdf.save(path)
+    return str(path)
+
+
+@pytest.fixture
+def run_job(app_module, tmp_path, monkeypatch):
+    """Runs ``process_pdf_with_ocr`` with a fake ocrmypdf and a fresh page cache."""
+    for name, value in {
+        'OCR_CACHE': '1',
+        'OCR_CACHE_DIR': str(tmp_path / 'cache'),
+        'OCR_CHECKPOINTS': '0',
+        'OCR_PAGE_TRIAGE': '0',
+        'OCR_LANGUAGE': 'spa+eng',
+    }.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(ocr_cache, '_cache', None)
+    monkeypatch.setattr(app_module, 'check_system_dependencies', lambda: [])
+    ocr_langs = []
+
+    def fake_ocrmypdf(input_path, output_path, lang, timeout, ocr_jobs=None, profile=None):
+        ocr_langs.append(lang)
+        shutil.copyfile(input_path, output_path)
+
+    monkeypatch.setattr(app_module, 'run_ocrmypdf', fake_ocrmypdf)
+
+    def run(pdf_path, detected):
+        monkeypatch.setattr(app_module, 'detect_languages', lambda path, lang: detected)
+        job_id = f"job{len(ocr_langs)}_{detected}"
+        app_module.jobs.create(job_id, status='queued')
+        app_module.process_pdf_with_ocr(job_id, pdf_path, str(tmp_path / f"{job_id}_OCR.pdf"))
+        job = app_module.jobs.get(job_id)
+        app_module.jobs.delete(job_id)
+        assert job['status'] == 'completed', job
+        return job
+
+    run.ocr_langs = ocr_langs
+    return run
+
+
+def test_stored_pages_are_found_again(run_job, tmp_path):
+    first = make_pdf(tmp_path / 'a.pdf', [100, 101, 102])
+    # Same pages plus a new one: a different document, so only the page cache helps.
+    second = make_pdf(tmp_path / 'b.pdf', [100, 101, 102, 103])
+    assert run_job(first, 'spa+eng')['pages_from_cache'] == 0
+    assert run_job(second, 'spa+eng')['pages_from_cache'] == 3
+
+
+def test_narrowed_chunks_are_not_stored_under_the_full_set(run_job, tmp_path):
+    first = make_pdf(tmp_path / 'a.pdf', [100, 101, 102])
+    second = make_pdf(tmp_path / 'b.pdf', [100, 101, 102, 103])
+    run_job(first, 'spa')
+    job = run_job(second, 'spa+eng')
+    assert job['pages_from_cache'] == 0
+    assert run_job.ocr_langs == ['spa', 'spa+eng']
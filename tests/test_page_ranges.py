@@ -0,0 +1,154 @@
+import io
+
+import pikepdf
+import pytest
+
+from pdf_tools import format_page_ranges, parse_page_ranges
+
+
+@pytest.mark.parametrize('spec, expected', [
+    ('1-5,8,20-', [0, 1, 2, 3, 4, 7, 19, 20, 21]),
+    ('3', [2]),
+    ('-2', [0, 1]),
+    ('22-', [21]),
+    ('1-', list(range(22))),
+    (' 8, 1 - 3 ,8,2', [0, 1, 2, 7]),
+    ('4-4', [3]),
+    ('5,,6,', [4, 5]),
+])
+def test_parse_page_ranges(spec, expected):
+    assert parse_page_ranges(spec, 22) == expected
+
+
+@pytest.mark.parametrize('spec', ['5-3', 'a', '1-x', '1-2-3', '1.5', '--', '1;2'])
+def test_parse_page_ranges_invalid(spec):
+    with pytest.raises(ValueError, match='no válido'):
+        parse_page_ranges(spec, 22)
+
+
+@pytest.mark.parametrize('spec', ['0', '0-3', '23', '20-23', '1,30'])
+def test_parse_page_ranges_outside_document(spec):
+    with pytest.raises(ValueError, match='fuera del documento.*22 páginas'):
+        parse_page_ranges(spec, 22)
+
+
+@pytest.mark.parametrize('spec', ['', ',', ' , '])
+def test_parse_page_ranges_empty(spec):
+    with pytest.raises(ValueError, match='ninguna página'):
+        parse_page_ranges(spec, 22)
+
+
+@pytest.mark.parametrize('pages, expected', [
+    ([], ''),
+    ([0], '1'),
+    ([0, 1, 2, 3, 4, 7, 19, 20, 21], '1-5,8,20-22'),
+    ([1, 3, 5], '2,4,6'),
+    ([9, 10], '10-11'),
+])
+def test_format_page_ranges(pages, expected):
+    assert format_page_ranges(pages) == expected
+
+
+def test_format_parse_roundtrip():
+    pages = [0, 2, 3, 4, 9, 15, 16]
+    assert parse_page_ranges(format_page_ranges(pages), 20) == pages
+
+
+def make_pdf(path, n):
+    pdf = pikepdf.new()
+    for i in range(n):
+        pdf.add_blank_page(page_size=(100 + i, 100))
+    pdf.save(path)
+
+
+def page_widths(data):
+    with pikepdf.open(io.BytesIO(data)) as pdf:
+        return [int(page.mediabox[2]) for page in pdf.pages]
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def job(app_module, tmp_path):
+    """A 5-page job whose first two result pages are already published."""
+    output = str(tmp_path / 'doc_OCR.pdf')
+    part = str(tmp_path / 'part_00000.pdf')
+    make_pdf(part, 2)
+    app_module.jobs.create(
+        'job1',
+        status='processing',
+        filename='doc_OCR.pdf',
+        output_path=output,
+        output_format='pdf',
+        total_pages=5,
+        ready_pages=2,
+        page_parts=[[part, [0, 1], [0, 1]]],
+    )
+    yield output
+    app_module.jobs.delete('job1')
+
+
+def test_pages_unknown_job(client):
+    assert client.get('/pages/nope?pages=1').status_code == 404
+
+
+def test_pages_ready_while_processing(client, job):
+    resp = client.get('/pages/job1?pages=1-2')
+    assert resp.status_code == 200
+    assert resp.mimetype == 'application/pdf'
+    assert 'doc_OCR_p1-2.pdf' in resp.headers['Content-Disposition']
+    assert page_widths(resp.data) == [100, 101]
+
+
+def test_pages_not_ready_is_409(client, job):
+    resp = client.get('/pages/job1?pages=2-4')
+    assert resp.status_code == 409
+    assert resp.headers['Retry-After'] == '5'
+    assert resp.get_json() == {
+        'error': 'Las páginas pedidas aún no están listas',
+        'missing': '3-4',
+        'ready_pages': 2,
+    }
+
+
+def test_pages_error_job_is_409(app_module, client, job):
+    app_module.jobs.update('job1', status='error', error='OCR falló')
+    resp = client.get('/pages/job1?pages=1')
+    assert resp.status_code == 409
+    assert resp.get_json() == {'error': 'OCR falló'}
+
+
+def test_pages_completed(app_module, client, job):
+    make_pdf(job, 5)
+    app_module.jobs.update('job1', status='completed', page_parts=None, ready_pages=5)
+    resp = client.get('/pages/job1?pages=2,4-5')
+    assert resp.status_code == 200
+    assert page_widths(resp.data) == [101, 103, 104]
+    assert 'last_access' in app_module.jobs.get('job1')
+    # Without pages=, the whole result.
+    assert page_widths(client.get('/pages/job1').data) == [100, 101, 102, 103, 104]
+
+
+def test_pages_bad_requests(app_module, client, job):
+    assert client.get('/pages/job1?pages=4-2').status_code == 400
+    assert client.get('/pages/job1?pages=6').status_code == 400
+    assert client.get('/pages/job1?pages=1&format=docx').status_code == 400
+    app_module.jobs.update('job1', method='text')
+    assert client.get('/pages/job1?pages=1').status_code == 400
+
+
+def test_pages_use_uploaded_numbering(app_module, client, job):
+    # pages=3-5 of a 10-page upload: result pages 0-2 are uploaded pages 3-5.
+    app_module.jobs.update('job1', total_pages=3, source_pages=10, page_selection='3-5')
+    resp = client.get('/pages/job1?pages=1')
+    assert resp.status_code == 400
+    assert 'no forman parte del trabajo: 1' in resp.get_json()['error']
+    resp = client.get('/pages/job1?pages=3-4')
+    assert resp.status_code == 200
+    assert page_widths(resp.data) == [100, 101]
+    resp = client.get('/pages/job1?pages=5')
+    assert resp.status_code == 409
+    assert resp.get_json()['missing'] == '5'
@@ -0,0 +1,111 @@
+import os
+import time
+
+import pytest
+
+from job_store import MemoryJobStore
+from retention import sweep, touch
+
+TTL = 3600.0
+
+
+@pytest.fixture
+def folders(tmp_path):
+    uploads, outputs = tmp_path / 'uploads', tmp_path / 'outputs'
+    uploads.mkdir()
+    outputs.mkdir()
+    return uploads, outputs
+
+
+def make_file(path, age, now):
+    path.write_bytes(b'x')
+    os.utime(path, (now - age, now - age))
+    return str(path)
+
+
+def make_job(jobs, folders, job_id, status, age, now, **fields):
+    uploads, outputs = folders
+    jobs.create(job_id, status=status,
+                input_path=make_file(uploads / f'{job_id}.pdf', age, now),
+                output_path=make_file(outputs / f'{job_id}_OCR.pdf', age, now), **fields)
+
+
+def run(jobs, folders, now):
+    return sweep(jobs, [str(f) for f in folders], ttl=TTL, now=now)
+
+
+def test_expired_jobs_are_removed_recent_ones_kept(folders):
+    jobs, now = MemoryJobStore(), time.time()
+    make_job(jobs, folders, 'old', 'completed', 2 * TTL, now)
+    make_job(jobs, folders, 'failed', 'error', 2 * TTL, now)
+    make_job(jobs, folders, 'new', 'completed', 60, now)
+    # Old files, but downloaded a minute ago.
+    make_job(jobs, folders, 'touched', 'completed', 2 * TTL, now, last_access=now - 60)
+    assert run(jobs, folders, now) == 2
+    assert 'old' not in jobs and 'failed' not in jobs
+    assert 'new' in jobs and 'touched' in jobs
+    assert not os.path.exists(folders[0] / 'old.pdf')
+    assert not os.path.exists(folders[1] / 'old_OCR.pdf')
+    assert os.path.exists(folders[1] / 'touched_OCR.pdf')
+
+
+def test_touch_restarts_the_ttl(folders):
+    jobs, now = MemoryJobStore(), time.time()
+    make_job(jobs, folders, 'j', 'completed', 2 * TTL, now)
+    touch(jobs, 'j')
+    assert run(jobs, folders, now) == 0
+    assert run(jobs, folders, now + TTL + 1) == 1
+
+
+def test_finished_job_without_files_is_removed(folders):
+    jobs, now = MemoryJobStore(), time.time()
+    jobs.create('gone', status='completed', input_path=None, output_path=None)
+    assert run(jobs, folders, now) == 1
+    assert 'gone' not in jobs
+
+
+@pytest.mark.parametrize('status', ['queued', 'processing'])
+def test_unfinished_jobs_keep_old_uploads(folders, status):
+    jobs, now = MemoryJobStore(), time.time()
+    make_job(jobs, folders, 'busy', status, 2 * TTL, now)
+    parts = folders[1] / 'busy.parts'
+    parts.mkdir()
+    os.utime(parts, (now - 2 * TTL, now - 2 * TTL))
+    assert run(jobs, folders, now) == 0
+    assert jobs.get('busy')['status'] == status
+    assert os.path.exists(folders[0] / 'busy.pdf')
+    assert os.path.exists(folders[1] / 'busy_OCR.pdf')
+    assert parts.is_dir()
+
+
+def test_orphan_files_and_parts_dirs(folders):
+    jobs, now = MemoryJobStore(), time.time()
+    uploads, outputs = folders
+    make_file(uploads / 'stale.pdf', 2 * TTL, now)
+    make_file(uploads / 'fresh.pdf', 60, now)
+    old_parts = outputs / 'dead.parts'
+    old_parts.mkdir()
+    make_file(old_parts / 'part_0000.pdf', 2 * TTL, now)
+    os.utime(old_parts, (now - 2 * TTL, now - 2 * TTL))
+    new_parts = outputs / 'recent.parts'
+    new_parts.mkdir()
+    assert run(jobs, folders, now) == 0
+    assert sorted(os.listdir(uploads)) == ['fresh.pdf']
+    assert sorted(os.listdir(outputs)) == ['recent.parts']
+
+
+def test_missing_folder_is_ignored(folders, tmp_path):
+    jobs, now = MemoryJobStore(), time.time()
+    assert sweep(jobs, [str(tmp_path / 'nope')], ttl=TTL, now=now) == 0
+
+
+def test_batch_removed_only_after_all_its_jobs(folders):
+    jobs, now = MemoryJobStore(), time.time()
+    make_job(jobs, folders, 'a', 'completed', 2 * TTL, now)
+    make_job(jobs, folders, 'b', 'completed', 60, now)
+    jobs.create('batch', kind='batch', job_ids=['a', 'b'], created_at=now - 2 * TTL)
+    # Batch records never count as removed jobs.
+    assert run(jobs, folders, now) == 1
+    assert 'batch' in jobs and 'a' not in jobs
+    assert run(jobs, folders, now + TTL) == 1
+    assert 'b' not in jobs and 'batch' not in jobs
@@ -0,0 +1,203 @@
+import socket
+
+import pytest
+
+from job_store import MemoryJobStore
+from scheduler import JobScheduler, QueueFull, job_lane
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def noop(job_id):
+    pass
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def jobs():
+    return MemoryJobStore()
+
+
+def make_scheduler(jobs, clock, **kwargs):
+    params = dict(slots=1, max_queued=3, aging=1.0, interactive_slots=1)
+    params.update(kwargs)
+    sched = JobScheduler(jobs, clock=clock, **params)
+    # Sin hilos: los trabajos se sacan de la cola con _next en la prueba.
+    sched._ensure_threads = lambda: None
+    return sched
+
+
+def submit(sched, job_id, cost, lane='interactive'):
+    sched.jobs.create(job_id, status='queued', total_pages=cost, priority=lane)
+    return sched.submit(job_id, noop, (), cost=cost, lane=lane)
+
+
+def order(sched):
+    return [e.job_id for e in sched._ordered()]
+
+
+def test_queue_full_per_lane(jobs, clock):
+    sched = make_scheduler(jobs, clock, max_queued=2)
+    submit(sched, 'i1', 1)
+    submit(sched, 'i2', 1)
+    with pytest.raises(QueueFull):
+        submit(sched, 'i3', 1)
+    # El carril bulk tiene su propio tope.
+    submit(sched, 'b1', 1, lane='bulk')
+    submit(sched, 'b2', 1, lane='bulk')
+    with pytest.raises(QueueFull):
+        submit(sched, 'b3', 1, lane='bulk')
+    assert sched.stats()['queued_by_lane'] == {'interactive': 2, 'bulk': 2}
+    # Al salir uno de la cola vuelve a haber sitio.
+    sched._next(('interactive',))
+    submit(sched, 'i3', 1)
+
+
+def test_submit_many_checks_room_for_every_lane(jobs, clock):
+    sched = make_scheduler(jobs, clock, max_queued=1)
+    submit(sched, 'b1', 1, lane='bulk')
+    for job_id in ('i1', 'b2'):
+        jobs.create(job_id, status='queued')
+    with pytest.raises(QueueFull):
+        sched.submit_many([('i1', noop, (), 1, 'interactive'), ('b2', noop, (), 1, 'bulk')])
+    assert order(sched) == ['b1']
+    # Con sitio, el lote entra entero aunque supere el tope.
+    sched._next(('bulk',))
+    sched.submit_many([('b2', noop, (), 1, 'bulk'), ('b3', noop, (), 1, 'bulk')])
+    assert sched.stats()['queued_by_lane']['bulk'] == 2
+
+
+def test_smallest_first(jobs, clock):
+    sched = make_scheduler(jobs, clock, max_queued=10)
+    submit(sched, 'big', 100)
+    submit(sched, 'small', 5)
+    submit(sched, 'medium', 20)
+    submit(sched, 'small2', 5)
+    # A igual coste, el orden de llegada.
+    assert order(sched) == ['small', 'small2', 'medium', 'big']
+
+
+def test_aging_credit(jobs, clock):
+    sched = make_scheduler(jobs, clock, max_queued=10, aging=2.0)
+    submit(sched, 'big', 100)
+    clock.now += 30
+    submit(sched, 'small', 50)
+    # big: 100 - 2*30 = 40 < 50.
+    assert order(sched) == ['big', 'small']
+    submit(sched, 'tiny', 30)
+    assert order(sched) == ['tiny', 'big', 'small']
+    clock.now += 10
+    # tiny: 30 - 2*10 = 10, big: 100 - 2*40 = 20, small: 50 - 2*10 = 30.
+    assert order(sched) == ['tiny', 'big', 'small']
+
+
+def test_aging_zero_is_pure_cost(jobs, clock):
+    sched = make_scheduler(jobs, clock, max_queued=10, aging=0.0)
+    submit(sched, 'big', 100)
+    clock.now += 10 ** 6
+    submit(sched, 'small', 1)
+    assert order(sched) == ['small', 'big']
+
+
+def test_queue_position_bookkeeping(jobs, clock):
+    sched = make_scheduler(jobs, clock, max_queued=10)
+    assert submit(sched, 'a', 10) == 1
+    assert submit(sched, 'b', 20) == 2
+    assert submit(sched, 'c', 5) == 1
+    assert [sched.queue_position(j) for j in ('c', 'a', 'b')] == [1, 2, 3]
+    assert [jobs.get(j)['queue_position'] for j in ('c', 'a', 'b')] == [1, 2, 3]
+    assert jobs.get('b')['message'] == 'En cola (posición 3)...'
+    assert jobs.get('a')['owner'] == sched.token
+
+    clock.now += 4
+    entry = sched._next(('interactive',))
+    assert entry.job_id == 'c'
+    assert sched.queue_position('c') is None
+    assert jobs.get('c')['queue_position'] == 0
+    assert jobs.get('c')['queue_wait_seconds'] == 4
+    assert [jobs.get(j)['queue_position'] for j in ('a', 'b')] == [1, 2]
+    assert sched.stats()['running'] == 1
+    assert sched.queue_position('missing') is None
+
+
+def test_interactive_lane_first(jobs, clock):
+    sched = make_scheduler(jobs, clock, max_queued=10)
+    submit(sched, 'bulk-small', 1, lane='bulk')
+    clock.now += 1000
+    submit(sched, 'interactive-big', 500)
+    # El carril interactivo va siempre delante, pese al coste y la espera.
+    assert order(sched) == ['interactive-big', 'bulk-small']
+
+
+def test_interactive_threads_skip_bulk(jobs, clock):
+    sched = make_scheduler(jobs, clock, max_queued=10)
+    submit(sched, 'b', 1, lane='bulk')
+    submit(sched, 'i', 50)
+    assert sched._next(('interactive',)).job_id == 'i'
+    # Los hilos comunes atienden ambos carriles.
+    assert sched._next(('interactive', 'bulk')).job_id == 'b'
+    assert sched.stats()['queued'] == 0
+
+
+def test_job_lane():
+    assert job_lane(None, 10) == 'interactive'
+    assert job_lane(' Bulk ', 10) == 'bulk'
+    assert job_lane('interactive', 10 ** 6) == 'bulk'
+    with pytest.raises(ValueError):
+        job_lane('urgent', 1)
+
+
+def dead_token():
+    # Un pid que no existe en esta máquina.
+    return f"{socket.gethostname()}:999999999:1"
+
+
+def test_recover_requeues_orphans(jobs, clock):
+    sched = make_scheduler(jobs, clock, max_queued=10)
+    dead = dead_token()
+    jobs.create('orphan', status='processing', owner=dead, total_pages=7, priority='bulk', path='x.pdf')
+    jobs.create('done', status='completed', owner=dead)
+    jobs.create('remote', status='queued', owner='other-host:1:1')
+    jobs.create('mine', status='queued', owner=sched.token)
+    jobs.create('unowned', status='queued')
+
+    recovered = sched.recover(noop, lambda data: (data['path'],))
+    assert recovered == ['orphan']
+    data = jobs.get('orphan')
+    assert data['owner'] == sched.token
+    assert data['status'] == 'queued'
+    assert data['queue_position'] == 1
+    entry = sched._next(('bulk',))
+    assert (entry.job_id, entry.args, entry.cost, entry.lane) == ('orphan', ('x.pdf',), 7, 'bulk')
+    assert jobs.get('done')['owner'] == dead
+    assert jobs.get('remote')['owner'] == 'other-host:1:1'
+
+
+def test_recover_claims_once(jobs, clock):
+    first = make_scheduler(jobs, clock)
+    second = make_scheduler(jobs, clock)
+    second.token = 'localhost-other:2:2'
+    jobs.create('orphan', status='queued', owner=dead_token())
+    assert first.recover(noop, lambda data: ()) == ['orphan']
+    # El dueño es ahora un proceso vivo.
+    assert second.recover(noop, lambda data: ()) == []
+
+
+def test_recover_marks_error_when_queue_full(jobs, clock):
+    sched = make_scheduler(jobs, clock, max_queued=1)
+    submit(sched, 'busy', 1)
+    jobs.create('orphan', status='queued', owner=dead_token())
+    assert sched.recover(noop, lambda data: ()) == []
+    data = jobs.get('orphan')
+    assert data['status'] == 'error'
+    assert data['message'].startswith('No se pudo reanudar el trabajo')
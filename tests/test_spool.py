@@ -0,0 +1,137 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from job_store import MemoryJobStore
+from ocr_worker import OCRWorker
+from scheduler import QueueFull, process_token
+from spool import Spool, requeue_stale_jobs
+
+LOCAL_DEAD = f"{socket.gethostname()}:999999999:1"
+REMOTE = 'other-host:1234:1'
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return Spool(str(tmp_path / 'spool.sqlite3'), aging=1.0)
+
+
+def set_column(spool, job_id, **values):
+    for column, value in values.items():
+        spool._conn().execute(f'UPDATE spool SET {column} = ? WHERE job_id = ?', (value, job_id))
+
+
+def claim_all(spool, token='t', lanes=('interactive', 'bulk')):
+    claimed = []
+    while True:
+        entry = spool.claim(token, lanes)
+        if entry is None:
+            return claimed
+        claimed.append(entry.job_id)
+
+
+def test_claim_order_lane_then_cost(spool):
+    spool.enqueue([('bulk-small', 'bulk', 1), ('big', 'interactive', 50),
+                   ('small', 'interactive', 5)], max_queued=10)
+    assert spool.waiting() == ['small', 'big', 'bulk-small']
+    assert claim_all(spool) == ['small', 'big', 'bulk-small']
+
+
+def test_aging_lets_old_expensive_jobs_through(spool):
+    spool.enqueue([('old', 'interactive', 100), ('new', 'interactive', 10)], max_queued=10)
+    set_column(spool, 'old', enqueued_at=time.time() - 200)
+    entry = spool.claim('t')
+    assert entry.job_id == 'old' and entry.lane == 'interactive' and entry.cost == 100
+
+
+def test_claim_respects_lanes(spool):
+    spool.enqueue([('i', 'interactive', 1), ('b', 'bulk', 1)], max_queued=10)
+    assert spool.claim('t', ['bulk']).job_id == 'b'
+    assert spool.claim('t', ['bulk']) is None
+    assert spool.claim('t', ['interactive']).job_id == 'i'
+
+
+def test_concurrent_claims_are_atomic(spool):
+    spool.enqueue([(f'j{n}', 'bulk', n) for n in range(40)], max_queued=100)
+    results = {}
+
+    def worker(name):
+        results[name] = claim_all(spool, token=name)
+
+    threads = [threading.Thread(target=worker, args=(f'w{n}',)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    claimed = [job_id for ids in results.values() for job_id in ids]
+    assert sorted(claimed) == sorted(f'j{n}' for n in range(40))
+
+
+def test_queue_full_is_per_lane(spool):
+    spool.enqueue([('i1', 'interactive', 1), ('i2', 'interactive', 1)], max_queued=2)
+    with pytest.raises(QueueFull):
+        spool.enqueue([('i3', 'interactive', 1)], max_queued=2)
+    # A full interactive lane does not block bulk jobs...
+    spool.enqueue([('b1', 'bulk', 1)], max_queued=2)
+    # ...and a rejected batch inserts nothing.
+    with pytest.raises(QueueFull):
+        spool.enqueue([('b2', 'bulk', 1), ('i4', 'interactive', 1)], max_queued=2)
+    assert sorted(spool.waiting()) == ['b1', 'i1', 'i2']
+    # Claimed jobs no longer count as waiting.
+    spool.claim('t', ['interactive'])
+    spool.enqueue([('i3', 'interactive', 1)], max_queued=2)
+    assert spool.stats()['queued_by_lane'] == {'interactive': 2, 'bulk': 1}
+
+
+def test_requeue_stale(spool):
+    spool.enqueue([('dead', 'bulk', 1), ('remote-stale', 'bulk', 1),
+                   ('remote-live', 'bulk', 1), ('live', 'bulk', 1)], max_queued=10)
+    spool.claim(LOCAL_DEAD)
+    spool.claim(REMOTE)
+    spool.claim(REMOTE)
+    spool.claim(process_token())
+    set_column(spool, 'remote-stale', heartbeat=time.time() - 600)
+    # A dead local process is requeued at once; a remote one only once its
+    # heartbeat is older than stale_after.
+    assert sorted(spool.requeue_stale(120)) == ['dead', 'remote-stale']
+    assert sorted(spool.waiting()) == ['dead', 'remote-stale']
+    assert spool.stats()['running'] == 2
+
+
+def test_requeue_stale_jobs_marks_records_queued(spool):
+    jobs = MemoryJobStore()
+    jobs.create('dead', status='processing')
+    spool.enqueue([('dead', 'bulk', 1)], max_queued=10)
+    spool.claim(LOCAL_DEAD)
+    assert requeue_stale_jobs(spool, jobs) == ['dead']
+    job = jobs.get('dead')
+    assert job['status'] == 'queued' and job['queue_position'] == 1
+
+
+@pytest.mark.parametrize('status', [None, 'completed', 'error'])
+def test_run_one_skips_deleted_or_finished_jobs(spool, status):
+    jobs = MemoryJobStore()
+    if status is not None:
+        jobs.create('j', status=status, input_path='in.pdf', output_path='out.pdf')
+    calls = []
+    worker = OCRWorker(spool, jobs, lambda *args: calls.append(args))
+    spool.enqueue([('j', 'bulk', 1)], max_queued=10)
+    worker.run_one(spool.claim(worker.token))
+    assert calls == []
+    assert spool.stats() == {'queued': 0, 'queued_by_lane': {'interactive': 0, 'bulk': 0}, 'running': 0}
+    if status is not None:
+        assert 'owner' not in jobs.get('j')
+
+
+def test_run_one_processes_queued_job(spool):
+    jobs = MemoryJobStore()
+    jobs.create('j', status='queued', input_path='in.pdf', output_path='out.pdf')
+    calls = []
+    worker = OCRWorker(spool, jobs, lambda *args: calls.append(args))
+    spool.enqueue([('j', 'bulk', 1)], max_queued=10)
+    worker.run_one(spool.claim(worker.token))
+    assert calls == [('j', 'in.pdf', 'out.pdf')]
+    assert jobs.get('j')['owner'] == worker.token
+    assert spool.stats()['running'] == 0
@@ -0,0 +1,42 @@
+import pytest
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def text_job(app_module, tmp_path):
+    output = tmp_path / 'doc.txt'
+    app_module.jobs.create('t-job', status='queued', progress=0, output_format='text',
+                           output_path=str(output), queue_position=2)
+    yield output
+    app_module.jobs.delete('t-job')
+
+
+def test_text_not_started_is_409(app_module, client, text_job):
+    resp = client.get('/text/t-job')
+    assert resp.status_code == 409
+    assert resp.headers['Retry-After'] == '5'
+    assert resp.get_json()['queue_position'] == 2
+    # Waiting for cores: processing, but no output yet.
+    app_module.jobs.update('t-job', status='processing')
+    assert client.get('/text/t-job').status_code == 409
+    # A queued job (e.g. resumed) does not stream a stale file.
+    text_job.write_text('old')
+    app_module.jobs.update('t-job', status='queued')
+    assert client.get('/text/t-job').status_code == 409
+
+
+def test_text_streams_once_pages_are_written(app_module, client, text_job):
+    text_job.write_text('página 1\n\f')
+    app_module.jobs.update('t-job', status='completed')
+    resp = client.get('/text/t-job')
+    assert resp.status_code == 200
+    assert resp.get_data(as_text=True) == 'página 1\n\f'
+
+
+def test_text_of_a_pdf_job(app_module, client, text_job):
+    app_module.jobs.update('t-job', output_format='pdf')
+    assert client.get('/text/t-job').status_code == 400
@@ -0,0 +1,253 @@
+"""Salida solo de texto: texto por página (y, opcionalmente, cajas de palabras).
+
+Para quien solo necesita el texto reconocido no hace falta el PDF
+buscable: no se rehace la capa de texto, no se optimiza ni se unen
+fragmentos.  Las páginas que ya tienen capa de texto se leen con
+``pdftotext``; el resto se rasteriza con ``pdftoppm`` y se reconoce con
+``tesseract`` (salida TSV, que trae también la caja y la confianza de cada
+palabra).  Las coordenadas se dan en puntos PDF con origen arriba a la
+izquierda, igual para los dos orígenes.
+
+``extract_pages`` reconoce varias páginas en paralelo y las entrega en
+orden según van estando listas, de modo que la salida se puede escribir
+(y servir) página a página.  ``text_layer_blocks`` es la vía rápida para
+PDFs que ya tienen texto en todas las páginas: ``pdftotext`` por bloques
+de páginas en paralelo.
+"""
+from __future__ import annotations
+
+import os
+import re
+import csv
+import html
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from memory_budget import memory_limited
+from preprocess import denoise_file
+
+# Formatos de salida: extensión del archivo y tipo MIME.
+TEXT_FORMATS = {
+    'text': ('txt', 'text/plain; charset=utf-8'),
+    'json': ('jsonl', 'application/x-ndjson'),
+}
+
+_PAGE_RE = re.compile(r'<page width="([\d.]+)" height="([\d.]+)">')
+_WORD_RE = re.compile(
+    r'<word xMin="([\d.]+)" yMin="([\d.]+)" xMax="([\d.]+)" yMax="([\d.]+)">(.*?)</word>'
+)
+
+
+@dataclass
+class PageText:
+    page: int                  # página del documento (desde 0)
+    source: str                # 'text_layer' u 'ocr'
+    text: str
+    words: Optional[List[Dict[str, Any]]] = None
+    width: float = 0.0         # tamaño de la página en puntos
+    height: float = 0.0
+    seconds: float = 0.0
+
+
+def _run(cmd: List[str], timeout: float, env: Optional[Dict[str, str]] = None) -> str:
+    try:
+        result = subprocess.run(memory_limited(cmd), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                text=True, timeout=timeout, env=env)
+    except FileNotFoundError:
+        raise RuntimeError(f'{cmd[0]} no está instalado')
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f'{cmd[0]} superó el tiempo límite de {int(timeout)} s')
+    if result.returncode != 0:
+        tail = (result.stderr or '').strip().splitlines()[-5:]
+        raise RuntimeError(f'{cmd[0]} falló: ' + ' '.join(tail))
+    return result.stdout
+
+
+def text_layer_page(pdf_path: str, page: int, boxes: bool = False,
+                    timeout: float = 60) -> PageText:
+    """Texto de una página que ya tiene capa de texto."""
+    n = str(page + 1)
+    text = _run(['pdftotext', '-layout', '-enc', 'UTF-8', '-f', n, '-l', n, pdf_path, '-'], timeout)
+    result = PageText(page, 'text_layer', text.rstrip('\f').rstrip())
+    if boxes:
+        markup = _run(['pdftotext', '-bbox', '-enc', 'UTF-8', '-f', n, '-l', n, pdf_path, '-'], timeout)
+        size = _PAGE_RE.search(markup)
+        if size:
+            result.width, result.height = float(size.group(1)), float(size.group(2))
+        result.words = [
+            {'text': html.unescape(w[4]), 'bbox': [round(float(v), 2) for v in w[:4]]}
+            for w in _WORD_RE.findall(markup)
+        ]
+    return result
+
+
+def _parse_tsv(tsv: str, scale: float) -> Tuple[str, List[Dict[str, Any]], Tuple[float, float]]:
+    """Texto (líneas y párrafos de tesseract), palabras y tamaño de la página."""
+    size = (0.0, 0.0)
+    words: List[Dict[str, Any]] = []
+    lines: List[str] = []
+    current: List[str] = []
+    line_key = par_key = None
+    for row in csv.DictReader(tsv.splitlines(), delimiter='\t', quoting=csv.QUOTE_NONE):
+        if row.get('level') == '1':
+            size = (round(int(row['width']) * scale, 2), round(int(row['height']) * scale, 2))
+        if row.get('level') != '5' or not (row.get('text') or '').strip():
+            continue
+        key = (row['block_num'], row['par_num'], row['line_num'])
+        if key != line_key:
+            if current:
+                lines.append(' '.join(current))
+            if par_key is not None and key[:2] != par_key:
+                lines.append('')
+            current, line_key, par_key = [], key, key[:2]
+        current.append(row['text'])
+        left, top = int(row['left']), int(row['top'])
+        right, bottom = left + int(row['width']), top + int(row['height'])
+        words.append({
+            'text': row['text'],
+            'bbox': [round(v * scale, 2) for v in (left, top, right, bottom)],
+            'conf': round(float(row['conf']), 1),
+        })
+    if current:
+        lines.append(' '.join(current))
+    return '\n'.join(lines), words, size
+
+
+def ocr_page(pdf_path: str, page: int, lang: str, dpi: int = 300, boxes: bool = False,
+             timeout: float = 300, work_dir: Optional[str] = None,
+             denoise_above: Optional[float] = None) -> PageText:
+    """Rasteriza la página ``page`` y la reconoce con tesseract.
+
+    Con ``denoise_above`` la imagen se limpia antes si tiene demasiadas
+    motas (ver preprocess.py).
+    """
+    tmpdir = tempfile.mkdtemp(prefix='ocr_text_', dir=work_dir)
+    try:
+        n = str(page + 1)
+        prefix = os.path.join(tmpdir, 'page')
+        _run(['pdftoppm', '-r', str(dpi), '-gray', '-png', '-singlefile',
+              '-f', n, '-l', n, pdf_path, prefix], timeout)
+        if denoise_above is not None:
+            denoise_file(prefix + '.png', denoise_above)
+        # Una página por hilo: tesseract no debe abrir a su vez varios hilos.
+        env = dict(os.environ, OMP_THREAD_LIMIT='1')
+        tsv = _run(['tesseract', prefix + '.png', 'stdout', '-l', lang, 'tsv'], timeout, env=env)
+        text, words, (width, height) = _parse_tsv(tsv, 72.0 / dpi)
+        return PageText(page, 'ocr', text, words if boxes else None, width, height)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def _in_order(func: Callable[[Any], Any], items: Sequence[Any], workers: int) -> Iterator[Any]:
+    """``func(item)`` con ``workers`` hilos; resultados en el orden de ``items``.
+
+    Hay como mucho ``2 * workers`` elementos en curso; cada resultado se
+    entrega en cuanto están listos él y todos los anteriores.
+    """
+    workers = max(1, workers)
+    pool = ThreadPoolExecutor(max_workers=workers)
+    pending: Deque[Future] = deque()
+    remaining = iter(items)
+    try:
+        for item in remaining:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            result = pending.popleft().result()
+            item = next(remaining, None)
+            if item is not None:
+                pending.append(pool.submit(func, item))
+            yield result
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def extract_pages(pdf_path: str, pages: Sequence[int], ocr_pages: Sequence[int], lang: str,
+                  workers: int, boxes: bool = False, dpi: int = 300,
+                  timeout: float = 300, denoise_above: Optional[float] = None) -> Iterator[PageText]:
+    """Texto de ``pages`` en orden; las de ``ocr_pages`` pasan por tesseract.
+
+    Se procesan ``workers`` páginas a la vez y se entregan en orden.
+    """
+    ocr_set = set(ocr_pages)
+
+    def one(page: int) -> PageText:
+        start = time.perf_counter()
+        if page in ocr_set:
+            result = ocr_page(pdf_path, page, lang, dpi=dpi, boxes=boxes, timeout=timeout,
+                              denoise_above=denoise_above)
+        else:
+            result = text_layer_page(pdf_path, page, boxes=boxes, timeout=timeout)
+        result.seconds = time.perf_counter() - start
+        return result
+
+    return _in_order(one, pages, workers)
+
+
+def text_layer_blocks(pdf_path: str, total_pages: int, workers: int, block: int = 25,
+                      timeout: float = 300) -> Iterator[PageText]:
+    """Texto con maquetación de todas las páginas de un PDF con capa de texto.
+
+    En lugar de un ``pdftotext`` por página se lanza uno por cada bloque
+    de ``block`` páginas (``workers`` a la vez) y su salida se separa por
+    los saltos de página; las páginas se entregan en orden.
+    """
+    def one(first: int) -> List[PageText]:
+        start = time.perf_counter()
+        last = min(first + block, total_pages)
+        out = _run(['pdftotext', '-layout', '-enc', 'UTF-8', '-f', str(first + 1), '-l', str(last),
+                    pdf_path, '-'], timeout)
+        texts = out.split('\f')
+        seconds = (time.perf_counter() - start) / (last - first)
+        return [PageText(page, 'text_layer', texts[page - first].rstrip() if page - first < len(texts) else '',
+                         seconds=seconds)
+                for page in range(first, last)]
+
+    for pages in _in_order(one, range(0, total_pages, max(1, block)), workers):
+        yield from pages
+
+
+def format_page(result: PageText, fmt: str) -> str:
+    """Registro de una página en el formato de salida ``fmt``."""
+    if fmt == 'json':
+        record: Dict[str, Any] = {
+            'page': result.page + 1,
+            'source': result.source,
+            'text': result.text,
+        }
+        if result.width:
+            record['width'] = result.width
+            record['height'] = result.height
+        if result.words is not None:
+            record['words'] = result.words
+        return json.dumps(record, ensure_ascii=False) + '\n'
+    # Texto plano: una página tras otra separadas por salto de página,
+    # como pdftotext.
+    return result.text + '\n\f'
+
+
+def follow_file(path: str, finished: Callable[[], bool], poll: float = 0.5,
+                block_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Contenido de ``path`` según crece, hasta que ``finished()`` y se llega al final."""
+    while not os.path.exists(path):
+        if finished():
+            return
+        time.sleep(poll)
+    with open(path, 'rb') as f:
+        while True:
+            done = finished()
+            block = f.read(block_size)
+            if block:
+                yield block
+                continue
+            if done:
+                return
+            time.sleep(poll)
@@ -0,0 +1,124 @@
+"""PDF de texto escrito página a página, sin reportlab.
+
+``process_pdf_with_text`` convierte un PDF que ya tiene capa de texto en
+un PDF sencillo con ese texto.  Antes se hacía con reportlab, que guarda
+todo el documento en memoria hasta ``save()``; aquí cada página se escribe
+en el archivo en cuanto se añade, y al cerrar solo quedan el árbol de
+páginas, la fuente y la tabla xref.
+
+El texto viene de ``pdftotext -layout`` (columnas alineadas con espacios),
+así que se compone en Courier: con una fuente de ancho fijo la maquetación
+se conserva.  Si la línea más larga de una página no cabe, se reduce el
+cuerpo de letra hasta MIN_FONT_SIZE y solo a partir de ahí se parten las
+líneas (por el último espacio, sin trocear palabra a palabra).  El texto
+que no cabe en una página continúa en la siguiente.
+"""
+from __future__ import annotations
+
+import zlib
+from typing import IO, Dict, Iterator, List, Tuple
+
+A4 = (595.28, 841.89)
+MARGIN = 40.0
+FONT_SIZE = 9.0
+MIN_FONT_SIZE = 6.0
+CHAR_WIDTH = 0.6   # ancho de un carácter de Courier, en cuerpos de letra
+LEADING = 1.2      # interlineado, en cuerpos de letra
+
+
+def wrap_line(line: str, width: int) -> Iterator[str]:
+    """Trozos de ``line`` de como mucho ``width`` caracteres, cortando en espacios."""
+    line = line.rstrip()
+    if len(line) <= width:
+        yield line
+        return
+    start, end = 0, len(line)
+    while start < end:
+        if end - start <= width:
+            yield line[start:]
+            return
+        cut = line.rfind(' ', start + 1, start + width + 1)
+        if cut <= start:
+            cut = start + width
+        yield line[start:cut].rstrip()
+        start = cut
+        while start < end and line[start] == ' ':
+            start += 1
+
+
+def _escape(text: str) -> bytes:
+    data = text.encode('cp1252', errors='replace')
+    return data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+class TextPDFWriter:
+    """Escribe un PDF de texto en ``path`` a medida que se añaden páginas."""
+
+    # Objetos fijos; las páginas empiezan en el 4.
+    _CATALOG, _PAGES, _FONT = 1, 2, 3
+
+    def __init__(self, path: str, page_size: Tuple[float, float] = A4) -> None:
+        self.width, self.height = page_size
+        self._file: IO[bytes] = open(path, 'wb')
+        self._offsets: Dict[int, int] = {}
+        self._pages: List[int] = []
+        self._next = 4
+        self._file.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def _object(self, number: int, body: bytes) -> None:
+        self._offsets[number] = self._file.tell()
+        self._file.write(b'%d 0 obj\n' % number + body + b'\nendobj\n')
+
+    def _write_page(self, lines: List[str], size: float) -> None:
+        leading = size * LEADING
+        parts = [b'BT /F1 %.2f Tf %.2f TL %.2f %.2f Td' % (size, leading, MARGIN, self.height - MARGIN - size)]
+        parts.extend(b'(' + _escape(line) + b') Tj T*' for line in lines)
+        parts.append(b'ET')
+        stream = zlib.compress(b'\n'.join(parts))
+        content, page = self._next, self._next + 1
+        self._next += 2
+        self._object(content, b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(stream)
+                     + stream + b'\nendstream')
+        self._object(page, b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %.2f %.2f] '
+                     b'/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>'
+                     % (self._PAGES, self.width, self.height, self._FONT, content))
+        self._pages.append(page)
+
+    def add_page(self, text: str) -> int:
+        """Añade el texto de una página; devuelve cuántas páginas de salida ocupa."""
+        usable = self.width - 2 * MARGIN
+        longest = max((len(line.rstrip()) for line in text.splitlines()), default=0)
+        size = FONT_SIZE
+        if longest:
+            size = max(MIN_FONT_SIZE, min(FONT_SIZE, usable / (CHAR_WIDTH * longest)))
+        width = max(1, int(usable / (CHAR_WIDTH * size)))
+        per_page = max(1, int((self.height - 2 * MARGIN) / (size * LEADING)))
+        lines = [piece for line in text.splitlines() for piece in wrap_line(line, width)]
+        written = 0
+        for start in range(0, max(1, len(lines)), per_page):
+            self._write_page(lines[start:start + per_page], size)
+            written += 1
+        self._file.flush()
+        return written
+
+    def close(self) -> None:
+        if self._file.closed:
+            return
+        self._object(self._FONT, b'<< /Type /Font /Subtype /Type1 /BaseFont /Courier '
+                     b'/Encoding /WinAnsiEncoding >>')
+        kids = b' '.join(b'%d 0 R' % n for n in self._pages)
+        self._object(self._PAGES, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(self._pages)))
+        self._object(self._CATALOG, b'<< /Type /Catalog /Pages %d 0 R >>' % self._PAGES)
+        xref = self._file.tell()
+        self._file.write(b'xref\n0 %d\n0000000000 65535 f \n' % self._next)
+        for number in range(1, self._next):
+            self._file.write(b'%010d 00000 n \n' % self._offsets[number])
+        self._file.write(b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+                         % (self._next, self._CATALOG, xref))
+        self._file.close()
+
+    def __enter__(self) -> 'TextPDFWriter':
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
@@ -0,0 +1,126 @@
+"""Recepción de subidas en streaming.
+
+Werkzeug pide un archivo de destino a ``Request._get_file_stream`` y va
+escribiendo en él el cuerpo multipart por bloques.  ``PDFUpload`` es ese
+destino: escribe directamente en UPLOAD_FOLDER (sin copia intermedia en un
+SpooledTemporaryFile), calcula el SHA-256 sobre la marcha y comprueba la
+cabecera ``%PDF-`` con el primer bloque, de modo que un archivo que no es
+PDF se rechaza sin recibirlo entero (se admiten también ZIP, que /batch
+desempaqueta).  Con el hash listo al terminar la
+subida, la búsqueda en caché y el recuento de páginas se hacen en la misma
+petición.
+"""
+from __future__ import annotations
+
+import os
+import hashlib
+import tempfile
+from typing import IO, Optional
+
+from flask import Request, current_app
+
+PDF_HEADER = b'%PDF-'
+ZIP_HEADER = b'PK\x03\x04'
+
+
+class UploadRejected(Exception):
+    """El contenido subido no es aceptable (p. ej. no es un PDF).
+
+    No hereda de ValueError: el analizador de formularios de werkzeug
+    silencia esas excepciones y la subida parecería simplemente vacía.
+    """
+
+
+class PDFUpload:
+    def __init__(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=directory, suffix='.upload')
+        self._file: IO[bytes] = os.fdopen(fd, 'w+b')
+        self._hash = hashlib.sha256()
+        self._head = b''
+        self._saved = False
+        self.size = 0
+
+    # -- interfaz de archivo que usa werkzeug ----------------------------
+    def write(self, data: bytes) -> int:
+        if len(self._head) < len(PDF_HEADER):
+            self._head += bytes(data[:len(PDF_HEADER) - len(self._head)])
+            if not (PDF_HEADER.startswith(self._head) or self._head.startswith(ZIP_HEADER)
+                    or ZIP_HEADER.startswith(self._head)):
+                self.discard()
+                raise UploadRejected('El archivo subido no parece un PDF válido')
+        self._hash.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+    def readline(self, size: int = -1) -> bytes:
+        return self._file.readline(size)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        # Flask cierra los archivos de la petición al terminar: lo que no se
+        # guardó con ``save_as`` se borra.
+        self._file.close()
+        if not self._saved:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    # -- resultado -------------------------------------------------------
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+    @property
+    def is_pdf(self) -> bool:
+        return self._head == PDF_HEADER
+
+    @property
+    def is_zip(self) -> bool:
+        return self._head.startswith(ZIP_HEADER)
+
+    @classmethod
+    def from_fileobj(cls, src: IO[bytes], directory: str) -> 'PDFUpload':
+        """Recibe el contenido de ``src`` (p. ej. un miembro de un ZIP)."""
+        upload = cls(directory)
+        try:
+            for block in iter(lambda: src.read(1024 * 1024), b''):
+                upload.write(block)
+        except BaseException:
+            upload.discard()
+            raise
+        return upload
+
+    def save_as(self, path: str) -> None:
+        """Mueve el archivo recibido a ``path`` (mismo sistema de archivos)."""
+        if not self.is_pdf:
+            self.discard()
+            raise UploadRejected('El archivo subido no parece un PDF válido')
+        self._file.close()
+        os.replace(self.path, path)
+        self.path = path
+        self._saved = True
+
+    def discard(self) -> None:
+        self._saved = False
+        self.close()
+
+
+class PDFUploadRequest(Request):
+    """Request de Flask cuyas subidas van directamente a UPLOAD_FOLDER."""
+
+    def _get_file_stream(self, total_content_length: Optional[int], content_type: Optional[str],
+                         filename: Optional[str] = None, content_length: Optional[int] = None):
+        return PDFUpload(current_app.config['UPLOAD_FOLDER'])